@@ -0,0 +1,129 @@
+"""
+Donut encoder giriş çözünürlüklerini karşılaştıran araç.
+
+Örnek crop'lar her çözünürlükte ve uyarlamalı modda (her crop için
+donut_ocr.select_resolution) işlenir; gecikme ile çıktı alanlarının referans
+çözünürlükteki (listedeki en büyük boyut, varsayılan 960x1280) çıktıyla uyumu raporlanır.
+
+Kullanım:
+    python benchmark_donut_resolution.py --images cropped --resolutions 640x640 640x960 960x1280
+    python benchmark_donut_resolution.py --images test_images --detect
+
+--detect verilirse klasördeki görüntüler önce YOLO ile tespit edilip kırpılır ve
+ölçüm crop'lar üzerinde yapılır.
+"""
+import argparse
+import json
+import logging
+import statistics
+import time
+from pathlib import Path
+
+from PIL import Image
+
+import donut_ocr
+from compare_donut_precision import IMAGE_EXTENSIONS, field_agreement, flatten_fields
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger("benchmark_donut_resolution")
+
+
+def load_crops(images_dir, detect=False):
+    """(isim, görüntü) listesi; detect açıksa görüntülerdeki faturaların crop'ları"""
+    paths = sorted(p for p in Path(images_dir).glob("*") if p.suffix.lower() in IMAGE_EXTENSIONS)
+    if not detect:
+        return [(p.name, Image.open(p).convert("RGB")) for p in paths]
+
+    from invoice_processor import InvoiceProcessor
+    processor = InvoiceProcessor()
+    crops = []
+    for crop_list, _ in processor.crop_invoices_from_imgs([str(p) for p in paths], [p.name for p in paths]):
+        crops.extend(crop_list)
+    return crops
+
+
+def decode(out_ids):
+    tokenizer = donut_ocr.get_processor().tokenizer
+    sequence = tokenizer.batch_decode(out_ids)[0]
+    sequence = sequence.replace(tokenizer.eos_token, "").replace(tokenizer.pad_token, "")
+    sequence = sequence.replace(donut_ocr.TASK_TOKEN, "", 1).strip()
+    return {
+        "text": tokenizer.batch_decode(out_ids, skip_special_tokens=True)[0].strip(),
+        "fields": flatten_fields(donut_ocr.get_processor().token2json(sequence)),
+    }
+
+
+def run_mode(crops, choose_resolution, runs, max_len):
+    """Her crop'u choose_resolution(crop) boyutunda işle; (gecikmeler, çıktılar, çözünürlükler) döner"""
+    latencies, outputs, used = {}, {}, {}
+    for name, image in crops:
+        resolution = choose_resolution(image)
+        times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            out_ids, _ = donut_ocr.generate_ids([image], max_len=max_len, resolution=resolution)
+            times.append(time.perf_counter() - start)
+        latencies[name] = statistics.median(times)
+        outputs[name] = decode(out_ids)
+        used[name] = f"{resolution[0]}x{resolution[1]}"
+    return latencies, outputs, used
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Donut giriş çözünürlüğü karşılaştırması")
+    parser.add_argument("--images", default="test_images", help="Crop veya görüntü klasörü")
+    parser.add_argument("--detect", action="store_true", help="Görüntüleri önce YOLO ile kırp")
+    parser.add_argument("--resolutions", nargs="+",
+                        default=[f"{w}x{h}" for w, h in donut_ocr.RESOLUTIONS],
+                        help="GENİŞLİKxYÜKSEKLİK biçiminde çözünürlükler")
+    parser.add_argument("--runs", type=int, default=3, help="Crop başına ölçüm tekrarı")
+    parser.add_argument("--max-len", type=int, default=512)
+    parser.add_argument("--output", help="Raporun yazılacağı JSON dosyası")
+    args = parser.parse_args()
+
+    resolutions = donut_ocr.parse_resolutions(",".join(args.resolutions))
+    crops = load_crops(args.images, args.detect)
+    if not crops:
+        logger.error(f"No images found in {args.images}")
+        return
+
+    # Isınma: ilk çağrının model yükleme ve kernel hazırlığı ölçüme girmesin
+    donut_ocr.generate_ids([crops[0][1]], max_len=8, resolution=resolutions[-1])
+
+    # Referans en büyük çözünürlük; uyarlamalı mod en sonda ölçülür
+    modes = [(f"{w}x{h}", lambda image, res=(w, h): res) for w, h in reversed(resolutions)]
+    modes.append(("adaptive", lambda image: donut_ocr.select_resolution(image, resolutions)))
+
+    reports, baseline = [], None
+    for mode, choose in modes:
+        logger.info(f"Running {mode} on {len(crops)} crops")
+        latencies, outputs, used = run_mode(crops, choose, args.runs, args.max_len)
+        if baseline is None:
+            baseline = outputs
+        report = {
+            "mode": mode,
+            "latency_median_ms": round(statistics.median(latencies.values()) * 1000, 1),
+            "latency_mean_ms": round(statistics.mean(latencies.values()) * 1000, 1),
+            "exact_text_match": round(
+                sum(outputs[n]["text"] == baseline[n]["text"] for n in outputs) / len(outputs), 4),
+            "field_agreement": round(
+                statistics.mean(field_agreement(baseline[n]["fields"], outputs[n]["fields"]) for n in outputs), 4),
+            "per_crop": {n: {"resolution": used[n], "ms": round(latencies[n] * 1000, 1)} for n in latencies},
+        }
+        reports.append(report)
+        logger.info(json.dumps({k: v for k, v in report.items() if k != "per_crop"}))
+
+    print(f"{'mode':<12}{'latency_ms':>12}{'exact':>8}{'fields':>8}")
+    for r in reports:
+        print(f"{r['mode']:<12}{r['latency_median_ms']:>12}{r['exact_text_match']:>8}{r['field_agreement']:>8}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(reports, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
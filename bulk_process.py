@@ -0,0 +1,234 @@
+"""
+Toplu (backfill) fatura işleme aracı.
+
+Girdi klasörü alt klasörleriyle birlikte taranır, her görüntü InvoiceProcessor ile
+işlenir ve sonuç bitince JSONL çıktı dosyasına tek satır olarak eklenir; sonuçlar
+bellekte biriktirilmez. İşlenen her dosya manifest dosyasına (JSONL) yazılır,
+tekrar çalıştırıldığında manifestte başarıyla kaydı olan ve boyutu/değişiklik
+zamanı aynı kalan dosyalar atlanır (hata alan dosyalar yeniden denenir).
+
+Kullanım:
+    python bulk_process.py --input scans/ --output results.jsonl
+    python bulk_process.py --input scans/ --output shard0.jsonl --shard 0/4 --workers 4
+
+--shard i/n ile dosyalar göreli yollarının hash'ine göre n parçaya bölünür ve
+yalnızca i. parça (0 tabanlı) işlenir; parçalar ayrı makinelerde çalıştırılabilir.
+--workers 0'dan büyükse modeller bir kez yüklenip bu sayıda fork edilmiş worker
+sürecinde paylaşılır (bkz. process_pool.WorkerPool).
+"""
+import argparse
+import json
+import logging
+import os
+import time
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from invoice_processor import InvoiceProcessor
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger("bulk_process")
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp")
+
+
+def parse_shard(value):
+    """"i/n" değerini (i, n) çiftine çevir (0 <= i < n)"""
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Geçersiz shard değeri: {value} (beklenen: i/n)")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"Geçersiz shard değeri: {value} (0 <= i < n olmalı)")
+    return index, count
+
+
+def in_shard(rel_path, shard):
+    """Dosya, göreli yolunun kararlı hash'ine göre bu parçaya mı düşüyor"""
+    index, count = shard
+    return zlib.crc32(rel_path.encode("utf-8")) % count == index
+
+
+def iter_images(input_dir):
+    """Girdi ağacındaki görüntüleri sıralı olarak (göreli_yol, tam_yol) çiftleri halinde döndür"""
+    for root, dirs, files in os.walk(input_dir):
+        dirs.sort()
+        for name in sorted(files):
+            if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                path = os.path.join(root, name)
+                yield os.path.relpath(path, input_dir), path
+
+
+def file_key(path):
+    """Dosyanın değişip değişmediğini anlamak için (boyut, mtime_ns)"""
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def load_manifest(path):
+    """
+    Manifestteki tamamlanmış dosyaları {göreli_yol: (boyut, mtime_ns)} olarak oku.
+    Yarım kalmış (çökme sırasında yazılan) son satır yok sayılır.
+    """
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if entry.get("status") == "error":
+                done.pop(entry["file"], None)
+            else:
+                done[entry["file"]] = (entry["size"], entry["mtime_ns"])
+    return done
+
+
+def open_append(path):
+    """Dosyayı ekleme modunda aç; çökmeden kalan yarım satır varsa yeni satırla kapat"""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    # Son byte ikili modda okunur: satır çok byte'lı bir UTF-8 karakterinin ortasında kesilmiş olabilir
+    needs_newline = False
+    if os.path.exists(path) and os.path.getsize(path) > 0:
+        with open(path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            needs_newline = f.read(1) != b"\n"
+    f = open(path, "a", encoding="utf-8")
+    if needs_newline:
+        f.write("\n")
+    return f
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+class Progress:
+    """İşlenen dosya sayısı, saniye başına dosya ve kalan süre tahmini"""
+
+    def __init__(self, total, interval=10.0):
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.errors = 0
+        self.start = time.perf_counter()
+        self._last_report = self.start
+
+    def update(self, status):
+        self.done += 1
+        if status == "error":
+            self.errors += 1
+        now = time.perf_counter()
+        if now - self._last_report >= self.interval:
+            self._last_report = now
+            self.report()
+
+    def report(self):
+        elapsed = time.perf_counter() - self.start
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        eta = format_duration((self.total - self.done) / rate) if rate > 0 else "-"
+        percent = 100.0 * self.done / self.total if self.total else 100.0
+        logger.info(f"{self.done}/{self.total} files ({percent:.1f}%), {rate:.2f} files/s, "
+                    f"ETA {eta}, errors {self.errors}")
+
+
+def build_processor(workers, concurrency, yolo_model_path):
+    """workers > 0 ise fork edilmiş worker süreçleri kullanan işlemci, değilse süreç içi işlemci"""
+    if workers > 0:
+        from process_pool import WorkerPool, ProcessPoolInvoiceProcessor
+        pool = WorkerPool(InvoiceProcessor(yolo_model_path=yolo_model_path),
+                          workers=workers, concurrency=concurrency)
+        return ProcessPoolInvoiceProcessor(pool, yolo_model_path=yolo_model_path), pool
+    return InvoiceProcessor(yolo_model_path=yolo_model_path), None
+
+
+def run(args):
+    manifest_path = args.manifest or f"{args.output}.manifest"
+    done = load_manifest(manifest_path)
+
+    pending = []
+    skipped = 0
+    for rel_path, path in iter_images(args.input):
+        if args.shard and not in_shard(rel_path, args.shard):
+            continue
+        key = file_key(path)
+        if done.get(rel_path) == key:
+            skipped += 1
+            continue
+        pending.append((rel_path, path, key))
+    done.clear()
+    logger.info(f"{len(pending)} files to process, {skipped} already completed"
+                + (f" (shard {args.shard[0]}/{args.shard[1]})" if args.shard else ""))
+    if not pending:
+        return 0
+
+    processor, pool = build_processor(args.workers, args.concurrency, args.yolo_model)
+    processor.warmup()
+    # Worker'lar hiç boş kalmasın diye havuz kapasitesinin iki katı kadar iş bekletilir
+    in_flight_limit = max(1, args.workers) * args.concurrency * 2
+    progress = Progress(len(pending), args.progress_interval)
+    output = open_append(args.output)
+    manifest = open_append(manifest_path)
+    executor = ThreadPoolExecutor(max_workers=in_flight_limit, thread_name_prefix="bulk")
+    try:
+        items = iter(pending)
+        in_flight = {}
+        while True:
+            for rel_path, path, key in items:
+                in_flight[executor.submit(processor.process_image, path)] = (rel_path, key)
+                if len(in_flight) >= in_flight_limit:
+                    break
+            if not in_flight:
+                break
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                rel_path, (size, mtime_ns) = in_flight.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.error(f"Error processing {rel_path}: {str(e)}")
+                    result = {"status": "error", "message": "İşlem sırasında hata oluştu",
+                              "error_details": str(e), "results": []}
+                status = result.get("status", "error")
+                # Önce sonuç, sonra manifest: çökme olursa dosya en kötü ihtimalle yeniden işlenir
+                output.write(json.dumps({"file": rel_path, **result}, ensure_ascii=False) + "\n")
+                output.flush()
+                manifest.write(json.dumps({"file": rel_path, "size": size, "mtime_ns": mtime_ns,
+                                           "status": status, "process_id": result.get("process_id")}) + "\n")
+                manifest.flush()
+                progress.update(status)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        output.close()
+        manifest.close()
+        if pool is not None:
+            pool.shutdown()
+    progress.report()
+    return 1 if progress.errors else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Kaldığı yerden devam edebilen toplu fatura işleme")
+    parser.add_argument("--input", required=True, help="Görüntülerin bulunduğu klasör (alt klasörler dahil)")
+    parser.add_argument("--output", required=True, help="Sonuçların ekleneceği JSONL dosyası")
+    parser.add_argument("--manifest", help="Tamamlanan dosyaların kaydı (varsayılan: <output>.manifest)")
+    parser.add_argument("--shard", type=parse_shard, help="Yalnızca i. parçayı işle (i/n, 0 tabanlı)")
+    parser.add_argument("--workers", type=int, default=0, help="Worker süreç sayısı (0: tek süreç)")
+    parser.add_argument("--concurrency", type=int, default=2,
+                        help="Süreç başına aynı anda işlenen görüntü sayısı")
+    parser.add_argument("--yolo-model", default=os.environ.get("YOLO_MODEL_PATH", "best.pt"))
+    parser.add_argument("--progress-interval", type=float, default=10.0, help="İlerleme raporu aralığı (saniye)")
+    args = parser.parse_args()
+    args.concurrency = max(1, args.concurrency)
+    raise SystemExit(run(args))
+
+
+if __name__ == "__main__":
+    main()
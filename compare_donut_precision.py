@@ -0,0 +1,167 @@
+"""
+Donut OCR'ı farklı hassasiyetlerde (fp32, int8, bf16) karşılaştıran araç.
+
+Her hassasiyet için modeli ayrı yükler, bir klasördeki görüntüler üzerinde
+gecikme, bellek ve çıktı alanlarının fp32 ile uyumunu raporlar.
+
+Kullanım:
+    python compare_donut_precision.py --images test_images --precisions fp32 int8
+
+--min-field-agreement verilirse, fp32 dışındaki bir hassasiyetin alan uyumu
+bu değerin altında kaldığında araç 1 çıkış koduyla biter (doğruluk kapısı).
+"""
+import argparse
+import gc
+import io
+import json
+import logging
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import torch
+from PIL import Image
+
+import donut_ocr
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger("compare_donut_precision")
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+def rss_mb():
+    """Sürecin anlık resident bellek kullanımı (MB, yalnızca Linux)"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def weights_mb(model):
+    """Modelin serileştirilmiş ağırlık boyutu (MB); quantize edilmiş katmanlar dahil"""
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / (1024 * 1024)
+
+
+def flatten_fields(data, prefix=""):
+    """token2json çıktısını {"menu.0.nm": "..."} gibi düz alan sözlüğüne çevir"""
+    fields = {}
+    if isinstance(data, dict):
+        for key, value in data.items():
+            fields.update(flatten_fields(value, f"{prefix}{key}."))
+    elif isinstance(data, list):
+        for idx, value in enumerate(data):
+            fields.update(flatten_fields(value, f"{prefix}{idx}."))
+    else:
+        fields[prefix.rstrip(".")] = str(data).strip()
+    return fields
+
+
+def field_agreement(reference, candidate):
+    """İki alan sözlüğünde aynı değere sahip alanların oranı (birleşim üzerinden)"""
+    keys = set(reference) | set(candidate)
+    if not keys:
+        return 1.0
+    return sum(1 for k in keys if reference.get(k) == candidate.get(k)) / len(keys)
+
+
+def run_precision(precision, images, runs, max_len):
+    gc.collect()
+    rss_before = rss_mb()
+    load_start = time.perf_counter()
+    model = donut_ocr.load_model(precision)
+    load_s = time.perf_counter() - load_start
+    rss_after = rss_mb()
+
+    tokenizer = donut_ocr.get_processor().tokenizer
+    outputs, latencies = {}, {}
+    # Isınma: ilk çağrının kernel/allocator hazırlığı ölçüme girmesin
+    donut_ocr.generate_ids([images[0][1]], max_len=max_len, donut_model=model)
+    for name, image in images:
+        times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            out_ids, _ = donut_ocr.generate_ids([image], max_len=max_len, donut_model=model)
+            times.append(time.perf_counter() - start)
+        latencies[name] = statistics.median(times)
+        sequence = tokenizer.batch_decode(out_ids)[0]
+        sequence = sequence.replace(tokenizer.eos_token, "").replace(tokenizer.pad_token, "")
+        sequence = sequence.replace(donut_ocr.TASK_TOKEN, "", 1).strip()
+        outputs[name] = {
+            "text": tokenizer.batch_decode(out_ids, skip_special_tokens=True)[0].strip(),
+            "fields": flatten_fields(donut_ocr.get_processor().token2json(sequence)),
+        }
+
+    report = {
+        "precision": precision,
+        "load_s": round(load_s, 2),
+        "weights_mb": round(weights_mb(model), 1),
+        "rss_delta_mb": round(rss_after - rss_before, 1) if rss_before is not None else None,
+        "latency_median_ms": round(statistics.median(latencies.values()) * 1000, 1),
+        "latency_mean_ms": round(statistics.mean(latencies.values()) * 1000, 1),
+        "per_image_ms": {k: round(v * 1000, 1) for k, v in latencies.items()},
+    }
+    del model
+    gc.collect()
+    return report, outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Donut fp32 / quantized karşılaştırması")
+    parser.add_argument("--images", default="test_images", help="Görüntü klasörü (ör. crop'lar)")
+    parser.add_argument("--precisions", nargs="+", default=["fp32", "int8"], choices=donut_ocr.PRECISIONS)
+    parser.add_argument("--runs", type=int, default=3, help="Görüntü başına ölçüm tekrarı")
+    parser.add_argument("--max-len", type=int, default=512)
+    parser.add_argument("--output", help="Raporun yazılacağı JSON dosyası")
+    parser.add_argument("--min-field-agreement", type=float,
+                        help="fp32 ile en düşük kabul edilebilir alan uyumu (0-1)")
+    args = parser.parse_args()
+
+    paths = sorted(p for p in Path(args.images).glob("*") if p.suffix.lower() in IMAGE_EXTENSIONS)
+    if not paths:
+        logger.error(f"No images found in {args.images}")
+        return
+    images = [(p.name, Image.open(p).convert("RGB")) for p in paths]
+    precisions = ["fp32"] + [p for p in args.precisions if p != "fp32"]
+
+    reports, baseline = [], None
+    for precision in precisions:
+        logger.info(f"Running {precision} on {len(images)} images")
+        report, outputs = run_precision(precision, images, args.runs, args.max_len)
+        if baseline is None:
+            baseline = outputs
+        report["exact_text_match"] = round(
+            sum(outputs[n]["text"] == baseline[n]["text"] for n in outputs) / len(outputs), 4)
+        report["field_agreement"] = round(
+            statistics.mean(field_agreement(baseline[n]["fields"], outputs[n]["fields"]) for n in outputs), 4)
+        reports.append(report)
+        logger.info(json.dumps({k: v for k, v in report.items() if k != "per_image_ms"}))
+
+    print(f"{'precision':<10}{'latency_ms':>12}{'weights_mb':>12}{'rss_mb':>10}{'exact':>8}{'fields':>8}")
+    for r in reports:
+        print(f"{r['precision']:<10}{r['latency_median_ms']:>12}{r['weights_mb']:>12}"
+              f"{str(r['rss_delta_mb']):>10}{r['exact_text_match']:>8}{r['field_agreement']:>8}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(reports, f, ensure_ascii=False, indent=2)
+
+    if args.min_field_agreement is not None:
+        failed = [r["precision"] for r in reports if r["field_agreement"] < args.min_field_agreement]
+        if failed:
+            logger.error(f"Field agreement below {args.min_field_agreement} for: {failed}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+donut_cord_v2 klasöründeki pytorch_model.bin ağırlıklarını model.safetensors'a çevirir.
+
+safetensors dosyası mmap ile açılır: yükleme sırasında pickle açılmaz, ağırlıklar
+sayfa önbelleğinden okunur ve aynı dosyayı yükleyen süreçler bu sayfaları paylaşır.
+donut_ocr.load_model, model.safetensors varsa onu kullanır.
+
+Kullanım:
+    python convert_donut_safetensors.py --model ./donut_cord_v2
+    python convert_donut_safetensors.py --model ./donut_cord_v2 --remove-bin
+"""
+import argparse
+import logging
+import os
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger("convert_donut_safetensors")
+
+
+def convert(model_dir, remove_bin=False):
+    import torch
+    from safetensors.torch import save_file
+
+    bin_path = os.path.join(model_dir, "pytorch_model.bin")
+    out_path = os.path.join(model_dir, "model.safetensors")
+    if os.path.exists(out_path):
+        logger.info(f"Already converted: {out_path}")
+    else:
+        state_dict = torch.load(bin_path, map_location="cpu", weights_only=True)
+        # safetensors paylaşılan bellekli tensörleri kabul etmez (bağlı embedding ağırlıkları)
+        seen = {}
+        for name, tensor in state_dict.items():
+            ptr = tensor.untyped_storage().data_ptr()
+            state_dict[name] = tensor.clone().contiguous() if ptr in seen else tensor.contiguous()
+            seen.setdefault(ptr, name)
+        save_file(state_dict, out_path, metadata={"format": "pt"})
+        logger.info(f"Wrote {out_path} ({os.path.getsize(out_path) / (1024 * 1024):.1f} MB)")
+
+    if remove_bin and os.path.exists(bin_path):
+        os.remove(bin_path)
+        logger.info(f"Removed {bin_path}")
+    return out_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Donut safetensors dönüşümü")
+    parser.add_argument("--model", default="./donut_cord_v2")
+    parser.add_argument("--remove-bin", action="store_true", help="Dönüşümden sonra pytorch_model.bin'i sil")
+    args = parser.parse_args()
+    convert(args.model, args.remove_bin)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,70 +1,224 @@
-import subprocess, sys, shutil, os, time
+import os, sys, threading
 from pathlib import Path
-import threading
+import logging
+
+from model_registry import registry
+
+logger = logging.getLogger("docgeonet_correct")
+
+DOCGEONET_DIR = os.environ.get("DOCGEONET_DIR", "DocGeoNet")
+# Crop'lar ağa bu boyutta verilir; backward map tam çözünürlükte uygulanır
+REC_SIZE = 288
+MAX_BATCH_SIZE = int(os.environ.get("DOCGEONET_MAX_BATCH_SIZE", "8"))
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+# Düzlük ön kontrolü: eğim veya eğrilik bu eşikleri (derece) aşan crop'lar düzeltilir
+GATE_MAX_SKEW_DEG = float(os.environ.get("RECTIFY_MAX_SKEW_DEG", "2.0"))
+GATE_MAX_CURVATURE_DEG = float(os.environ.get("RECTIFY_MAX_CURVATURE_DEG", "1.5"))
+# Bundan az doğru bulunan crop'lar değerlendirilemez ve düzeltmeye gönderilir
+GATE_MIN_LINES = int(os.environ.get("RECTIFY_MIN_LINES", "4"))
+GATE_MAX_SIDE = 400
+
+# DocGeoNet/inference.py aynı modül adlarını kullanır; import yalnızca bir kez yapılır
+_import_lock = threading.Lock()
+
+
+def _load_weights(model, path):
+    """
+    Ağırlıkları inference.py'deki reload_*_model gibi yükle: kayıt sırasında eklenen
+    'module.' / 'model.' önekleri atılır ve yalnızca modelde bulunan anahtarlar alınır.
+    """
+    import torch
+    model_dict = model.state_dict()
+    for k, v in torch.load(path, map_location="cpu").items():
+        for prefix in ("module.", "model."):
+            if k.startswith(prefix) and k not in model_dict:
+                k = k[len(prefix):]
+        if k in model_dict:
+            model_dict[k] = v
+    model.load_state_dict(model_dict)
+
+
+def _weighted_median(values, weights):
+    import numpy as np
+    order = np.argsort(values)
+    cumulative = np.cumsum(weights[order])
+    return values[order][np.searchsorted(cumulative, cumulative[-1] / 2)]
+
+
+def assess_flatness(image, max_side=GATE_MAX_SIDE):
+    """
+    Crop'un eğim ve eğriliğini küçültülmüş kopyasındaki doğrulardan tahmin et.
+
+    Canny kenarlarında HoughLinesP ile uzun doğru parçaları bulunur; açılar 90 dereceye
+    göre katlanır (yatay ve dikey doğrular aynı eğimi verir). Eğim, uzunlukla ağırlıklı
+    medyan açıdır; eğrilik, açıların bu medyan etrafındaki ağırlıklı standart sapmasıdır
+    (bükülmüş sayfada satırlar farklı açılarda kırılır).
+
+    Returns:
+        {"lines": doğru_sayısı, "skew_deg": eğim, "curvature_deg": eğrilik}; doğru yoksa açılar None
+    """
+    import cv2
+    import numpy as np
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    scale = max_side / max(gray.shape[:2])
+    if scale < 1:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    edges = cv2.Canny(gray, 50, 150)
+    min_length = max(20, int(0.2 * min(gray.shape[:2])))
+    lines = cv2.HoughLinesP(edges, 1, np.pi / 180, threshold=50, minLineLength=min_length, maxLineGap=10)
+    if lines is None:
+        return {"lines": 0, "skew_deg": None, "curvature_deg": None}
+
+    x1, y1, x2, y2 = lines[:, 0].astype(np.float64).T
+    angles = (np.degrees(np.arctan2(y2 - y1, x2 - x1)) + 45) % 90 - 45
+    lengths = np.hypot(x2 - x1, y2 - y1)
+    skew = _weighted_median(angles, lengths)
+    curvature = np.sqrt(np.average((angles - skew) ** 2, weights=lengths))
+    return {"lines": int(len(angles)), "skew_deg": round(abs(float(skew)), 2),
+            "curvature_deg": round(float(curvature), 2)}
+
+
+def needs_rectification(image, max_skew_deg=GATE_MAX_SKEW_DEG, max_curvature_deg=GATE_MAX_CURVATURE_DEG,
+                        min_lines=GATE_MIN_LINES):
+    """
+    Crop'un DocGeoNet ile düzeltilmesi gerekip gerekmediğine karar ver.
+
+    Returns:
+        assess_flatness çıktısı + "rectify" (bool) ve "reason" ("skew", "curvature",
+        "insufficient_lines" veya düz crop'lar için "flat")
+    """
+    decision = assess_flatness(image)
+    if decision["lines"] < min_lines:
+        reason = "insufficient_lines"
+    elif decision["skew_deg"] > max_skew_deg:
+        reason = "skew"
+    elif decision["curvature_deg"] > max_curvature_deg:
+        reason = "curvature"
+    else:
+        reason = "flat"
+    decision.update(rectify=reason != "flat", reason=reason)
+    return decision
+
+
+class DocGeoNetRectifier:
+    """
+    Bellekte tutulan DocGeoNet belge düzelticisi.
+
+    DocGeoNet/inference.py ile aynı hesaplama (U2NETP maskesi -> DocGeoNet backward
+    map -> tam çözünürlüklü crop üzerinde grid_sample); modeller bir kez yüklenir ve
+    crop'lar geçici klasörler yerine BGR diziler olarak toplu halde verilir.
+
+    Args:
+        docgeonet_dir: DocGeoNet klasörü (kod + model_pretrained/)
+        device: torch cihazı; verilmezse varsa cuda kullanılır
+    """
+
+    def __init__(self, docgeonet_dir=DOCGEONET_DIR, device=None):
+        import torch
+        docgeonet_dir = Path(docgeonet_dir).resolve()
+        with _import_lock:
+            if str(docgeonet_dir) not in sys.path:
+                sys.path.insert(0, str(docgeonet_dir))
+            from seg import U2NETP
+            from model import DocGeoNet
+
+        self.device = torch.device(device or ("cuda" if torch.cuda.is_available() else "cpu"))
+        weights = docgeonet_dir / "model_pretrained"
+        self.seg = U2NETP(3, 1)
+        self.rec = DocGeoNet()
+        _load_weights(self.seg, weights / "preprocess.pth")
+        _load_weights(self.rec, weights / "DocGeoNet.pth")
+        self.seg.to(self.device).eval()
+        self.rec.to(self.device).eval()
+
+    def _backward_maps(self, batch):
+        """(B, 3, 288, 288) RGB [0, 1] -> [-1, 1] aralığına normalize (B, 2, 288, 288) map'ler"""
+        msk = self.seg(batch)[0]
+        msk = (msk > 0.5).float()
+        bm = self.rec(msk * batch)
+        if isinstance(bm, (tuple, list)):
+            bm = bm[-1]
+        return (2 * (bm / 286.8) - 1) * 0.99
+
+    def rectify(self, images):
+        """
+        BGR uint8 crop'ları düzelt.
+
+        Returns:
+            Girdiyle aynı boyut ve sırada düzeltilmiş BGR uint8 dizilerin listesi
+        """
+        import cv2
+        import numpy as np
+        import torch
+        import torch.nn.functional as F
+
+        outputs = []
+        for start in range(0, len(images), MAX_BATCH_SIZE):
+            chunk = [np.ascontiguousarray(img[:, :, ::-1]).astype(np.float32) / 255.0
+                     for img in images[start:start + MAX_BATCH_SIZE]]
+            batch = np.stack([cv2.resize(img, (REC_SIZE, REC_SIZE)).transpose(2, 0, 1) for img in chunk])
+            with torch.inference_mode():
+                maps = self._backward_maps(torch.from_numpy(batch).to(self.device)).cpu().numpy()
+
+            for img, bm in zip(chunk, maps):
+                h, w = img.shape[:2]
+                grid = np.stack([cv2.blur(cv2.resize(bm[0], (w, h)), (3, 3)),
+                                 cv2.blur(cv2.resize(bm[1], (w, h)), (3, 3))], axis=2)
+                with torch.inference_mode():
+                    out = F.grid_sample(torch.from_numpy(img).permute(2, 0, 1).unsqueeze(0),
+                                        torch.from_numpy(grid).unsqueeze(0), align_corners=True)
+                rgb = (out[0].permute(1, 2, 0).numpy() * 255).astype(np.uint8)
+                outputs.append(np.ascontiguousarray(rgb[:, :, ::-1]))
+        return outputs
+
+    def warmup(self):
+        """Modelleri boş bir görüntüyle bir kez çalıştır"""
+        import numpy as np
+        self.rectify([np.full((REC_SIZE, REC_SIZE, 3), 255, dtype=np.uint8)])
+
+
+def _load_rectifier():
+    rectifier = DocGeoNetRectifier(DOCGEONET_DIR)
+    logger.info(f"DocGeoNet yüklendi: {DOCGEONET_DIR} | Cihaz: {rectifier.device.type}")
+    return rectifier
+
+
+registry.register("docgeonet", _load_rectifier)
+
+
+def get_rectifier():
+    """DocGeoNet'i ilk kullanımda yükle ve tüm çağıranlarla paylaş"""
+    return registry.get("docgeonet")
 
-# Thread-local storage to prevent race conditions when multiple threads call the function
-thread_local = threading.local()
 
 def correct_with_docgeonet(docgeonet_dir, crops_dir, rec_dir):
     """
     Correct document geometry using DocGeoNet.
-    
+
     Args:
         docgeonet_dir: Path to DocGeoNet directory
         crops_dir: Directory containing cropped images
         rec_dir: Directory to save rectified images
-        
+
     Returns:
         List of paths to rectified images
     """
-    # Use thread-local storage to generate unique directory names
-    if not hasattr(thread_local, 'counter'):
-        thread_local.counter = 0
-    thread_local.counter += 1
-    
-    # Generate unique directory names using timestamp and thread counter
-    timestamp = int(time.time())
-    thread_id = threading.get_ident()
-    unique_suffix = f"{timestamp}_{thread_id}_{thread_local.counter}"
-    
-    docgeonet_dir = Path(docgeonet_dir).resolve()  # mutlak yol
-    # Use /tmp directory for temporary files instead of the read-only /app directory
-    tmp_dir = Path("/tmp")
-    DG_DIST = tmp_dir / f"distorted_{unique_suffix}"
-    DG_REC = tmp_dir / f"rec_{unique_suffix}"
-
-    try:
-        # 1) Klasör oluştur (temizleme yerine benzersiz klasörler kullan)
-        for p in (DG_DIST, DG_REC):
-            p.mkdir(parents=True, exist_ok=True)
-
-        # 2) Crop'ları kopyala
-        for cimg in Path(crops_dir).glob("*"):
-            shutil.copy(cimg, DG_DIST / cimg.name)
-
-        # 3) DocGeoNet'i çağır
-        cmd = [
-            sys.executable,
-            "inference.py",
-            "--seg_model_path", str(docgeonet_dir / "model_pretrained" / "preprocess.pth"),
-            "--rec_model_path", str(docgeonet_dir / "model_pretrained" / "DocGeoNet.pth"),
-            "--distorrted_path", str(DG_DIST),
-            "--save_path", str(DG_REC),
-        ]
-        subprocess.run(cmd, cwd=docgeonet_dir, check=True)
-
-        # 4) Çıktıları kopyala
-        rec_dir = Path(rec_dir)
-        rec_dir.mkdir(exist_ok=True, parents=True)
-        rec_imgs = []
-        for rimg in DG_REC.glob("*_rec.png"):
-            shutil.copy(rimg, rec_dir / rimg.name)
-            rec_imgs.append(str(rec_dir / rimg.name))
-        print(f"{len(rec_imgs)} görüntü düzeltildi ➜ {rec_dir}")
-        return sorted(rec_imgs)
-    
-    finally:
-        # 5) Geçici klasörleri temizle
-        for p in (DG_DIST, DG_REC):
-            if p.exists():
-                shutil.rmtree(p)
\ No newline at end of file
+    import cv2
+    rectifier = get_rectifier() if Path(docgeonet_dir).resolve() == Path(DOCGEONET_DIR).resolve() \
+        else DocGeoNetRectifier(docgeonet_dir)
+
+    rec_dir = Path(rec_dir)
+    rec_dir.mkdir(exist_ok=True, parents=True)
+    crop_paths = sorted(p for p in Path(crops_dir).glob("*") if p.suffix.lower() in IMAGE_EXTENSIONS)
+    rec_imgs = []
+    for start in range(0, len(crop_paths), MAX_BATCH_SIZE):
+        chunk = crop_paths[start:start + MAX_BATCH_SIZE]
+        images = [cv2.imread(str(p)) for p in chunk]
+        readable = [(p, img) for p, img in zip(chunk, images) if img is not None]
+        for (path, _), rectified in zip(readable, rectifier.rectify([img for _, img in readable])):
+            out_path = rec_dir / f"{path.stem}_rec.png"
+            cv2.imwrite(str(out_path), rectified)
+            rec_imgs.append(str(out_path))
+    print(f"{len(rec_imgs)} görüntü düzeltildi ➜ {rec_dir}")
+    return sorted(rec_imgs)
@@ -1,8 +1,20 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+
+import numpy as np
 import torch
 from PIL import Image
-from transformers import DonutProcessor, VisionEncoderDecoderModel, utils as hf_utils
+from transformers import (DonutProcessor, VisionEncoderDecoderModel, StoppingCriteria,
+                          StoppingCriteriaList, utils as hf_utils)
 import logging, warnings, contextlib, io
 
+from model_registry import registry
+from metrics import timed, GENERATED_TOKENS
+
 hf_utils.logging.set_verbosity_error()
 logging.getLogger("transformers").setLevel(logging.ERROR)
 warnings.filterwarnings("ignore")
@@ -12,16 +24,467 @@ local_model_path = "./donut_cord_v2"  # Donut model klasörünü doğru göster!
 
 TASK_TOKEN = "<s_cord-v2>"
 
-with contextlib.redirect_stderr(io.StringIO()):
-    processor = DonutProcessor.from_pretrained(local_model_path)
-    model = VisionEncoderDecoderModel.from_pretrained(local_model_path).to(device).eval()
+# Dinamik mikro-batch ayarları (ortam değişkenleri ile değiştirilebilir)
+MAX_BATCH_SIZE = int(os.environ.get("DONUT_MAX_BATCH_SIZE", "8"))
+MAX_WAIT_MS = float(os.environ.get("DONUT_MAX_WAIT_MS", "10"))
+
+# Çıkarım hassasiyeti: fp32 (varsayılan), int8 (CPU'da dinamik quantization) veya bf16
+PRECISION = os.environ.get("DONUT_PRECISION", "fp32").lower()
+PRECISIONS = ("fp32", "int8", "bf16")
+
+
+def load_model(precision=PRECISION):
+    """
+    Donut modelini istenen hassasiyette yükle.
+
+    int8: Encoder ve decoder'daki tüm nn.Linear katmanları dinamik int8 quantize edilir
+          (yalnızca CPU). bf16: Ağırlıklar bfloat16'ya çevrilir; CPU desteklemiyorsa fp32 kalır.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"Bilinmeyen Donut hassasiyeti: {precision} (seçenekler: {PRECISIONS})")
+    # model.safetensors varsa ağırlıklar mmap ile okunur; low_cpu_mem_usage (accelerate
+    # gerektirir) rastgele başlatılmış ikinci bir kopyanın bellekte oluşmasını önler
+    use_safetensors = os.path.exists(os.path.join(local_model_path, "model.safetensors"))
+    with contextlib.redirect_stderr(io.StringIO()):
+        loaded = VisionEncoderDecoderModel.from_pretrained(
+            local_model_path, use_safetensors=use_safetensors or None, low_cpu_mem_usage=True).eval()
+
+    if precision == "int8":
+        if device != "cpu":
+            logging.getLogger("donut_ocr").warning("int8 dynamic quantization is CPU-only; using fp32 on %s", device)
+        else:
+            # inplace: fp32 modelin derin kopyası oluşturulmaz (yükleme sırasında bellek iki katına çıkmaz)
+            return torch.quantization.quantize_dynamic(loaded, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    elif precision == "bf16":
+        if device == "cuda" or _cpu_supports_bf16():
+            loaded = loaded.to(torch.bfloat16)
+        else:
+            logging.getLogger("donut_ocr").warning("bf16 is not supported on this CPU; using fp32")
+    return loaded.to(device)
+
+
+def _cpu_supports_bf16():
+    checker = getattr(getattr(torch, "cpu", None), "_is_avx512_bf16_supported", None)
+    return bool(checker and checker())
+
+
+def _model_dtype(m):
+    """Modelin girdi olarak beklediği float tipini döndür (quantize modellerde float32)"""
+    for param in m.parameters():
+        if param.is_floating_point():
+            return param.dtype
+    return torch.float32
+
+
+# Uyarlamalı giriş çözünürlüğü (DONUT_ADAPTIVE_RESOLUTION=1): Donut ön işlemesi her crop'u
+# varsayılan olarak 960x1280 tuvale ölçekleyip pad'ler ve Swin encoder maliyeti bu boyutla
+# büyür. Açıkken her crop, DONUT_RESOLUTIONS içinden crop'u kendi çözünürlüğünün altına
+# küçültmeden taşıyan en küçük (genişlik x yükseklik) boyutla işlenir; sığmayan crop'lar
+# en büyük boyutu kullanır.
+ADAPTIVE_RESOLUTION = os.environ.get("DONUT_ADAPTIVE_RESOLUTION", "0").lower() in ("1", "true", "yes")
+
+
+def parse_resolutions(value):
+    """DONUT_RESOLUTIONS değerini (ör. "640x960,960x1280") alana göre sıralı (genişlik, yükseklik) listesine çevir"""
+    resolutions = set()
+    for part in value.split(","):
+        if part.strip():
+            width, height = (int(v) for v in part.lower().split("x"))
+            resolutions.add((width, height))
+    if not resolutions:
+        raise ValueError(f"Geçersiz Donut çözünürlük listesi: {value!r}")
+    return sorted(resolutions, key=lambda r: (r[0] * r[1], r))
+
+
+RESOLUTIONS = parse_resolutions(os.environ.get("DONUT_RESOLUTIONS", "640x640,640x960,960x1280"))
+
+
+def _image_size(image):
+    """(genişlik, yükseklik); dosya yollarında yalnızca başlık okunur"""
+    if isinstance(image, (str, Path)):
+        with Image.open(image) as img:
+            return img.size
+    if isinstance(image, np.ndarray):
+        return image.shape[1], image.shape[0]
+    return image.size
+
+
+def select_resolution(image, resolutions=None):
+    """Crop'u küçültmeden taşıyan en küçük desteklenen çözünürlük; hiçbiri yetmezse en büyüğü"""
+    resolutions = resolutions or RESOLUTIONS
+    width, height = _image_size(image)
+    for res_width, res_height in resolutions:
+        if width <= res_width and height <= res_height:
+            return res_width, res_height
+    return resolutions[-1]
+
+
+# Çıkarım backend'i: torch (PyTorch eager, varsayılan) veya onnx (ONNX Runtime, CPU).
+# onnx için grafikler önce export_donut_onnx.py ile DONUT_ONNX_DIR'e üretilmelidir.
+BACKEND = os.environ.get("DONUT_BACKEND", "torch").lower()
+ONNX_DIR = os.environ.get("DONUT_ONNX_DIR", "./donut_cord_v2_onnx")
+
+
+def load_onnx_model(onnx_dir=ONNX_DIR):
+    """ONNX Runtime backend'ini ORT_INTRA_OP_THREADS / ORT_INTER_OP_THREADS ayarlarıyla yükle"""
+    from donut_onnx import OnnxDonut
+    return OnnxDonut(onnx_dir,
+                     intra_op_threads=int(os.environ.get("ORT_INTRA_OP_THREADS", "0")),
+                     inter_op_threads=int(os.environ.get("ORT_INTER_OP_THREADS", "0")))
+
+
+if BACKEND not in ("torch", "onnx"):
+    raise ValueError(f"Bilinmeyen Donut backend'i: {BACKEND} (seçenekler: torch, onnx)")
+
+
+def _load_processor():
+    with contextlib.redirect_stderr(io.StringIO()):
+        return DonutProcessor.from_pretrained(local_model_path)
+
+
+# Modeller import sırasında değil, ilk kullanımda (veya warmup() ile) yüklenir
+registry.register("donut_processor", _load_processor)
+registry.register("donut_model", load_onnx_model if BACKEND == "onnx" else load_model)
+
+
+def get_processor():
+    return registry.get("donut_processor")
+
+
+def get_model():
+    """Yapılandırılmış backend'in modeli (torch: VisionEncoderDecoderModel, onnx: OnnxDonut)"""
+    return registry.get("donut_model")
+
+
+def warmup(max_len=8):
+    """Modelleri yükle ve beyaz bir görüntüyle kısa bir generate çalıştır (kernel/arena ısınması)"""
+    blank = Image.new("RGB", (960, 1280), "white")
+    img2json_batch([blank], max_len=max_len)
+
+
+def checkpoint_version():
+    """Yüklü Donut checkpoint'ini tanımlayan metin (ağırlık dosyalarının boyutu ve değişim zamanı)"""
+    parts = [os.path.abspath(local_model_path)]
+    for name in ("config.json", "model.safetensors", "pytorch_model.bin"):
+        path = os.path.join(local_model_path, name)
+        if os.path.exists(path):
+            stat = os.stat(path)
+            parts.append(f"{name}:{stat.st_size}:{int(stat.st_mtime)}")
+    parts.append(f"backend={BACKEND}" if BACKEND != "torch" else f"precision={PRECISION}")
+    if ADAPTIVE_RESOLUTION:
+        parts.append("resolutions=" + ",".join(f"{w}x{h}" for w, h in RESOLUTIONS))
+    return "|".join(parts)
+
+
+_task_start_ids = None
+
+
+def _get_start_ids():
+    """TASK_TOKEN'ın token id'lerini bir kez hesaplayıp önbellekte tut"""
+    global _task_start_ids
+    if _task_start_ids is None:
+        _task_start_ids = get_processor().tokenizer(TASK_TOKEN, add_special_tokens=False,
+                                                    return_tensors="pt").input_ids.to(device)
+    return _task_start_ids
+
+
+def _to_pil(image):
+    """
+    Dosya yolu, PIL görüntüsü veya NumPy dizisini RGB PIL görüntüsüne çevir.
+    NumPy dizileri OpenCV/YOLO çıktısı gibi BGR sırasında kabul edilir.
+    """
+    if isinstance(image, (str, Path)):
+        return Image.open(image).convert("RGB")
+    if isinstance(image, np.ndarray):
+        if image.ndim == 3 and image.shape[2] >= 3:
+            image = np.ascontiguousarray(image[:, :, 2::-1])
+        return Image.fromarray(image).convert("RGB")
+    return image.convert("RGB")
+
+
+# Decode bütçesi varsayılanları; API isteği başına max_new_tokens / timeout_s ile değiştirilebilir.
+# 0: sınır yok (yalnızca max_len geçerli)
+DEFAULT_MAX_NEW_TOKENS = int(os.environ.get("DONUT_MAX_NEW_TOKENS", "0"))
+DEFAULT_DECODE_TIMEOUT_S = float(os.environ.get("DONUT_DECODE_TIMEOUT_S", "0"))
+
+# Decode'un EOS dışında bir nedenle durması (sonuçtaki stop_reason)
+STOP_TRUNCATED = "truncated"
+STOP_DEADLINE = "deadline_exceeded"
+STOP_CANCELLED = "cancelled"
+
+
+class DecodeBudget:
+    """
+    Bir isteğin decode bütçesi: en fazla yeni token, duvar saati son tarihi ve iptal.
+
+    Son tarih bütçe oluşturulduğu anda başlar; böylece kuyrukta geçen süre de
+    bütçeden düşer. cancel() thread-safe'tir (ör. istemci bağlantısı koptuğunda).
+    """
+
+    def __init__(self, max_new_tokens=None, timeout_s=None):
+        max_new_tokens = DEFAULT_MAX_NEW_TOKENS if max_new_tokens is None else max_new_tokens
+        timeout_s = DEFAULT_DECODE_TIMEOUT_S if timeout_s is None else timeout_s
+        self.max_new_tokens = int(max_new_tokens) if max_new_tokens and max_new_tokens > 0 else None
+        self.deadline = time.monotonic() + float(timeout_s) if timeout_s and timeout_s > 0 else None
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def stop_reason(self):
+        """İptal edildiyse veya son tarih geçtiyse nedeni, aksi halde None"""
+        if self.cancelled:
+            return STOP_CANCELLED
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            return STOP_DEADLINE
+        return None
+
+
+class BudgetStoppingCriteria(StoppingCriteria):
+    """
+    Batch'teki her diziyi kendi DecodeBudget'ına göre ayrı ayrı durdurur.
+    İlk durdurma nedeni reasons listesinde tutulur (bütçesi olmayan diziler için None).
+    """
+
+    def __init__(self, budgets, prompt_len):
+        self.budgets = budgets
+        self.prompt_len = prompt_len
+        self.reasons = [None] * len(budgets)
+
+    def step(self, cur_len):
+        """Her dizi için durması gerekip gerekmediğini döndür (cur_len: önek dahil uzunluk)"""
+        generated = cur_len - self.prompt_len
+        for i, budget in enumerate(self.budgets):
+            if budget is None or self.reasons[i] is not None:
+                continue
+            reason = budget.stop_reason()
+            if reason is None and budget.max_new_tokens is not None and generated >= budget.max_new_tokens:
+                reason = STOP_TRUNCATED
+            self.reasons[i] = reason
+        return [reason is not None for reason in self.reasons]
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.tensor(self.step(input_ids.shape[1]), dtype=torch.bool, device=input_ids.device)
+
 
 @torch.no_grad()
+def generate_ids(images, max_len=512, donut_model=None, resolution=None, stopping=None):
+    """
+    Görüntüleri tek bir padded generate çağrısında işle ve ham token id'lerini döndür.
+    resolution verilirse ((genişlik, yükseklik)) encoder girdisi bu boyutta hazırlanır.
+    stopping (BudgetStoppingCriteria) verilirse diziler bütçeleri dolduğunda durdurulur.
+
+    Returns:
+        (out_ids, prompt_len): Üretilen diziler ve başlarındaki TASK_TOKEN uzunluğu
+    """
+    m = donut_model if donut_model is not None else get_model()
+    processor = get_processor()
+    size_kwargs = {"size": {"width": resolution[0], "height": resolution[1]}} if resolution else {}
+    with timed("donut_preprocess"):
+        pixel_values = processor([_to_pil(img) for img in images], return_tensors="pt", **size_kwargs).pixel_values
+    start_ids = _get_start_ids().repeat(pixel_values.shape[0], 1)
+    if not isinstance(m, torch.nn.Module):
+        # Encoder ve decoder süreleri OnnxDonut.generate içinde ayrı ölçülür
+        out_ids = m.generate(pixel_values.numpy(), start_ids.cpu().numpy(), max_length=max_len,
+                             eos_token_id=processor.tokenizer.eos_token_id,
+                             pad_token_id=processor.tokenizer.pad_token_id,
+                             stopping=stopping.step if stopping is not None else None)
+        return torch.from_numpy(out_ids), start_ids.shape[1]
+
+    pixel_values = pixel_values.to(device, _model_dtype(m))
+    # Encoder ayrı çalıştırılır (süresi ayrı ölçülsün diye); generate hazır encoder çıktısını kullanır
+    with timed("donut_encoder"):
+        encoder_outputs = m.encoder(pixel_values=pixel_values)
+    # Greedy decode'da EOS üreten diziler pad ile doldurulur, diğerleri devam eder
+    with timed("donut_decoder"):
+        out_ids = m.generate(encoder_outputs=encoder_outputs, decoder_input_ids=start_ids,
+                             max_length=max_len, early_stopping=True,
+                             pad_token_id=processor.tokenizer.pad_token_id,
+                             eos_token_id=processor.tokenizer.eos_token_id,
+                             stopping_criteria=StoppingCriteriaList([stopping]) if stopping is not None else None)
+    return out_ids, start_ids.shape[1]
+
+
+def _stop_reason(generated, eos_token_id, budget_reason, hit_max_len):
+    """Tek bir dizinin durma nedeni; EOS ile doğal olarak bittiyse None"""
+    eos_positions = (generated == eos_token_id).nonzero()
+    if len(eos_positions) == 0:
+        return budget_reason or STOP_TRUNCATED
+    # max_len'e ulaşan dizilerin son token'ı forced_eos ile EOS'a çevrilir
+    if hit_max_len and int(eos_positions[0]) == len(generated) - 1:
+        return STOP_TRUNCATED
+    return None
+
+
+def img2json_batch(images, max_len=512, resolution=None, budgets=None):
+    """
+    Birden fazla görüntüyü tek bir padded generate çağrısında işle.
+
+    Args:
+        images: PIL görüntüleri veya NumPy dizileri (BGR) listesi
+        max_len: Üretilecek en uzun dizi uzunluğu (TASK_TOKEN dahil)
+        resolution: Encoder girdi boyutu (genişlik, yükseklik). Verilmezse uyarlamalı
+            modda her görüntü için select_resolution ile seçilir ve farklı boyutlar
+            ayrı generate çağrılarında işlenir; aksi halde preprocessor varsayılanı kullanılır.
+        budgets: Görüntü başına DecodeBudget (veya None) listesi
+
+    Returns:
+        Her görüntü için {"text": str, "num_tokens": int, "stop_reason": str | None}
+        sözlüklerinden oluşan liste. stop_reason EOS'la biten dizilerde None, aksi halde
+        "truncated", "deadline_exceeded" veya "cancelled"dır.
+    """
+    if not images:
+        return []
+    budgets = list(budgets) if budgets is not None else [None] * len(images)
+    if resolution is None and ADAPTIVE_RESOLUTION:
+        selected = [select_resolution(img) for img in images]
+        if len(set(selected)) > 1:
+            outputs = [None] * len(images)
+            for res in set(selected):
+                indices = [i for i, r in enumerate(selected) if r == res]
+                group = img2json_batch([images[i] for i in indices], max_len=max_len, resolution=res,
+                                       budgets=[budgets[i] for i in indices])
+                for i, output in zip(indices, group):
+                    outputs[i] = output
+            return outputs
+        resolution = selected[0]
+    stopping = BudgetStoppingCriteria(budgets, len(_get_start_ids()[0])) if any(budgets) else None
+    out_ids, prompt_len = generate_ids(images, max_len=max_len, resolution=resolution, stopping=stopping)
+    processor = get_processor()
+    texts = processor.batch_decode(out_ids, skip_special_tokens=True)
+    generated = out_ids[:, prompt_len:]
+    token_counts = (generated != processor.tokenizer.pad_token_id).sum(dim=1).tolist()
+    for count in token_counts:
+        GENERATED_TOKENS.observe(count)
+    hit_max_len = out_ids.shape[1] >= max_len
+    reasons = stopping.reasons if stopping is not None else [None] * len(images)
+    return [{"text": text.strip(), "num_tokens": int(count),
+             "stop_reason": _stop_reason(row, processor.tokenizer.eos_token_id, reason, hit_max_len)}
+            for text, count, row, reason in zip(texts, token_counts, generated, reasons)]
+
+
 def img2json(img_path, max_len=512):
-    img = Image.open(img_path).convert("RGB")
-    pixel_values = processor(img, return_tensors="pt").pixel_values.to(device)
-    start_ids = processor.tokenizer(TASK_TOKEN, add_special_tokens=False,
-                                    return_tensors="pt").input_ids.to(device)
-    out_ids = model.generate(pixel_values, decoder_input_ids=start_ids,
-                             max_length=max_len, early_stopping=True)
-    return processor.batch_decode(out_ids, skip_special_tokens=True)[0].strip()
+    return img2json_batch([_to_pil(img_path)], max_len=max_len)[0]["text"]
+
+
+class DonutBatcher:
+    """
+    Eşzamanlı isteklerden gelen crop'ları toplayıp tek bir batched generate
+    çağrısında işleyen zamanlayıcı.
+
+    Bir batch, max_batch_size öğeye ulaşınca ya da ilk öğe max_wait_ms kadar
+    beklediğinde çalıştırılır. Her çağırana, img2json_batch'in o görüntü için
+    döndürdüğü {"text", "num_tokens", "stop_reason"} sözlüğünü taşıyan bir Future döner.
+    """
+
+    def __init__(self, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS):
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="donut-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, image, max_len=512, budget=None):
+        """Görüntüyü kuyruğa ekle; OCR çıktısını döndürecek bir Future döner"""
+        if self._closed:
+            raise RuntimeError("DonutBatcher kapatıldı")
+        future = Future()
+        self._queue.put((image, max_len, budget, future))
+        return future
+
+    def qsize(self):
+        """Batch'e alınmayı bekleyen crop sayısı"""
+        return self._queue.qsize()
+
+    def close(self):
+        """Kuyruktaki işleri bitirip arka plan thread'ini durdur"""
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            self._thread.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stop = False
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self._run_batch(batch)
+            if stop:
+                return
+
+    def _run_batch(self, batch):
+        # Farklı max_len değerleri ve (uyarlamalı modda) farklı giriş çözünürlükleri
+        # aynı generate çağrısında karıştırılmaz
+        groups = {}
+        for image, max_len, budget, future in batch:
+            if not future.set_running_or_notify_cancel():
+                continue
+            # Kuyrukta beklerken iptal edilen veya süresi dolan istekler için model çalıştırılmaz
+            reason = budget.stop_reason() if budget is not None else None
+            if reason is not None:
+                future.set_result({"text": "", "num_tokens": 0, "stop_reason": reason})
+                continue
+            resolution = select_resolution(image) if ADAPTIVE_RESOLUTION else None
+            groups.setdefault((max_len, resolution), []).append((image, budget, future))
+
+        for (max_len, resolution), items in groups.items():
+            self._generate(items, max_len, resolution)
+
+    def _generate(self, items, max_len, resolution):
+        """
+        Grubu tek generate çağrısında işle. Çağrı hata verirse grup ikiye bölünerek yeniden
+        denenir; hata yalnızca gerçekten başarısız olan crop'ların Future'ına yazılır, aynı
+        batch'e düşen diğer isteklerin crop'ları etkilenmez.
+        """
+        try:
+            outputs = img2json_batch([image for image, _, _ in items], max_len=max_len,
+                                     resolution=resolution, budgets=[budget for _, budget, _ in items])
+        except Exception as e:
+            if len(items) == 1:
+                items[0][2].set_exception(e)
+                return
+            logging.getLogger("donut_ocr").warning(
+                "Batched generate failed for %d crops, retrying in halves: %s", len(items), e)
+            middle = len(items) // 2
+            self._generate(items[:middle], max_len, resolution)
+            self._generate(items[middle:], max_len, resolution)
+            return
+        for (_, _, future), output in zip(items, outputs):
+            future.set_result(output)
+
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+
+def get_batcher():
+    """Süreç genelinde paylaşılan DonutBatcher örneğini döndür"""
+    global _batcher
+    with _batcher_lock:
+        if _batcher is None:
+            _batcher = DonutBatcher()
+        return _batcher
+
+
+def batcher_queue_depth():
+    """Paylaşılan batcher'da bekleyen crop sayısı (batcher henüz oluşturulmadıysa 0)"""
+    batcher = _batcher
+    return batcher.qsize() if batcher is not None else 0
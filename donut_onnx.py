@@ -0,0 +1,121 @@
+"""
+Donut için ONNX Runtime backend'i.
+
+export_donut_onnx.py ile üretilen üç grafiği kullanır:
+    encoder_model.onnx            pixel_values -> last_hidden_state
+    decoder_model.onnx            ilk adım: TASK_TOKEN önekinin tamamı, KV cache üretir
+    decoder_with_past_model.onnx  sonraki adımlar: tek token + KV cache
+
+Greedy decode, PyTorch tarafındaki model.generate ile aynı kuralları uygular
+(EOS üreten diziler pad ile doldurulur, forced_eos_token_id son adımda zorlanır).
+"""
+import json
+import logging
+import os
+
+import numpy as np
+
+from metrics import timed
+
+logger = logging.getLogger("donut_onnx")
+
+ENCODER_FILE = "encoder_model.onnx"
+DECODER_FILE = "decoder_model.onnx"
+DECODER_WITH_PAST_FILE = "decoder_with_past_model.onnx"
+
+
+class OnnxDonut:
+    def __init__(self, onnx_dir, intra_op_threads=0, inter_op_threads=0):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise RuntimeError("ONNX backend için onnxruntime kurulu olmalı: pip install onnxruntime") from e
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        if inter_op_threads:
+            options.inter_op_num_threads = inter_op_threads
+            options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+        providers = ["CPUExecutionProvider"]
+
+        self.onnx_dir = onnx_dir
+        self.encoder = ort.InferenceSession(os.path.join(onnx_dir, ENCODER_FILE), options, providers=providers)
+        self.decoder = ort.InferenceSession(os.path.join(onnx_dir, DECODER_FILE), options, providers=providers)
+        self.decoder_with_past = ort.InferenceSession(os.path.join(onnx_dir, DECODER_WITH_PAST_FILE),
+                                                      options, providers=providers)
+
+        self._decoder_inputs = {i.name for i in self.decoder.get_inputs()}
+        self._past_inputs = [i.name for i in self.decoder_with_past.get_inputs()
+                             if i.name.startswith("past_key_values")]
+        self._with_past_inputs = {i.name for i in self.decoder_with_past.get_inputs()}
+        self.forced_eos_token_id = self._load_generation_config().get("forced_eos_token_id")
+        logger.info(f"ONNX Donut loaded from {onnx_dir} (intra_op={intra_op_threads}, inter_op={inter_op_threads})")
+
+    def _load_generation_config(self):
+        path = os.path.join(self.onnx_dir, "generation_config.json")
+        if not os.path.exists(path):
+            return {}
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+    @staticmethod
+    def _present_to_past(outputs, names):
+        """present.* çıktılarını decoder_with_past'ın past_key_values.* girdilerine eşle"""
+        return {name.replace("present", "past_key_values", 1): value
+                for name, value in zip(names, outputs) if name.startswith("present")}
+
+    def generate(self, pixel_values, start_ids, max_length, eos_token_id, pad_token_id, stopping=None):
+        """
+        Batched greedy decode.
+
+        Args:
+            pixel_values: (B, 3, H, W) float32 dizisi
+            start_ids: (B, P) int64 TASK_TOKEN önekleri
+            stopping: Her adımdan sonra güncel uzunlukla çağrılan ve dizi başına
+                durdurma kararı (B bool) döndüren fonksiyon (ör. BudgetStoppingCriteria.step)
+        Returns:
+            (B, L) int64 token dizileri (önek dahil, bitmiş diziler pad ile doldurulmuş)
+        """
+        with timed("donut_encoder"):
+            encoder_hidden_states = self.encoder.run(None, {"pixel_values": pixel_values.astype(np.float32)})[0]
+        with timed("donut_decoder"):
+            return self._decode(encoder_hidden_states, start_ids, max_length, eos_token_id, pad_token_id, stopping)
+
+    def _decode(self, encoder_hidden_states, start_ids, max_length, eos_token_id, pad_token_id, stopping):
+        """Encoder çıktısından greedy decode döngüsü (KV önbellekli)"""
+        sequences = start_ids.astype(np.int64)
+        batch_size = sequences.shape[0]
+        unfinished = np.ones(batch_size, dtype=bool)
+
+        feed = {"input_ids": sequences, "encoder_hidden_states": encoder_hidden_states}
+        if "encoder_attention_mask" in self._decoder_inputs:
+            feed["encoder_attention_mask"] = np.ones(encoder_hidden_states.shape[:2], dtype=np.int64)
+        output_names = [o.name for o in self.decoder.get_outputs()]
+        outputs = self.decoder.run(None, {k: v for k, v in feed.items() if k in self._decoder_inputs})
+        logits = outputs[0]
+        # Cross-attention KV'leri yalnızca ilk adımda üretilir ve sonraki adımlarda aynen kullanılır
+        past = self._present_to_past(outputs, output_names)
+        with_past_output_names = [o.name for o in self.decoder_with_past.get_outputs()]
+
+        while True:
+            next_tokens = logits[:, -1, :].argmax(axis=-1)
+            if self.forced_eos_token_id is not None and sequences.shape[1] + 1 >= max_length:
+                next_tokens = np.full_like(next_tokens, self.forced_eos_token_id)
+            next_tokens = np.where(unfinished, next_tokens, pad_token_id).astype(np.int64)
+            sequences = np.concatenate([sequences, next_tokens[:, None]], axis=1)
+            unfinished &= next_tokens != eos_token_id
+            if stopping is not None:
+                unfinished &= ~np.asarray(stopping(sequences.shape[1]), dtype=bool)
+            if not unfinished.any() or sequences.shape[1] >= max_length:
+                return sequences
+
+            feed = {"input_ids": next_tokens[:, None], **{name: past[name] for name in self._past_inputs}}
+            if "encoder_hidden_states" in self._with_past_inputs:
+                feed["encoder_hidden_states"] = encoder_hidden_states
+            if "encoder_attention_mask" in self._with_past_inputs:
+                feed["encoder_attention_mask"] = np.ones(encoder_hidden_states.shape[:2], dtype=np.int64)
+            outputs = self.decoder_with_past.run(None, feed)
+            logits = outputs[0]
+            past.update(self._present_to_past(outputs, with_past_output_names))
@@ -0,0 +1,96 @@
+"""
+donut_cord_v2 modelini ONNX Runtime backend'i için ayrı encoder ve
+decoder(-with-past) grafiklerine dönüştürür.
+
+Kullanım:
+    python export_donut_onnx.py --model ./donut_cord_v2 --output ./donut_cord_v2_onnx
+    python export_donut_onnx.py --output ./donut_cord_v2_onnx --check test_images
+
+--check verilirse, klasördeki görüntüler hem PyTorch hem ONNX ile işlenir ve
+çıktı metinlerinin birebir aynı olup olmadığı raporlanır.
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger("export_donut_onnx")
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+def export(model_dir, output_dir, opset=14):
+    try:
+        from optimum.exporters.onnx import main_export
+    except ImportError as e:
+        raise RuntimeError("ONNX export için optimum gerekli: pip install optimum[exporters]") from e
+
+    # no_post_process: decoder ve decoder_with_past tek bir "merged" grafikte birleştirilmez
+    main_export(model_name_or_path=model_dir, output=output_dir,
+                task="image-to-text-with-past", opset=opset, device="cpu",
+                no_post_process=True)
+
+    from transformers import VisionEncoderDecoderModel
+    model = VisionEncoderDecoderModel.from_pretrained(model_dir)
+    model.generation_config.save_pretrained(output_dir)
+
+    for name in ("encoder_model.onnx", "decoder_model.onnx", "decoder_with_past_model.onnx"):
+        path = os.path.join(output_dir, name)
+        if not os.path.exists(path):
+            raise RuntimeError(f"Beklenen grafik üretilmedi: {path}")
+        logger.info(f"Exported {path} ({os.path.getsize(path) / (1024 * 1024):.1f} MB)")
+
+
+def check_parity(output_dir, images_dir, max_len=512):
+    """PyTorch ve ONNX çıktılarını karşılaştır; hepsi aynıysa True döner"""
+    from PIL import Image
+    import donut_ocr
+
+    # Referans her zaman fp32 PyTorch modelidir (DONUT_PRECISION int8/bf16 olsa bile);
+    # ONNX grafiği fp32 ağırlıklardan dışa aktarıldığı için quantize modelle kıyaslanmaz
+    torch_model = donut_ocr.load_model("fp32")
+    onnx_model = donut_ocr.load_onnx_model(output_dir)
+    tokenizer = donut_ocr.get_processor().tokenizer
+
+    paths = sorted(p for p in Path(images_dir).glob("*") if p.suffix.lower() in IMAGE_EXTENSIONS)
+    mismatches = 0
+    for path in paths:
+        image = Image.open(path).convert("RGB")
+        outputs = {}
+        for name, m in (("torch", torch_model), ("onnx", onnx_model)):
+            start = time.perf_counter()
+            out_ids, _ = donut_ocr.generate_ids([image], max_len=max_len, donut_model=m)
+            elapsed = (time.perf_counter() - start) * 1000
+            outputs[name] = tokenizer.batch_decode(out_ids, skip_special_tokens=True)[0].strip()
+            logger.info(f"{path.name} [{name}] {elapsed:.0f} ms")
+        if outputs["torch"] != outputs["onnx"]:
+            mismatches += 1
+            logger.warning(f"{path.name}: outputs differ\n  torch: {outputs['torch']}\n  onnx:  {outputs['onnx']}")
+
+    logger.info(f"Parity check: {len(paths) - mismatches}/{len(paths)} identical")
+    return mismatches == 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Donut ONNX export")
+    parser.add_argument("--model", default="./donut_cord_v2")
+    parser.add_argument("--output", default="./donut_cord_v2_onnx")
+    parser.add_argument("--opset", type=int, default=14)
+    parser.add_argument("--skip-export", action="store_true", help="Yalnızca --check çalıştır")
+    parser.add_argument("--check", metavar="IMAGES_DIR", help="PyTorch/ONNX çıktı eşitliğini kontrol et")
+    args = parser.parse_args()
+
+    if not args.skip_export:
+        export(args.model, args.output, args.opset)
+    if args.check and not check_parity(args.output, args.check):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
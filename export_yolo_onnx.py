@@ -0,0 +1,103 @@
+"""
+YOLOv8 fatura dedektörünü (best.pt) ONNX veya OpenVINO IR olarak dışa aktarır
+ve dışa aktarılmış modelin kutularının .pt modeliyle uyumunu kontrol eder.
+
+Kullanım:
+    python export_yolo_onnx.py --model best.pt --format onnx --check test_images
+    YOLO_MODEL_PATH=best.onnx python main.py
+
+Parite kontrolünde her .pt kutusu için IoU >= --iou-tol olan ve güven skoru
+--score-tol içinde kalan bir eşleşme aranır; eşleşmeyen kutu varsa araç 1
+çıkış koduyla biter.
+"""
+import argparse
+import logging
+import sys
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from yolo_onnx import ExportedYoloDetector
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger("export_yolo_onnx")
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+def export(model_path, fmt, imgsz):
+    from torch_safe_globals import register_safe_globals
+    from ultralytics import YOLO
+
+    register_safe_globals()
+    # Sabit 640x640 girdi, dinamik batch: dedektör letterbox'ı kare tuvale uygular
+    exported = YOLO(model_path).export(format=fmt, imgsz=imgsz, dynamic=fmt == "onnx", simplify=fmt == "onnx")
+    logger.info(f"Exported {model_path} -> {exported}")
+    return exported
+
+
+def box_iou(a, b):
+    """(N, 4) ve (M, 4) xyxy kutular arasındaki IoU matrisi"""
+    tl = np.maximum(a[:, None, :2], b[None, :, :2])
+    br = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = (br - tl).clip(0).prod(axis=2)
+    area_a = (a[:, 2:] - a[:, :2]).prod(axis=1)
+    area_b = (b[:, 2:] - b[:, :2]).prod(axis=1)
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+
+def check_parity(pt_path, exported_path, images_dir, imgsz, conf, iou_tol, score_tol):
+    from torch_safe_globals import register_safe_globals
+    from ultralytics import YOLO
+
+    register_safe_globals()
+    pt_model = YOLO(pt_path)
+    detector = ExportedYoloDetector(exported_path, imgsz=imgsz)
+
+    paths = sorted(p for p in Path(images_dir).glob("*") if p.suffix.lower() in IMAGE_EXTENSIONS)
+    failures = 0
+    for path in paths:
+        image = cv2.imread(str(path))
+        ref = pt_model.predict(image, conf=conf, imgsz=imgsz, save=False, verbose=False)[0].boxes
+        ref_boxes, ref_scores = ref.xyxy.cpu().numpy(), ref.conf.cpu().numpy()
+        det = detector.predict([image], conf=conf)[0]
+
+        matched = 0
+        if len(ref_boxes) and len(det):
+            ious = box_iou(ref_boxes, det[:, :4])
+            for i in range(len(ref_boxes)):
+                j = ious[i].argmax()
+                if ious[i, j] >= iou_tol and abs(ref_scores[i] - det[j, 4]) <= score_tol:
+                    matched += 1
+        ok = matched == len(ref_boxes) == len(det)
+        failures += not ok
+        logger.info(f"{path.name}: pt={len(ref_boxes)} exported={len(det)} matched={matched} {'OK' if ok else 'MISMATCH'}")
+
+    logger.info(f"Parity check: {len(paths) - failures}/{len(paths)} images match")
+    return failures == 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="YOLO dedektör export ve parite kontrolü")
+    parser.add_argument("--model", default="best.pt")
+    parser.add_argument("--format", default="onnx", choices=["onnx", "openvino"])
+    parser.add_argument("--imgsz", type=int, default=640)
+    parser.add_argument("--exported", help="Mevcut export'u kullan (export adımını atla)")
+    parser.add_argument("--check", metavar="IMAGES_DIR", help="Kutuların .pt modeliyle uyumunu kontrol et")
+    parser.add_argument("--conf", type=float, default=0.20)
+    parser.add_argument("--iou-tol", type=float, default=0.9)
+    parser.add_argument("--score-tol", type=float, default=0.05)
+    args = parser.parse_args()
+
+    exported = args.exported or export(args.model, args.format, args.imgsz)
+    if args.check and not check_parity(args.model, exported, args.check, args.imgsz,
+                                       args.conf, args.iou_tol, args.score_tol):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
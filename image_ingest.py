@@ -0,0 +1,153 @@
+"""
+Görüntü girişi: byte'ları tek seferde BGR NumPy dizisine decode eder.
+
+Kaynak JPEG ise ve uzun kenarı INGEST_MAX_SIDE'ın en az iki katıysa, libjpeg'in
+DCT ölçekleme (draft) desteğiyle 1/2, 1/4 veya 1/8 boyutta decode edilir; tam
+boyutlu piksel dizisi hiç oluşturulmaz. Dedektör görüntüyü zaten IMGSZ'ye
+küçülttüğü için tespit sonucu değişmez. Küçültülmüş görüntüde uzun kenarı
+FULL_RES_CROP_MIN_SIDE'dan kısa kalan crop'lar (fotoğrafta küçük görünen faturalar)
+için orijinal görüntü ilk ihtiyaçta bir kez tam boyutta decode edilir ve crop
+oradan alınır; böylece OCR'a giden çözünürlük düşmez.
+"""
+import os
+
+from metrics import timed
+
+# Draft decode sonrası uzun kenar bu değerin altına inmez; 0 draft decode'u kapatır
+INGEST_MAX_SIDE = int(os.environ.get("INGEST_MAX_SIDE", "1600"))
+# Küçültülmüş görüntüde bundan kısa kalan crop'lar tam çözünürlükten alınır (Donut girişinin uzun kenarı)
+FULL_RES_CROP_MIN_SIDE = int(os.environ.get("FULL_RES_CROP_MIN_SIDE", "1280"))
+
+# Boyut bilgisi taşıyan JPEG SOF işaretleri (DHT, JPG ve DAC hariç)
+_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+_SIGNATURES = (
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"BM", "bmp"),
+    (b"II*\x00", "tiff"),
+    (b"MM\x00*", "tiff"),
+)
+
+
+def sniff_format(data):
+    """Başlık byte'larından görüntü formatını bul (decode etmeden); tanınmazsa None"""
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    for signature, fmt in _SIGNATURES:
+        if data[:len(signature)] == signature:
+            return fmt
+    return None
+
+
+def jpeg_size(data):
+    """JPEG başlığındaki SOF segmentinden (genişlik, yükseklik); bulunamazsa None"""
+    if data[:2] != b"\xff\xd8":
+        return None
+    i, n = 2, len(data)
+    while i + 4 <= n:
+        if data[i] != 0xFF:
+            i += 1
+            continue
+        marker = data[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            # Uzunluk alanı olmayan işaretler
+            i += 2
+            continue
+        if marker in _SOF_MARKERS:
+            if i + 9 > n:
+                return None
+            height = int.from_bytes(data[i + 5:i + 7], "big")
+            width = int.from_bytes(data[i + 7:i + 9], "big")
+            return width, height
+        i += 2 + int.from_bytes(data[i + 2:i + 4], "big")
+    return None
+
+
+def reduction_factor(width, height, max_side=INGEST_MAX_SIDE):
+    """Uzun kenarı max_side'ın altına düşürmeyen en büyük JPEG ölçek böleni (1, 2, 4 veya 8)"""
+    if max_side <= 0:
+        return 1
+    for factor in (8, 4, 2):
+        if max(width, height) / factor >= max_side:
+            return factor
+    return 1
+
+
+class DecodedImage:
+    """
+    Decode edilmiş görüntü: array (muhtemelen küçültülmüş BGR dizisi) ve gerekirse
+    tam çözünürlüğü yeniden üretmek için kaynak byte'lar.
+
+    Args:
+        data: Kaynak byte'lar (array zaten tam çözünürlükteyse None olabilir)
+        array: BGR NumPy dizisi
+        factor: array'in orijinale göre küçültme oranı (1: tam çözünürlük)
+    """
+
+    def __init__(self, data, array, factor=1):
+        self.data = data if factor > 1 else None
+        self.array = array
+        self.factor = factor
+        self._full = None
+
+    @property
+    def shape(self):
+        return self.array.shape
+
+    def full_resolution(self):
+        """Tam çözünürlüklü diziyi döndür (küçültülmüş decode edildiyse ilk çağrıda bir kez decode eder)"""
+        if self.factor == 1:
+            return self.array
+        if self._full is None:
+            import cv2
+            import numpy as np
+            with timed("decode"):
+                self._full = cv2.imdecode(np.frombuffer(self.data, np.uint8), cv2.IMREAD_COLOR)
+        return self._full
+
+    def crop(self, x1, y1, x2, y2, min_side=FULL_RES_CROP_MIN_SIDE):
+        """
+        array koordinatlarındaki kutuyu kırp. Görüntü küçültülmüşse ve crop'un uzun
+        kenarı min_side'dan kısaysa crop tam çözünürlüklü görüntüden alınır.
+        """
+        if self.factor == 1 or max(x2 - x1, y2 - y1) >= min_side:
+            return self.array[y1:y2, x1:x2]
+        full = self.full_resolution()
+        sy = full.shape[0] / self.array.shape[0]
+        sx = full.shape[1] / self.array.shape[1]
+        return full[int(y1 * sy):int(round(y2 * sy)), int(x1 * sx):int(round(x2 * sx))]
+
+
+def decode_image(data, max_side=INGEST_MAX_SIDE):
+    """
+    Görüntü byte'larını tek seferde decode et (büyük JPEG'lerde draft/ölçekli decode).
+
+    Returns:
+        DecodedImage; byte'lar boşsa veya decode edilemiyorsa None
+    """
+    if not data:
+        return None
+    import cv2
+    import numpy as np
+    factor = 1
+    if max_side > 0 and sniff_format(data) == "jpeg":
+        size = jpeg_size(data)
+        if size is not None:
+            factor = reduction_factor(*size, max_side=max_side)
+    flag = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2,
+            4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}[factor]
+    with timed("decode"):
+        array = cv2.imdecode(np.frombuffer(data, np.uint8), flag)
+    if array is None:
+        return None
+    return DecodedImage(data, array, factor)
+
+
+def read_image(path, max_side=INGEST_MAX_SIDE):
+    """Dosyayı okuyup decode_image ile decode et"""
+    with open(path, "rb") as f:
+        return decode_image(f.read(), max_side)
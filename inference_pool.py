@@ -0,0 +1,93 @@
+"""
+FastAPI endpoint'leri için sınırlı inference çalıştırıcısı.
+
+Senkron model çağrıları event loop dışında, sabit sayıda worker thread'i olan
+bir havuzda çalıştırılır. Çalışan + bekleyen iş sayısı sınırı aşarsa yeni iş
+kabul edilmez ve QueueFullError fırlatılır; API bunu Retry-After başlıklı bir
+503 yanıtına çevirir.
+"""
+import asyncio
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger("inference_pool")
+
+
+class QueueFullError(Exception):
+    """İnference kuyruğu dolu olduğunda fırlatılır"""
+
+
+class InferencePool:
+    def __init__(self, max_workers=4, max_queue=32):
+        self.max_workers = max(1, int(max_workers))
+        self.max_queue = max(0, int(max_queue))
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                            thread_name_prefix="inference")
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._running = 0
+
+    def _try_acquire(self):
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queue:
+                return False
+            self._pending += 1
+            return True
+
+    def _release(self):
+        with self._lock:
+            self._pending -= 1
+
+    def _call(self, fn, *args, **kwargs):
+        with self._lock:
+            self._running += 1
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._running -= 1
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        fn'i havuza gönder ve sonucunu taşıyan bir asyncio Future döndür.
+        Kapasite kontrolü çağrı anında yapılır; böylece streaming yanıtlar
+        başlamadan önce reddedilebilir.
+
+        Raises:
+            QueueFullError: Havuz ve kuyruk doluysa
+        """
+        if not self._try_acquire():
+            raise QueueFullError("Inference kuyruğu dolu")
+        loop = asyncio.get_running_loop()
+        try:
+            future = loop.run_in_executor(
+                self._executor, functools.partial(self._call, fn, *args, **kwargs))
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(lambda _: self._release())
+        return future
+
+    async def run(self, fn, *args, **kwargs):
+        """
+        fn'i havuzda çalıştır ve sonucunu bekle.
+
+        Raises:
+            QueueFullError: Havuz ve kuyruk doluysa
+        """
+        return await self.submit(fn, *args, **kwargs)
+
+    def stats(self):
+        """Havuzun anlık doluluk bilgisini döndür"""
+        with self._lock:
+            return {
+                "workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "running": self._running,
+                "queued": max(0, self._pending - self._running),
+            }
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
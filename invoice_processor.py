@@ -3,13 +3,22 @@ import sys
 import json
 import tempfile
 import base64
-import io
+import copy
+import functools
 import logging
+import shutil
+import threading
+import uuid
 from pathlib import Path
-from PIL import Image
-from ultralytics import YOLO
-from donut_ocr import img2json
-# from docgeonet_correct import correct_with_docgeonet  # DocGeoNet devre dışı
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from donut_ocr import img2json_batch, get_batcher, checkpoint_version, warmup as warmup_donut, STOP_CANCELLED
+from model_registry import registry
+from phash_index import phash
+from metrics import timed, CACHE_LOOKUPS, INVOICES_DETECTED, NEAR_DUPLICATE_HITS, OCR_RESULTS
+from image_ingest import DecodedImage, decode_image, read_image, sniff_format
+from yolo_onnx import ExportedYoloDetector, is_exported_model
+from docgeonet_correct import (get_rectifier, needs_rectification, DOCGEONET_DIR,
+                               GATE_MAX_SKEW_DEG, GATE_MAX_CURVATURE_DEG, GATE_MIN_LINES)
 import time
 import traceback
 
@@ -23,51 +32,131 @@ logging.basicConfig(
 )
 logger = logging.getLogger("invoice_processor")
 
+# Crop'ları OCR'dan önce süreç içi DocGeoNet ile düzelt (model bir kez yüklenir)
+RECTIFY = os.environ.get("DOCGEONET_RECTIFY", "0").lower() in ("1", "true", "yes")
+# Düzeltme açıkken yalnızca eğik/bükülmüş görünen crop'ları düzelt (düz taramalar atlanır)
+RECTIFY_GATE = os.environ.get("RECTIFY_GATE", "1").lower() in ("1", "true", "yes")
+
+
+def load_detector(model_path, imgsz=640):
+    """
+    YOLO dedektörünü yükle: .pt için Ultralytics YOLO, dışa aktarılmış modeller
+    (ONNX / OpenVINO IR) için ExportedYoloDetector.
+    """
+    if is_exported_model(model_path):
+        # Dışa aktarılmış dedektör: Ultralytics predictor'ı olmadan,
+        # NumPy letterbox + NMS ile çalışır ve thread-safe'tir
+        return ExportedYoloDetector(model_path, imgsz=imgsz)
+
+    # Register safe globals before loading the YOLO model
+    register_safe_globals()
+
+    # PyTorch weights_only yüklemeyi devre dışı bırak
+    import torch
+    if hasattr(torch, 'set_default_tensor_type'):
+        # Eski sürümler için
+        original_load = torch.load
+        def safe_load(*args, **kwargs):
+            kwargs.setdefault('weights_only', False)
+            return original_load(*args, **kwargs)
+        torch.load = safe_load
+
+    from ultralytics import YOLO
+    return YOLO(model_path)
+
 
 class InvoiceProcessor:
-    def __init__(self, yolo_model_path="best.pt", device=None):
+    def __init__(self, yolo_model_path="best.pt", device=None, use_batching=True,
+                 save_crops=False, crop_dir=None, result_cache=None, crop_index=None, rectify=None):
         self.YOLO_MODEL_PATH = yolo_model_path
-        self.DOCGEONET_DIR = "DocGeoNet"
+        self.DOCGEONET_DIR = DOCGEONET_DIR
+        self.rectify = RECTIFY if rectify is None else rectify
+        self.rectify_gate = RECTIFY_GATE
         self.CONF_THRESHOLD = 0.20
         self.IMGSZ = 640
+        self.DETECT_BATCH_SIZE = max(1, int(os.environ.get("DETECT_BATCH_SIZE", "8")))
 
-        # Always use temporary directories for processing
-        self.use_temp_dirs = True
+        # Crop'ları eşzamanlı isteklerle birlikte Donut batcher'ı üzerinden işle
+        self.use_batching = use_batching
 
-        # Create temporary directories that will be cleaned up after processing
-        self.temp_base_dir = tempfile.mkdtemp(prefix="invoice_processor_")
-        self.CROP_DIR = os.path.join(self.temp_base_dir, "cropped")
-        self.REC_DIR = os.path.join(self.temp_base_dir, "rectified")
-        os.makedirs(self.CROP_DIR, exist_ok=True)
-        os.makedirs(self.REC_DIR, exist_ok=True)
+        # Crop'lar varsayılan olarak bellekte kalır ve doğrudan OCR'a verilir.
+        # save_crops açıksa (debug) crop'lar JPEG olarak diske de yazılır:
+        # crop_dir verilmişse oraya kalıcı olarak, verilmemişse her istek için
+        # açılıp istek bitince silinen geçici bir alt klasöre.
+        # Bu nesne yalnızca modelleri ve ayarları tutar; isteğe ait tüm durum
+        # (crop'lar, process_id, süreler, geçici klasörler) process_image içinde yereldir.
+        self.save_crops = save_crops or crop_dir is not None
+        self.use_temp_dirs = self.save_crops and crop_dir is None
 
-        # Register safe globals before loading the YOLO model
-        # This is now handled by the centralized module, but we call it again to be sure
-        register_safe_globals()
+        if self.use_temp_dirs:
+            self.temp_base_dir = tempfile.mkdtemp(prefix="invoice_processor_")
+            self.CROP_DIR = self.temp_base_dir
+        else:
+            self.CROP_DIR = crop_dir
+
+        # Aynı görüntü byte'ları için önceki sonucu döndüren opsiyonel önbellek (result_cache.ResultCache)
+        self.result_cache = result_cache
+
+        # Yakın-kopya crop'lar için OCR çıktısını yeniden kullanan opsiyonel indeks (phash_index.CropIndex)
+        self.crop_index = crop_index
 
-        # Log initialization information
-        logger.info(f"Initializing InvoiceProcessor with model: {self.YOLO_MODEL_PATH}")
+        # Ayarlanırsa (pipeline.InvoicePipeline) process_image_bytes görüntüleri aşamalı hatta işler
+        self.pipeline = None
 
+        # Ultralytics predictor'ı thread-safe değil; tespit çağrıları bu kilitle sıraya girer,
+        # OCR ise Donut batcher üzerinden eşzamanlı isteklerle birlikte işlenir
+        self._yolo_lock = threading.Lock()
+
+        # Dedektör ilk tespit çağrısında (veya warmup() ile) yüklenir; aynı model yolunu
+        # kullanan tüm InvoiceProcessor örnekleri tek bir yüklü modeli paylaşır
+        self._requested_device = device
+        self._detector_name = f"yolo:{os.path.abspath(self.YOLO_MODEL_PATH)}"
+        registry.register(self._detector_name,
+                          functools.partial(load_detector, self.YOLO_MODEL_PATH, self.IMGSZ))
+        logger.info(f"Initializing InvoiceProcessor with model: {self.YOLO_MODEL_PATH} (lazy)")
+
+    @property
+    def detector(self):
         try:
-            # PyTorch weights_only yüklemeyi devre dışı bırak
-            import torch
-            if hasattr(torch, 'set_default_tensor_type'):
-                # Eski sürümler için
-                original_load = torch.load
-                def safe_load(*args, **kwargs):
-                    kwargs.setdefault('weights_only', False)
-                    return original_load(*args, **kwargs)
-                torch.load = safe_load
-            
-            # YOLOv8 modelini yükle
-            self.yolo_model = YOLO(self.YOLO_MODEL_PATH)
-            self.device = device if device else ('cuda' if self.yolo_model.device.type == 'cuda' else 'cpu')
-            logger.info(f"YOLOv8 loaded: {self.YOLO_MODEL_PATH} | Device: {self.device}")
+            return registry.get(self._detector_name)
         except Exception as e:
             logger.error(f"Failed to load YOLO model: {str(e)}")
             logger.error(traceback.format_exc())
             raise
 
+    @property
+    def exported_detector(self):
+        detector = self.detector
+        return detector if isinstance(detector, ExportedYoloDetector) else None
+
+    @property
+    def yolo_model(self):
+        detector = self.detector
+        return None if isinstance(detector, ExportedYoloDetector) else detector
+
+    @property
+    def device(self):
+        if self.exported_detector is not None:
+            return 'cpu'
+        if self._requested_device:
+            return self._requested_device
+        return 'cuda' if self.yolo_model.device.type == 'cuda' else 'cpu'
+
+    def warmup(self):
+        """
+        Dedektörü ve Donut modelini yükleyip sahte girdilerle birer kez çalıştır.
+        İlk gerçek isteğin model yükleme ve ilk-çağrı maliyetini ödememesi için
+        servis başlarken çağrılır.
+        """
+        import numpy as np
+        start = time.perf_counter()
+        self._detect([np.zeros((self.IMGSZ, self.IMGSZ, 3), dtype=np.uint8)])
+        logger.info(f"YOLOv8 ready: {self.YOLO_MODEL_PATH} | Device: {self.device}")
+        if self.rectify:
+            get_rectifier().warmup()
+        warmup_donut()
+        logger.info(f"Warmup completed in {time.perf_counter() - start:.1f} s")
+
     def __del__(self):
         """Destructor to ensure temporary directories are cleaned up when object is destroyed"""
         if hasattr(self, 'use_temp_dirs') and self.use_temp_dirs and hasattr(self, 'temp_base_dir'):
@@ -82,197 +171,554 @@ class InvoiceProcessor:
     def clamp(self, v, lo, hi):
         return max(lo, min(v, hi))
 
-    def cleanup_temp_dirs(self):
-        """Clean up temporary directories if they exist"""
-        if hasattr(self, 'use_temp_dirs') and self.use_temp_dirs and hasattr(self, 'temp_base_dir'):
-            if os.path.exists(self.temp_base_dir):
-                try:
-                    import shutil
-                    shutil.rmtree(self.temp_base_dir)
-                    print(f"Temporary directory cleaned up: {self.temp_base_dir}")
-                except Exception as e:
-                    print(f"Error cleaning up temporary directory: {str(e)}")
+    def _make_request_dir(self, process_id):
+        """İsteğe özel geçici crop klasörü oluştur (yalnızca geçici klasörle crop kaydı açıksa)"""
+        if not self.use_temp_dirs:
+            return None
+        request_dir = os.path.join(self.temp_base_dir, process_id)
+        os.makedirs(request_dir, exist_ok=True)
+        return request_dir
 
-            # Create new temporary directories for next processing
-            self.temp_base_dir = tempfile.mkdtemp(prefix="invoice_processor_")
-            self.CROP_DIR = os.path.join(self.temp_base_dir, "cropped")
-            self.REC_DIR = os.path.join(self.temp_base_dir, "rectified")
-            os.makedirs(self.CROP_DIR, exist_ok=True)
-            os.makedirs(self.REC_DIR, exist_ok=True)
-
-    def crop_invoices_from_img(self, img_path):
-        """Fatura görüntüsünü kırp"""
-        results = self.yolo_model.predict(img_path, conf=self.CONF_THRESHOLD,
-                                          imgsz=self.IMGSZ, device=self.device,
-                                          save=False, verbose=False)[0]
-        n = len(results.boxes)
-        print(f"{Path(img_path).name} - {n} fatura bulundu")
-        orig = results.orig_img.copy()
-        H, W = orig.shape[:2]
-        crop_paths = []
-
-        for idx, b in enumerate(results.boxes.xyxy.cpu().numpy().astype(int)):
+    def _cleanup_request_dir(self, request_dir):
+        """İsteğe özel geçici crop klasörünü sil"""
+        if request_dir and os.path.exists(request_dir):
+            try:
+                shutil.rmtree(request_dir)
+            except Exception as e:
+                print(f"Error cleaning up temporary directory: {str(e)}")
+
+    def crop_invoices_from_img(self, img_path, crop_dir=None):
+        """
+        Fatura görüntüsünü kırp.
+
+        Returns:
+            ([(crop_adı, crop_dizisi), ...], fatura_sayısı). Crop dizileri
+            decode edilen görüntü üzerindeki BGR view'lardır; save_crops açıksa
+            crop adı crop_dir (verilmezse CROP_DIR) altına yazılan JPEG dosyasının yoludur.
+        """
+        orig, boxes = self._detect([img_path])[0]
+        return self._crops_from_detection(orig, boxes, Path(img_path).name, crop_dir)
+
+    def crop_invoices_from_imgs(self, images, names, crop_dir=None):
+        """
+        Birden fazla görüntüyü (dosya yolu, DecodedImage veya BGR NumPy dizisi) DETECT_BATCH_SIZE'lık
+        gruplar halinde tek predict çağrısıyla tespit edip kırp.
+
+        Birden fazla grup varsa bir sonraki grubun decode/letterbox işlemi, mevcut grup
+        dedektörde çalışırken arka plan thread'inde yapılır.
+
+        Returns:
+            Her görüntü için crop_invoices_from_img ile aynı (crops, fatura_sayısı) çifti
+        """
+        if not images:
+            return []
+        starts = list(range(0, len(images), self.DETECT_BATCH_SIZE))
+        if len(starts) == 1:
+            return [self._crops_from_detection(orig, boxes, name, crop_dir)
+                    for (orig, boxes), name in zip(self._detect(images), names)]
+
+        outputs = []
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="detect-prefetch") as prefetch:
+            pending = prefetch.submit(self._prepare_detection, images[:self.DETECT_BATCH_SIZE])
+            for i, start in enumerate(starts):
+                prepared = pending.result()
+                if i + 1 < len(starts):
+                    next_start = starts[i + 1]
+                    pending = prefetch.submit(self._prepare_detection,
+                                              images[next_start:next_start + self.DETECT_BATCH_SIZE])
+                chunk_names = names[start:start + self.DETECT_BATCH_SIZE]
+                for (orig, boxes), name in zip(self._detect(prepared=prepared), chunk_names):
+                    outputs.append(self._crops_from_detection(orig, boxes, name, crop_dir))
+        return outputs
+
+    @staticmethod
+    def _as_decoded(image):
+        """Dosya yolunu tek seferde decode et (image_ingest), NumPy dizisini DecodedImage'a sar"""
+        if isinstance(image, DecodedImage):
+            return image
+        if isinstance(image, str):
+            decoded = read_image(image)
+            if decoded is None:
+                raise ValueError("Görüntü okunamadı")
+            return decoded
+        return DecodedImage(None, image)
+
+    def _prepare_detection(self, images):
+        """
+        Tespit girdisini hazırla: dosya yollarını decode et, dışa aktarılmış dedektörde
+        letterbox + normalize uygula. (DecodedImage listesi, dedektör_girdisi) döner.
+        """
+        sources = [self._as_decoded(img) for img in images]
+        detector = self.exported_detector
+        return sources, detector.preprocess([src.array for src in sources]) if detector is not None else None
+
+    def _detect(self, images=None, prepared=None):
+        """
+        Görüntülerde (dosya yolu, DecodedImage veya BGR dizisi) tek predict çağrısıyla fatura
+        tespiti yap. prepared verilirse (_prepare_detection çıktısı) decode/letterbox adımı atlanır.
+
+        Returns:
+            Her görüntü için (DecodedImage, decode edilen görüntü koordinatlarında (N, 4) xyxy kutu dizisi) çifti
+        """
+        if prepared is None and not images:
+            return []
+        sources, inputs = prepared if prepared is not None else self._prepare_detection(images)
+        if not sources:
+            return []
+        arrays = [src.array for src in sources]
+        if self.exported_detector is not None:
+            with timed("detect"):
+                detections = self.exported_detector.predict(arrays, conf=self.CONF_THRESHOLD, prepared=inputs)
+            return [(src, det[:, :4]) for src, det in zip(sources, detections)]
+
+        with self._yolo_lock, timed("detect"):
+            results = self.yolo_model.predict(arrays, conf=self.CONF_THRESHOLD,
+                                              imgsz=self.IMGSZ, device=self.device,
+                                              save=False, verbose=False)
+        return [(src, r.boxes.xyxy.cpu().numpy()) for src, r in zip(sources, results)]
+
+    def _crops_from_detection(self, image, boxes, name, crop_dir=None):
+        """
+        Tespit edilen kutuları kırp. Crop'lar decode edilen görüntü üzerinde view'dır;
+        görüntü küçültülerek decode edildiyse küçük kalan crop'lar tam çözünürlükten alınır
+        (image_ingest.DecodedImage.crop).
+        """
+        with timed("crop"):
+            return self._crop_boxes(self._as_decoded(image), boxes, name, crop_dir)
+
+    def _crop_boxes(self, source, boxes, name, crop_dir):
+        n = len(boxes)
+        INVOICES_DETECTED.inc(n)
+        logger.info(f"{name} - {n} fatura bulundu")
+        H, W = source.shape[:2]
+        crops = []
+
+        for idx, b in enumerate(boxes.astype(int)):
             x1, y1, x2, y2 = [self.clamp(x, 0, W - 1 if i % 2 == 0 else H - 1) for i, x in
                               enumerate([b[0], b[1], b[2], b[3]])]
-            crop = orig[y1:y2, x1:x2]
-            cpath = Path(self.CROP_DIR) / f"crop_{Path(img_path).stem}_{idx:02d}.jpg"
-            os.makedirs(os.path.dirname(cpath), exist_ok=True)
-            import cv2
-            cv2.imwrite(str(cpath), crop)
-            crop_paths.append(str(cpath))
-        return crop_paths, n
-
-    def process_image(self, image_path):
-        """Tek bir fatura görüntüsünü işle"""
+            crop = source.crop(x1, y1, x2, y2)
+            crop_name = f"crop_{Path(name).stem}_{idx:02d}.jpg"
+            if self.save_crops:
+                cpath = Path(crop_dir or self.CROP_DIR) / crop_name
+                os.makedirs(os.path.dirname(cpath), exist_ok=True)
+                import cv2
+                cv2.imwrite(str(cpath), crop)
+                crop_name = str(cpath)
+            crops.append((crop_name, crop))
+        return crops, n
+
+    def rectify_crops(self, crops):
+        """
+        rectify açıksa crop'ları ([(crop_adı, crop_dizisi), ...]) DocGeoNet ile düzelt.
+        rectify_gate açıksa yalnızca needs_rectification'ın eğik/bükülmüş bulduğu crop'lar
+        tek seferde düzeltilir. Düzeltme başarısız olursa orijinal crop'lar kullanılır.
+
+        Returns:
+            (crop'lar, kararlar). Kararlar her crop için sonuca eklenecek
+            {"applied": bool, ...} kaydıdır; rectify kapalıysa None'dır.
+        """
+        if not self.rectify:
+            return crops, [None] * len(crops)
+        if self.rectify_gate:
+            decisions = [needs_rectification(crop) for _, crop in crops]
+        else:
+            decisions = [{"rectify": True, "reason": "gate_disabled"} for _ in crops]
+        selected = [i for i, decision in enumerate(decisions) if decision.pop("rectify")]
+        for decision in decisions:
+            decision["applied"] = False
+
+        crops = list(crops)
+        if selected:
+            try:
+                with timed("rectify"):
+                    rectified = get_rectifier().rectify([crops[i][1] for i in selected])
+            except Exception as e:
+                logger.error(f"DocGeoNet rectification failed, using original crops: {str(e)}")
+                for i in selected:
+                    decisions[i]["error"] = str(e)
+                return crops, decisions
+            for i, img in zip(selected, rectified):
+                crops[i] = (crops[i][0], img)
+                decisions[i]["applied"] = True
+        return crops, decisions
+
+    def submit_ocr(self, images, budget=None):
+        """
+        Crop'ları OCR için gönder; her crop için {"text", "num_tokens", "stop_reason"} döndüren
+        bir Future listesi döner. Batcher açıksa crop'lar diğer isteklerin crop'larıyla aynı
+        batch'te işlenebilir, kapalıysa tüm crop'lar tek bir img2json_batch çağrısında işlenir.
+        budget (donut_ocr.DecodeBudget) isteğin tüm crop'larının decode'unu sınırlar.
+        """
+        if self.use_batching:
+            batcher = get_batcher()
+            return [batcher.submit(img, budget=budget) for img in images]
+
+        futures = [Future() for _ in images]
         try:
-            # Girdi doğrulama
-            if not image_path or not isinstance(image_path, str):
-                timestamp = int(time.time())
-                process_id = f"process_{timestamp}_invalid_path"
-                return {
-                    "status": "error",
-                    "message": "Geçersiz görüntü yolu",
-                    "error_details": "image_path parametresi geçerli bir string olmalıdır",
-                    "timestamp": timestamp,
-                    "process_id": process_id,
-                    "invoice_count": 0,
-                    "success_count": 0,
-                    "error_count": 0,
-                    "results": []
-                }
+            outputs = img2json_batch(images, budgets=[budget] * len(images))
+            for future, output in zip(futures, outputs):
+                future.set_result(output)
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+        return futures
 
-            if not os.path.exists(image_path):
-                timestamp = int(time.time())
-                process_id = f"process_{timestamp}_file_not_found"
-                return {
-                    "status": "error",
-                    "message": f"Dosya bulunamadı: {image_path}",
-                    "error_details": "Belirtilen dosya sistemde bulunamadı",
-                    "timestamp": timestamp,
-                    "process_id": process_id,
-                    "input_image": image_path,
-                    "invoice_count": 0,
-                    "success_count": 0,
-                    "error_count": 0,
-                    "results": []
-                }
+    def submit_crops(self, crops, budget=None):
+        """
+        Crop dizilerini OCR'a gönder; crop_index açıksa önce yakın-kopya aranır.
 
-            # Benzersiz bir işlem ID'si oluştur
-            process_id = f"process_{int(time.time())}_{hash(image_path) % 10000}"
-            timestamp = int(time.time())
+        Returns:
+            Her crop için (future, eşleşme) çifti. Eşleşme, indeksten dönen crop'lar için
+            {"distance": hamming_mesafesi, "hash": hex_hash}, diğerleri için None'dır.
+        """
+        if self.crop_index is None:
+            return [(future, None) for future in self.submit_ocr(crops, budget)]
 
-            # 1. Faturayı tespit et ve kırp
-            crop_paths, invoice_count = self.crop_invoices_from_img(image_path)
-            if not crop_paths:
-                # Clean up temporary directories before returning
-                if hasattr(self, 'use_temp_dirs') and self.use_temp_dirs:
-                    self.cleanup_temp_dirs()
+        hashes = [phash(crop) for crop in crops]
+        submitted = [None] * len(crops)
+        pending = []
+        for i, value in enumerate(hashes):
+            output, distance = self.crop_index.lookup(value)
+            if output is None:
+                pending.append(i)
+                continue
+            future = Future()
+            future.set_result(output)
+            submitted[i] = (future, {"distance": distance, "hash": f"{value:016x}"})
+            NEAR_DUPLICATE_HITS.inc()
+
+        for i, future in zip(pending, self.submit_ocr([crops[i] for i in pending], budget)):
+            future.add_done_callback(functools.partial(self._index_ocr_output, hashes[i]))
+            submitted[i] = (future, None)
+        return submitted
+
+    def _index_ocr_output(self, value, future):
+        """Başarılı ve tamamlanmış (EOS ile biten) OCR çıktısını yakın-kopya indeksine ekle"""
+        if future.exception() is None and future.result().get("stop_reason") is None:
+            self.crop_index.add(value, future.result())
+
+    def _ocr_result_entry(self, crop_name, future, match=None, rectification=None):
+        """OCR Future'ının sonucunu API sonuç kaydına çevir (rectification: rectify_crops kararı)"""
+        entry = self._ocr_entry(crop_name, future, match)
+        if rectification is not None:
+            entry["rectification"] = rectification
+        return entry
+
+    def _ocr_entry(self, crop_name, future, match=None):
+        logger.debug(f"OCR sonucu bekleniyor: {crop_name}")
+        try:
+            output = future.result()
+            stop_reason = output.get("stop_reason")
+            if stop_reason == STOP_CANCELLED:
                 return {
-                    "status": "warning", 
-                    "message": "Fatura tespit edilemedi", 
-                    "process_id": process_id,
-                    "timestamp": timestamp,
-                    "input_image": image_path,
-                    "invoice_count": 0,
-                    "results": []
+                    "image_path": crop_name,
+                    "status": "error",
+                    "error": "OCR iptal edildi",
+                    "stop_reason": stop_reason
+                }
+            ocr_result = output["text"]
+            # JSON formatını doğrula
+            try:
+                # Eğer string JSON formatında ise, parse et
+                parsed_json = json.loads(ocr_result) if isinstance(ocr_result, str) else ocr_result
+                entry = {
+                    "image_path": crop_name,
+                    "status": "success",
+                    "ocr_data": parsed_json
+                }
+            except json.JSONDecodeError:
+                # JSON formatında değilse, düz metin olarak ekle
+                entry = {
+                    "image_path": crop_name,
+                    "status": "partial_success",
+                    "ocr_text": ocr_result
                 }
+            if stop_reason is not None:
+                # Decode bütçesi (token sınırı veya son tarih) dolduğu için çıktı yarım kaldı
+                entry["stop_reason"] = stop_reason
+            if match is not None:
+                # Sonuç OCR çalıştırılmadan yakın-kopya indeksinden geldi
+                entry["near_duplicate"] = match
+            return entry
+        except Exception as e:
+            error_msg = f"OCR hatası: {str(e)}"
+            print(error_msg)
+            return {
+                "image_path": crop_name,
+                "status": "error",
+                "error": error_msg
+            }
 
-            # 2. DocGeoNet atlanıyor - doğrudan crop'ları kullan
-            # rectified_imgs = correct_with_docgeonet(self.DOCGEONET_DIR, self.CROP_DIR, self.REC_DIR)
-            
-            # Crop edilen görüntüleri doğrudan kullan
-            crop_imgs = [str(p) for p in Path(self.CROP_DIR).glob("*.jpg")]
-            
-            # 3. OCR ile işle
-            results = []
-            success_count = 0
-            error_count = 0
-
-            for rec_img_path in crop_imgs:
-                print(f"OCR başlatılıyor: {rec_img_path}")
-                try:
-                    ocr_result = img2json(rec_img_path)
-                    # JSON formatını doğrula
-                    try:
-                        # Eğer string JSON formatında ise, parse et
-                        parsed_json = json.loads(ocr_result) if isinstance(ocr_result, str) else ocr_result
-                        results.append({
-                            "image_path": rec_img_path,
-                            "status": "success",
-                            "ocr_data": parsed_json
-                        })
-                        success_count += 1
-                    except json.JSONDecodeError:
-                        # JSON formatında değilse, düz metin olarak ekle
-                        results.append({
-                            "image_path": rec_img_path,
-                            "status": "partial_success",
-                            "ocr_text": ocr_result
-                        })
-                        success_count += 1
-                except Exception as e:
-                    error_msg = f"OCR hatası: {str(e)}"
-                    print(error_msg)
-                    results.append({
-                        "image_path": rec_img_path,
-                        "status": "error",
-                        "error": error_msg
-                    })
-                    error_count += 1
-
-            # Genel durumu belirle
-            status = "success"
-            if success_count == 0 and error_count > 0:
-                status = "error"
-            elif success_count > 0 and error_count > 0:
-                status = "partial_success"
-
-            # Prepare result
+    def _summarize(self, results, invoice_count, process_id, timestamp, input_image, timings):
+        """Crop sonuçlarından görüntü düzeyindeki yanıtı oluştur (timings None ise eklenmez)"""
+        with timed("serialize"):
+            for r in results:
+                OCR_RESULTS.labels(r["status"]).inc()
+            return self._build_summary(results, invoice_count, process_id, timestamp, input_image, timings)
+
+    def _build_summary(self, results, invoice_count, process_id, timestamp, input_image, timings):
+        if invoice_count == 0 and not results:
             result = {
-                "status": status,
-                "message": f"{invoice_count} fatura tespit edildi, {success_count} başarılı, {error_count} hatalı",
+                "status": "warning", 
+                "message": "Fatura tespit edilemedi", 
                 "process_id": process_id,
                 "timestamp": timestamp,
-                "input_image": image_path,
-                "invoice_count": invoice_count,
-                "success_count": success_count,
-                "error_count": error_count,
-                "results": results
+                "input_image": input_image,
+                "invoice_count": 0,
+                "results": []
             }
+            if timings is not None:
+                result["timings"] = timings
+            return result
+
+        success_count = sum(1 for r in results if r["status"] != "error")
+        error_count = len(results) - success_count
 
-            # Clean up temporary directories after processing
-            if hasattr(self, 'use_temp_dirs') and self.use_temp_dirs:
-                self.cleanup_temp_dirs()
+        # Genel durumu belirle
+        status = "success"
+        if success_count == 0 and error_count > 0:
+            status = "error"
+        elif success_count > 0 and error_count > 0:
+            status = "partial_success"
 
+        result = {
+            "status": status,
+            "message": f"{invoice_count} fatura tespit edildi, {success_count} başarılı, {error_count} hatalı",
+            "process_id": process_id,
+            "timestamp": timestamp,
+            "input_image": input_image,
+            "invoice_count": invoice_count,
+            "success_count": success_count,
+            "error_count": error_count,
+            "results": results
+        }
+        if timings is not None:
+            result["timings"] = timings
+        return result
+
+    def cache_version(self):
+        """Önbellek anahtarına giren model ve eşik bilgisi; biri değişirse eski sonuçlar kullanılmaz"""
+        yolo_version = self.YOLO_MODEL_PATH
+        if os.path.exists(self.YOLO_MODEL_PATH):
+            stat = os.stat(self.YOLO_MODEL_PATH)
+            yolo_version += f":{stat.st_size}:{int(stat.st_mtime)}"
+        version = f"{yolo_version}|conf={self.CONF_THRESHOLD}|imgsz={self.IMGSZ}|donut={checkpoint_version()}"
+        if not self.rectify:
+            return version
+        if self.rectify_gate:
+            return version + (f"|rectify=docgeonet:gate={GATE_MAX_SKEW_DEG},"
+                              f"{GATE_MAX_CURVATURE_DEG},{GATE_MIN_LINES}")
+        return version + "|rectify=docgeonet"
+
+    @staticmethod
+    def _is_complete(result):
+        """Hatasız ve decode bütçesine takılmadan (stop_reason olmadan) tamamlanmış sonuç mu"""
+        return result.get("status") != "error" and not any(
+            r.get("stop_reason") for r in result.get("results", []))
+
+    @staticmethod
+    def _rename_result(result, filename):
+        """
+        Önbellek anahtarı dosya adını içermez; başka bir dosya adıyla kaydedilmiş sonucun
+        input_image ve crop adlarını (image_path) bu isteğin dosya adına göre yeniden yaz.
+        """
+        cached_name = result.get("input_image")
+        if cached_name is None or cached_name == filename:
+            return
+        result["input_image"] = filename
+        old_prefix = f"crop_{Path(cached_name).stem}_"
+        new_prefix = f"crop_{Path(filename).stem}_"
+        for entry in result.get("results", []):
+            crop_path = Path(entry.get("image_path", ""))
+            if crop_path.name.startswith(old_prefix):
+                renamed = new_prefix + crop_path.name[len(old_prefix):]
+                entry["image_path"] = renamed if crop_path.parent == Path(".") else str(crop_path.parent / renamed)
+
+    def _cached(self, image_bytes, compute, filename=None):
+        """
+        compute() sonucunu görüntü byte'larına göre önbellekle. Hata veya stop_reason içeren
+        sonuçlar saklanmaz. Önbellekten gelen sonuçlar yeni process_id/timestamp, cache
+        bilgisi ve (filename verilirse) bu isteğin dosya adıyla kopyalanarak döner.
+        """
+        if self.result_cache is None:
+            return compute()
+        key = self.result_cache.make_key(image_bytes, self.cache_version())
+        result, source = self.result_cache.get_or_compute(key, compute, should_store=self._is_complete)
+        CACHE_LOOKUPS.labels(source).inc()
+        if source == "coalesced" and not self._is_complete(result):
+            # Beklenen işlem kendi bütçesiyle yarıda kaldı (ör. o istemci bağlantıyı kapattı);
+            # bu istek kendi bütçesiyle yeniden çalıştırılır
+            return compute()
+        # Önbellekteki nesne paylaşıldığı için çağırana her zaman kopyası verilir
+        result = copy.deepcopy(result)
+        if source == "miss":
             return result
+        result["timestamp"] = int(time.time())
+        result["process_id"] = self._new_process_id(result["timestamp"])
+        result["cache"] = {"hit": True, "source": source, "key": key}
+        if filename is not None:
+            self._rename_result(result, filename)
+        return result
+
+    @staticmethod
+    def decode_image_bytes(image_bytes):
+        """
+        Görüntü byte'larını tek seferde decode et (büyük JPEG'lerde küçültülmüş decode);
+        DecodedImage veya geçersizse None döner
+        """
+        return decode_image(image_bytes)
+
+    def _new_process_id(self, timestamp):
+        """Eşzamanlı isteklerde çakışmayan benzersiz işlem ID'si üret"""
+        return f"process_{timestamp}_{uuid.uuid4().hex[:8]}"
+
+    def process_image(self, image_path, budget=None):
+        """Tek bir fatura görüntüsünü işle (budget: OCR decode bütçesi, donut_ocr.DecodeBudget)"""
+        # Girdi doğrulama
+        if not image_path or not isinstance(image_path, str):
+            timestamp = int(time.time())
+            process_id = f"process_{timestamp}_invalid_path"
+            return {
+                "status": "error",
+                "message": "Geçersiz görüntü yolu",
+                "error_details": "image_path parametresi geçerli bir string olmalıdır",
+                "timestamp": timestamp,
+                "process_id": process_id,
+                "invoice_count": 0,
+                "success_count": 0,
+                "error_count": 0,
+                "results": []
+            }
+
+        if not os.path.exists(image_path):
+            timestamp = int(time.time())
+            process_id = f"process_{timestamp}_file_not_found"
+            return {
+                "status": "error",
+                "message": f"Dosya bulunamadı: {image_path}",
+                "error_details": "Belirtilen dosya sistemde bulunamadı",
+                "timestamp": timestamp,
+                "process_id": process_id,
+                "input_image": image_path,
+                "invoice_count": 0,
+                "success_count": 0,
+                "error_count": 0,
+                "results": []
+            }
+
+        return self._process_decoded(image_path, image_path, budget)
+
+    def _process_decoded(self, image, input_image, budget=None):
+        """
+        Tek bir görüntüyü (dosya yolu veya DecodedImage) tespit + kırpma + OCR'dan geçir.
+        Görüntü yalnızca bir kez decode edilir; geçici dosya kullanılmaz.
+        """
+        request_dir = None
+        try:
+            # Benzersiz bir işlem ID'si oluştur
+            timestamp = int(time.time())
+            process_id = self._new_process_id(timestamp)
+            request_dir = self._make_request_dir(process_id)
+            timings = {}
+            start_time = time.perf_counter()
+
+            # İstek kuyrukta beklerken iptal edildiyse veya süresi dolduysa tespiti de çalıştırma
+            stop_reason = budget.stop_reason() if budget is not None else None
+            if stop_reason is not None:
+                return self._stopped_result(process_id, timestamp, input_image, stop_reason)
+
+            # 1. Faturayı tespit et ve kırp
+            crops, invoice_count = self.crop_invoices_from_imgs([image], [Path(input_image).name],
+                                                                crop_dir=request_dir)[0]
+            timings["detection_ms"] = round((time.perf_counter() - start_time) * 1000, 1)
+            if not crops:
+                timings["total_ms"] = timings["detection_ms"]
+                return self._summarize([], 0, process_id, timestamp, input_image, timings)
+
+            # 2. Crop'ları (açıksa) bellekte DocGeoNet ile düzelt
+            rectify_start = time.perf_counter()
+            crops, decisions = self.rectify_crops(crops)
+            if self.rectify:
+                timings["rectify_ms"] = round((time.perf_counter() - rectify_start) * 1000, 1)
+
+            # 3. Crop'ları bellekten doğrudan OCR'a ver (JPEG encode/decode yok)
+            ocr_start = time.perf_counter()
+            submitted = self.submit_crops([crop for _, crop in crops], budget)
+            results = [self._ocr_result_entry(name, future, match, decision)
+                       for (name, _), (future, match), decision in zip(crops, submitted, decisions)]
+
+            timings["ocr_ms"] = round((time.perf_counter() - ocr_start) * 1000, 1)
+            timings["total_ms"] = round((time.perf_counter() - start_time) * 1000, 1)
+
+            return self._summarize(results, invoice_count, process_id, timestamp, input_image, timings)
 
         except Exception as e:
             error_details = traceback.format_exc()
             print(f"İşleme hatası: {str(e)}\n{error_details}")
 
-            # Clean up temporary directories even if an error occurs
-            if hasattr(self, 'use_temp_dirs') and self.use_temp_dirs:
-                self.cleanup_temp_dirs()
-
             timestamp = int(time.time())
-            process_id = f"process_{timestamp}_{hash(str(e)) % 10000}"
+            process_id = self._new_process_id(timestamp)
             return {
                 "status": "error",
                 "message": f"İşleme hatası: {str(e)}",
                 "error_details": error_details,
                 "timestamp": timestamp,
                 "process_id": process_id,
-                "input_image": image_path if 'image_path' in locals() else None,
+                "input_image": input_image,
                 "invoice_count": 0,
                 "success_count": 0,
                 "error_count": 0,
                 "results": []
             }
+        finally:
+            # İsteğe özel geçici klasörü her durumda temizle
+            self._cleanup_request_dir(request_dir)
+
+    def _stopped_result(self, process_id, timestamp, input_image, stop_reason):
+        """Decode bütçesi işlem başlamadan dolan istekler için yanıt"""
+        return {
+            "status": "error",
+            "message": "İşlem başlamadan durduruldu",
+            "stop_reason": stop_reason,
+            "timestamp": timestamp,
+            "process_id": process_id,
+            "input_image": input_image,
+            "invoice_count": 0,
+            "success_count": 0,
+            "error_count": 0,
+            "results": []
+        }
 
-    def process_image_bytes(self, image_bytes, filename=None):
+    def _invalid_image_result(self, filename, timestamp=None, process_id=None):
+        """Decode edilemeyen görüntü için hata sonucu"""
+        timestamp = timestamp or int(time.time())
+        return {
+            "status": "error",
+            "message": f"Geçersiz görüntü formatı: {filename}",
+            "timestamp": timestamp,
+            "process_id": process_id or self._new_process_id(timestamp),
+            "input_image": filename,
+            "invoice_count": 0,
+            "success_count": 0,
+            "error_count": 0,
+            "results": []
+        }
+
+    def _process_bytes_uncached(self, image_bytes, filename, budget=None):
+        """Görüntü byte'larını önbelleğe bakmadan işle"""
+        if self.pipeline is not None:
+            return self.pipeline.process(image_bytes, filename, budget)
+
+        # Byte'lar bellekte bir kez decode edilir ve dizi doğrudan tespit/kırpmaya verilir
+        image = self.decode_image_bytes(image_bytes)
+        if image is None:
+            return self._invalid_image_result(filename)
+        return self._process_decoded(image, filename, budget)
+
+    def process_image_bytes(self, image_bytes, filename=None, budget=None):
         """Byte array olarak gelen görüntüyü işle - API için gerekli"""
         timestamp = int(time.time())
-        process_id = f"process_{timestamp}_{hash(str(image_bytes)[:100]) % 10000}"
+        process_id = self._new_process_id(timestamp)
 
         # Girdi doğrulama
         if not image_bytes:
@@ -293,43 +739,24 @@ class InvoiceProcessor:
             if filename is None:
                 filename = f"upload_{timestamp}.jpg"
 
-            # Geçici dosya oluştur
-            temp_dir = tempfile.gettempdir()
-            temp_path = os.path.join(temp_dir, filename)
-
-            try:
-                with open(temp_path, "wb") as f:
-                    f.write(image_bytes)
-
-                # İşleme yap
-                result = self.process_image(temp_path)
+            # Aynı görüntü daha önce işlendiyse (veya şu an işleniyorsa) sonucu önbellekten al
+            result = self._cached(image_bytes, functools.partial(
+                self._process_bytes_uncached, image_bytes, filename, budget), filename)
 
-                # process_id ve timestamp ekle/güncelle
-                if "process_id" not in result:
-                    result["process_id"] = process_id
-                if "timestamp" not in result:
-                    result["timestamp"] = timestamp
+            # process_id ve timestamp ekle/güncelle
+            if "process_id" not in result:
+                result["process_id"] = process_id
+            if "timestamp" not in result:
+                result["timestamp"] = timestamp
 
-                # Kaynak bilgisi ekle
-                result["source_type"] = "bytes"
-
-            finally:
-                # Geçici dosyayı temizle (her durumda)
-                if os.path.exists(temp_path):
-                    try:
-                        os.remove(temp_path)
-                    except Exception as cleanup_error:
-                        print(f"Geçici dosya temizleme hatası: {str(cleanup_error)}")
+            # Kaynak bilgisi ekle
+            result["source_type"] = "bytes"
 
             return result
         except Exception as e:
             error_details = traceback.format_exc()
             print(f"Byte işleme hatası: {str(e)}\n{error_details}")
 
-            # Clean up temporary directories even if an error occurs
-            if hasattr(self, 'use_temp_dirs') and self.use_temp_dirs:
-                self.cleanup_temp_dirs()
-
             return {
                 "status": "error",
                 "message": f"Byte işleme hatası: {str(e)}",
@@ -343,10 +770,10 @@ class InvoiceProcessor:
                 "results": []
             }
 
-    def process_base64_image(self, base64_string, filename=None):
+    def process_base64_image(self, base64_string, filename=None, budget=None):
         """Base64 kodlu görüntüyü işle - API için gerekli"""
         timestamp = int(time.time())
-        process_id = f"process_{timestamp}_{hash(str(base64_string)[:100]) % 10000}"
+        process_id = self._new_process_id(timestamp)
 
         # Girdi doğrulama
         if not base64_string:
@@ -372,9 +799,6 @@ class InvoiceProcessor:
             try:
                 image_bytes = base64.b64decode(base64_string)
             except Exception as decode_error:
-                # Clean up temporary directories if an error occurs
-                if hasattr(self, 'use_temp_dirs') and self.use_temp_dirs:
-                    self.cleanup_temp_dirs()
                 return {
                     "status": "error",
                     "message": f"Base64 decode hatası: {str(decode_error)}",
@@ -388,20 +812,13 @@ class InvoiceProcessor:
                     "results": []
                 }
 
-            # Görüntü formatını doğrula
-            try:
-                img = Image.open(io.BytesIO(image_bytes))
-                # Eğer filename belirtilmemişse, formatı kullan
-                if filename is None:
-                    filename = f"upload_{timestamp}.{img.format.lower() if img.format else 'jpg'}"
-            except Exception as img_error:
-                # Clean up temporary directories if an error occurs
-                if hasattr(self, 'use_temp_dirs') and self.use_temp_dirs:
-                    self.cleanup_temp_dirs()
+            # Görüntü formatını başlık byte'larından doğrula (decode tespit aşamasında bir kez yapılır)
+            image_format = sniff_format(image_bytes)
+            if image_format is None:
                 return {
                     "status": "error",
-                    "message": f"Geçersiz görüntü formatı: {str(img_error)}",
-                    "error_details": traceback.format_exc(),
+                    "message": "Geçersiz görüntü formatı: tanınmayan görüntü başlığı",
+                    "error_details": "Desteklenen formatlar: JPEG, PNG, WebP, BMP, TIFF",
                     "timestamp": timestamp,
                     "process_id": process_id,
                     "source_type": "base64",
@@ -410,9 +827,12 @@ class InvoiceProcessor:
                     "error_count": 0,
                     "results": []
                 }
+            # Eğer filename belirtilmemişse, formatı kullan
+            if filename is None:
+                filename = f"upload_{timestamp}.{'jpg' if image_format == 'jpeg' else image_format}"
 
             # Byte array olarak işle
-            result = self.process_image_bytes(image_bytes, filename)
+            result = self.process_image_bytes(image_bytes, filename, budget)
 
             # Kaynak bilgisini güncelle
             result["source_type"] = "base64"
@@ -422,10 +842,6 @@ class InvoiceProcessor:
             error_details = traceback.format_exc()
             print(f"Base64 işleme hatası: {str(e)}\n{error_details}")
 
-            # Clean up temporary directories if an error occurs
-            if hasattr(self, 'use_temp_dirs') and self.use_temp_dirs:
-                self.cleanup_temp_dirs()
-
             return {
                 "status": "error",
                 "message": f"Base64 işleme hatası: {str(e)}",
@@ -440,6 +856,190 @@ class InvoiceProcessor:
             }
 
 
+    def process_image_stream(self, image_bytes, filename=None, budget=None):
+        """
+        Görüntüyü işle ve ilerlemeyi olay olarak üret (streaming API için).
+
+        Sırasıyla şu olayları yield eder:
+            {"event": "detection", ...}  tespit ve kırpma biter bitmez
+            {"event": "result", "index": i, ...}  her crop'un OCR'ı tamamlandıkça (tamamlanma sırasıyla)
+            {"event": "summary", ...}  process_image ile aynı formatta genel sonuç
+        Hata durumunda {"event": "error", ...} üretilip akış sonlanır.
+        """
+        timestamp = int(time.time())
+        process_id = self._new_process_id(timestamp)
+        name = filename or f"upload_{timestamp}.jpg"
+        request_dir = self._make_request_dir(process_id)
+        start_time = time.perf_counter()
+        timings = {}
+
+        try:
+            img = self.decode_image_bytes(image_bytes)
+            if img is None:
+                yield {
+                    "event": "error",
+                    "status": "error",
+                    "message": f"Geçersiz görüntü formatı: {name}",
+                    "process_id": process_id,
+                    "timestamp": timestamp
+                }
+                return
+
+            crops, invoice_count = self.crop_invoices_from_imgs([img], [name], crop_dir=request_dir)[0]
+            timings["detection_ms"] = round((time.perf_counter() - start_time) * 1000, 1)
+            yield {
+                "event": "detection",
+                "process_id": process_id,
+                "timestamp": timestamp,
+                "input_image": name,
+                "invoice_count": invoice_count,
+                "crops": [crop_name for crop_name, _ in crops],
+                "detection_ms": timings["detection_ms"]
+            }
+
+            rectify_start = time.perf_counter()
+            crops, decisions = self.rectify_crops(crops)
+            if self.rectify:
+                timings["rectify_ms"] = round((time.perf_counter() - rectify_start) * 1000, 1)
+
+            ocr_start = time.perf_counter()
+            submitted = self.submit_crops([crop for _, crop in crops], budget)
+            index_of = {future: i for i, (future, _) in enumerate(submitted)}
+            results = [None] * len(submitted)
+            for future in as_completed(index_of):
+                i = index_of[future]
+                results[i] = self._ocr_result_entry(crops[i][0], future, submitted[i][1], decisions[i])
+                yield {"event": "result", "process_id": process_id, "index": i, **results[i]}
+
+            timings["ocr_ms"] = round((time.perf_counter() - ocr_start) * 1000, 1)
+            timings["total_ms"] = round((time.perf_counter() - start_time) * 1000, 1)
+            summary = self._summarize(results, invoice_count, process_id, timestamp, name, timings)
+            yield {"event": "summary", **summary}
+        except Exception as e:
+            error_details = traceback.format_exc()
+            print(f"İşleme hatası: {str(e)}\n{error_details}")
+            yield {
+                "event": "error",
+                "status": "error",
+                "message": f"İşleme hatası: {str(e)}",
+                "error_details": error_details,
+                "process_id": process_id,
+                "timestamp": timestamp
+            }
+        finally:
+            self._cleanup_request_dir(request_dir)
+
+    def process_image_batch(self, files, budget=None):
+        """
+        Birden fazla görüntüyü tek seferde işle - toplu API için.
+        Tespit DETECT_BATCH_SIZE'lık gruplar halinde, OCR ise tüm dosyaların
+        crop'ları birlikte batch'lenerek yapılır.
+
+        Args:
+            files: [(dosya_adı, image_bytes), ...] listesi
+            budget: Tüm crop'lar için ortak OCR decode bütçesi (donut_ocr.DecodeBudget)
+
+        Returns:
+            Dosya adına göre anahtarlanmış, her biri process_image ile aynı
+            formatta sonuçlar içeren toplu yanıt
+        """
+        timestamp = int(time.time())
+        batch_id = self._new_process_id(timestamp)
+        start_time = time.perf_counter()
+        request_dir = self._make_request_dir(batch_id)
+        per_file = {}
+
+        try:
+            # Dosya adlarını benzersizleştir (aynı isimli dosyalar birbirinin sonucunu ezmesin)
+            names, used = [], set()
+            for idx, (filename, _) in enumerate(files):
+                name = base = filename or f"upload_{idx}.jpg"
+                # Yeni ad da başka bir yüklemeyle çakışabilir (ör. a.jpg, a_1.jpg, a.jpg); boş ad bulunana kadar artır
+                counter = idx
+                while name in used:
+                    name = f"{Path(base).stem}_{counter}{Path(base).suffix}"
+                    counter += 1
+                used.add(name)
+                names.append(name)
+
+            # 1. Görüntüleri bellekte decode et
+            images, valid_names = [], []
+            for name, (_, image_bytes) in zip(names, files):
+                img = self.decode_image_bytes(image_bytes)
+                if img is None:
+                    per_file[name] = {
+                        "status": "error",
+                        "message": f"Geçersiz görüntü formatı: {name}",
+                        "process_id": self._new_process_id(timestamp),
+                        "timestamp": timestamp,
+                        "input_image": name,
+                        "invoice_count": 0,
+                        "success_count": 0,
+                        "error_count": 0,
+                        "results": []
+                    }
+                    continue
+                images.append(img)
+                valid_names.append(name)
+
+            # Hiçbir dosya decode edilemediyse tespit/düzeltme/OCR atlanır, her dosya kendi hatasıyla döner
+            detection_ms = rectify_ms = ocr_ms = 0.0
+            if images:
+                # 2. Toplu tespit ve kırpma
+                detect_start = time.perf_counter()
+                detections = self.crop_invoices_from_imgs(images, valid_names, crop_dir=request_dir)
+                detection_ms = round((time.perf_counter() - detect_start) * 1000, 1)
+
+                # 3. Tüm dosyaların crop'larını (açıksa) birlikte düzelt ve OCR'a gönder
+                rectify_start = time.perf_counter()
+                all_crops, decisions = self.rectify_crops([c for crops, _ in detections for c in crops])
+                rectify_ms = round((time.perf_counter() - rectify_start) * 1000, 1)
+
+                ocr_start = time.perf_counter()
+                submitted = iter(self.submit_crops([crop for _, crop in all_crops], budget))
+                decisions = iter(decisions)
+                for name, (crops, invoice_count) in zip(valid_names, detections):
+                    results = [self._ocr_result_entry(crop_name, *next(submitted), next(decisions))
+                               for crop_name, _ in crops]
+                    per_file[name] = self._summarize(results, invoice_count, self._new_process_id(timestamp),
+                                                     timestamp, name, None)
+                ocr_ms = round((time.perf_counter() - ocr_start) * 1000, 1)
+
+            statuses = {r["status"] for r in per_file.values()}
+            status = "success" if statuses <= {"success", "warning"} else \
+                "error" if statuses == {"error"} else "partial_success"
+            return {
+                "status": status,
+                "message": f"{len(files)} dosya işlendi",
+                "process_id": batch_id,
+                "timestamp": timestamp,
+                "file_count": len(files),
+                "invoice_count": sum(r.get("invoice_count", 0) for r in per_file.values()),
+                "results": {name: per_file[name] for name in names},
+                "timings": {
+                    "detection_ms": detection_ms,
+                    **({"rectify_ms": rectify_ms} if self.rectify else {}),
+                    "ocr_ms": ocr_ms,
+                    "total_ms": round((time.perf_counter() - start_time) * 1000, 1)
+                }
+            }
+        except Exception as e:
+            error_details = traceback.format_exc()
+            print(f"Toplu işleme hatası: {str(e)}\n{error_details}")
+            return {
+                "status": "error",
+                "message": f"Toplu işleme hatası: {str(e)}",
+                "error_details": error_details,
+                "process_id": batch_id,
+                "timestamp": timestamp,
+                "file_count": len(files),
+                "invoice_count": 0,
+                "results": per_file
+            }
+        finally:
+            self._cleanup_request_dir(request_dir)
+
+
 # Komut satırından çağrıldığında
 if __name__ == "__main__":
     processor = InvoiceProcessor()
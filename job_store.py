@@ -0,0 +1,192 @@
+"""
+Asenkron iş (job) API'si için iş kayıt depoları.
+
+Her iş bir sözlük olarak tutulur:
+    {"job_id", "status", "source_type", "filename", "created_at",
+     "updated_at", "result", "error"}
+
+status değerleri: queued, running, done, failed.
+Bitmiş ya da bitmemiş her iş updated_at üzerinden ttl_seconds geçince silinir.
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger("job_store")
+
+JOB_STATUSES = ("queued", "running", "done", "failed")
+
+
+class JobStore:
+    """İş deposu arayüzü"""
+
+    def __init__(self, ttl_seconds=3600):
+        self.ttl_seconds = ttl_seconds
+
+    def create(self, job_id, source_type, filename=None):
+        raise NotImplementedError
+
+    def update(self, job_id, **fields):
+        raise NotImplementedError
+
+    def get(self, job_id):
+        raise NotImplementedError
+
+    def evict_expired(self):
+        """Süresi dolan işleri sil; silinen iş sayısını döndür"""
+        raise NotImplementedError
+
+    def fail_incomplete(self, error):
+        """Bitmemiş işleri failed olarak işaretle (ör. sunucu yeniden başlatıldığında)"""
+        raise NotImplementedError
+
+    def _new_job(self, job_id, source_type, filename):
+        now = time.time()
+        return {
+            "job_id": job_id,
+            "status": "queued",
+            "source_type": source_type,
+            "filename": filename,
+            "created_at": now,
+            "updated_at": now,
+            "result": None,
+            "error": None,
+        }
+
+    def _is_expired(self, job, now=None):
+        return (now or time.time()) - job["updated_at"] > self.ttl_seconds
+
+
+class InMemoryJobStore(JobStore):
+    """Süreç belleğinde tutulan iş deposu; sunucu yeniden başlarsa işler kaybolur"""
+
+    def __init__(self, ttl_seconds=3600):
+        super().__init__(ttl_seconds)
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create(self, job_id, source_type, filename=None):
+        job = self._new_job(job_id, source_type, filename)
+        with self._lock:
+            self._jobs[job_id] = job
+        return dict(job)
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job.update(fields, updated_at=time.time())
+            return dict(job)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if self._is_expired(job):
+                del self._jobs[job_id]
+                return None
+            return dict(job)
+
+    def evict_expired(self):
+        now = time.time()
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items() if self._is_expired(job, now)]
+            for job_id in expired:
+                del self._jobs[job_id]
+        return len(expired)
+
+    def fail_incomplete(self, error):
+        with self._lock:
+            for job in self._jobs.values():
+                if job["status"] in ("queued", "running"):
+                    job.update(status="failed", error=error, updated_at=time.time())
+
+
+class SQLiteJobStore(JobStore):
+    """Yerel bir SQLite dosyasında tutulan iş deposu; sonuçlar yeniden başlatmadan sonra da okunabilir"""
+
+    def __init__(self, path, ttl_seconds=3600):
+        super().__init__(ttl_seconds)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " job_id TEXT PRIMARY KEY,"
+                " status TEXT NOT NULL,"
+                " source_type TEXT,"
+                " filename TEXT,"
+                " created_at REAL NOT NULL,"
+                " updated_at REAL NOT NULL,"
+                " result TEXT,"
+                " error TEXT)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_updated_at ON jobs (updated_at)")
+
+    def _row_to_job(self, row):
+        job = dict(row)
+        job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+        return job
+
+    def create(self, job_id, source_type, filename=None):
+        job = self._new_job(job_id, source_type, filename)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO jobs (job_id, status, source_type, filename, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, job["status"], source_type, filename, job["created_at"], job["updated_at"]),
+            )
+        return job
+
+    def update(self, job_id, **fields):
+        fields = {k: v for k, v in fields.items() if k in ("status", "result", "error")}
+        if "result" in fields:
+            fields["result"] = json.dumps(fields["result"], ensure_ascii=False)
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{k} = ?" for k in fields)
+        with self._lock, self._conn:
+            self._conn.execute(f"UPDATE jobs SET {assignments} WHERE job_id = ?",
+                               (*fields.values(), job_id))
+        return self.get(job_id)
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = self._row_to_job(row)
+        if self._is_expired(job):
+            with self._lock, self._conn:
+                self._conn.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+            return None
+        return job
+
+    def evict_expired(self):
+        with self._lock, self._conn:
+            cur = self._conn.execute("DELETE FROM jobs WHERE updated_at < ?",
+                                     (time.time() - self.ttl_seconds,))
+            return cur.rowcount
+
+    def fail_incomplete(self, error):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, updated_at = ?"
+                " WHERE status IN ('queued', 'running')",
+                (error, time.time()),
+            )
+
+
+def create_job_store(kind="memory", path=None, ttl_seconds=3600):
+    """Ayara göre iş deposu oluştur ("memory" veya "sqlite")"""
+    if kind == "memory":
+        return InMemoryJobStore(ttl_seconds=ttl_seconds)
+    if kind == "sqlite":
+        return SQLiteJobStore(path or "/tmp/invoice_jobs.sqlite3", ttl_seconds=ttl_seconds)
+    raise ValueError(f"Bilinmeyen iş deposu türü: {kind}")
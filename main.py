@@ -1,18 +1,28 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Body
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, UploadFile, File, HTTPException, Body, Request
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import uvicorn
+import asyncio
 import base64
-from typing import Optional
+import io
+import json
+import zipfile
+import uuid
+from typing import List, Optional
 import os
 import time
 import logging
 import traceback
 from invoice_processor import InvoiceProcessor
-
-# Import the centralized safe globals module
-from torch_safe_globals import register_safe_globals
+from pipeline import InvoicePipeline, parse_stage_workers
+from donut_ocr import DecodeBudget, batcher_queue_depth
+from inference_pool import InferencePool, QueueFullError
+from job_store import create_job_store
+from result_cache import ResultCache
+from phash_index import CropIndex
+from model_registry import registry
+import metrics
 
 # Configure logging
 logging.basicConfig(
@@ -21,11 +31,6 @@ logging.basicConfig(
 )
 logger = logging.getLogger("main_api")
 
-# Register safe globals before loading any models
-# This is automatically done when importing the module, but we call it again to be sure
-register_safe_globals()
-logger.info("PyTorch safe globals registered")
-
 # Initialize the FastAPI app
 app = FastAPI(
     title="Invoice Processing API",
@@ -43,12 +48,133 @@ app.add_middleware(
 )
 
 # Initialize the invoice processor
-processor = InvoiceProcessor()
+# Crops stay in memory; set SAVE_CROPS_DIR to also write them to disk for debugging
+# Identical image bytes are served from RESULT_CACHE_SIZE-entry LRU cache (0 disables it)
+RESULT_CACHE_SIZE = int(os.environ.get("RESULT_CACHE_SIZE", "1024"))
+result_cache = ResultCache(
+    max_entries=RESULT_CACHE_SIZE,
+    ttl_seconds=int(os.environ.get("RESULT_CACHE_TTL_SECONDS", "86400")),
+    disk_dir=os.environ.get("RESULT_CACHE_DIR") or None,
+) if RESULT_CACHE_SIZE > 0 else None
+# Opt-in near-duplicate crop index: reuse OCR output for crops within
+# CROP_INDEX_MAX_DISTANCE bits (perceptual hash) of an earlier crop
+CROP_INDEX_SIZE = int(os.environ.get("CROP_INDEX_SIZE", "0"))
+crop_index = CropIndex(
+    max_entries=CROP_INDEX_SIZE,
+    max_distance=int(os.environ.get("CROP_INDEX_MAX_DISTANCE", "6")),
+) if CROP_INDEX_SIZE > 0 else None
+# YOLO_MODEL_PATH may point to best.pt or to an exported ONNX / OpenVINO IR detector.
+# Models are loaded lazily; the startup warmup loads them in the background
+YOLO_MODEL_PATH = os.environ.get("YOLO_MODEL_PATH", "best.pt")
+SAVE_CROPS_DIR = os.environ.get("SAVE_CROPS_DIR") or None
+# PROCESS_WORKERS > 0: models are loaded once in this process and shared copy-on-write
+# with forked worker processes; the result cache stays here, the crop index is per worker
+PROCESS_WORKERS = int(os.environ.get("PROCESS_WORKERS", "0"))
+# PIPELINE=1: single-image requests run through the staged pipeline
+# (decode -> detect -> crop -> rectify -> ocr -> serialize) with per-stage worker counts
+PIPELINE_ENABLED = os.environ.get("PIPELINE", "0").lower() in ("1", "true", "yes")
+
+
+def enable_pipeline(target):
+    """Attach a staged pipeline to the processor that runs the models"""
+    if PIPELINE_ENABLED:
+        target.pipeline = InvoicePipeline(
+            target,
+            workers=parse_stage_workers(os.environ.get("PIPELINE_WORKERS",
+                                                        "decode=2,detect=1,crop=1,rectify=1,ocr=4,serialize=1")),
+            queue_size=int(os.environ.get("PIPELINE_QUEUE_SIZE", "16")),
+        )
+    return target
+
+
+if PROCESS_WORKERS > 0:
+    from process_pool import WorkerPool, ProcessPoolInvoiceProcessor
+    worker_pool = WorkerPool(
+        enable_pipeline(InvoiceProcessor(yolo_model_path=YOLO_MODEL_PATH, crop_dir=SAVE_CROPS_DIR,
+                                         crop_index=crop_index)),
+        workers=PROCESS_WORKERS,
+        torch_threads=int(os.environ.get("TORCH_THREADS_PER_WORKER", "0")) or None,
+        pin_cpus=os.environ.get("PIN_WORKER_CPUS", "0").lower() in ("1", "true", "yes"),
+        concurrency=int(os.environ.get("PROCESS_WORKER_CONCURRENCY", "1")),
+    )
+    processor = ProcessPoolInvoiceProcessor(worker_pool, yolo_model_path=YOLO_MODEL_PATH,
+                                            result_cache=result_cache)
+else:
+    worker_pool = None
+    processor = enable_pipeline(InvoiceProcessor(yolo_model_path=YOLO_MODEL_PATH, crop_dir=SAVE_CROPS_DIR,
+                                                 result_cache=result_cache, crop_index=crop_index))
+
+# Bounded worker pool for the blocking model calls, so the event loop (and /health)
+# stays responsive. Requests beyond workers + queue limit are rejected with 503.
+inference_pool = InferencePool(
+    max_workers=int(os.environ.get("INFERENCE_WORKERS", "4")),
+    max_queue=int(os.environ.get("INFERENCE_QUEUE_LIMIT", "32")),
+)
+RETRY_AFTER_SECONDS = int(os.environ.get("RETRY_AFTER_SECONDS", "5"))
+
+# Maximum number of images accepted by /api/process-batch (after zip extraction)
+BATCH_MAX_FILES = int(os.environ.get("BATCH_MAX_FILES", "100"))
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp")
+# Largest body accepted by /api/process-raw; larger uploads get 413 before being buffered
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(25 * 1024 * 1024)))
+# Total image bytes accepted by /api/process-batch (uploaded files + uncompressed zip members)
+BATCH_MAX_BYTES = int(os.environ.get("BATCH_MAX_BYTES", str(4 * MAX_UPLOAD_BYTES)))
+
+
+def queue_full_error():
+    return HTTPException(
+        status_code=503,
+        detail="Sunucu meşgul, inference kuyruğu dolu. Lütfen daha sonra tekrar deneyin.",
+        headers={"Retry-After": str(RETRY_AFTER_SECONDS)},
+    )
+
+# Asynchronous job API: jobs are queued here and run by JOB_WORKERS background
+# workers through the inference pool, results are kept in the job store until TTL
+job_store = create_job_store(
+    kind=os.environ.get("JOB_STORE", "memory"),
+    path=os.environ.get("JOB_STORE_PATH", "/tmp/invoice_jobs.sqlite3"),
+    ttl_seconds=int(os.environ.get("JOB_TTL_SECONDS", "3600")),
+)
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", str(inference_pool.max_workers)))
+JOB_QUEUE_LIMIT = int(os.environ.get("JOB_QUEUE_LIMIT", "1000"))
+# Queued and running jobs keep their image payload in memory; new jobs get 503 beyond this total
+JOB_QUEUE_MAX_BYTES = int(os.environ.get("JOB_QUEUE_MAX_BYTES", str(256 * 1024 * 1024)))
+job_queue = None
+job_queue_bytes = 0
+
+# Live gauges, read from the pools and queues when /metrics is scraped
+metrics.register_gauge("inference_pool_running", "Inference havuzunda çalışan çağrılar",
+                       lambda: inference_pool.stats()["running"])
+metrics.register_gauge("inference_pool_queued", "Inference havuzunda bekleyen çağrılar",
+                       lambda: inference_pool.stats()["queued"])
+metrics.register_gauge("jobs_queued", "Arka plan iş kuyruğunda bekleyen işler",
+                       lambda: job_queue.qsize() if job_queue is not None else 0)
+if worker_pool is not None:
+    metrics.register_gauge("worker_pool_in_flight", "Worker süreçlerine gönderilip bitmemiş görevler",
+                           lambda: worker_pool.stats()["in_flight"])
+else:
+    # With PROCESS_WORKERS the batcher lives in the worker processes
+    metrics.register_gauge("donut_batcher_queue_depth", "Donut batcher'ında bekleyen crop'lar",
+                           batcher_queue_depth)
+if processor.pipeline is not None:
+    metrics.register_gauge("pipeline_stage_queue_depth", "Pipeline aşamalarının giriş kuyruğu derinliği",
+                           lambda: {(name,): s["queue_depth"] for name, s in processor.pipeline.stats().items()},
+                           labels=("stage",))
+
+
+@app.middleware("http")
+async def track_requests_in_flight(request: Request, call_next):
+    if not request.url.path.startswith("/api/"):
+        return await call_next(request)
+    with metrics.REQUESTS_IN_FLIGHT.track_inprogress():
+        return await call_next(request)
 
 # Define request models
 class Base64Request(BaseModel):
     base64_image: str
     filename: Optional[str] = None
+    max_new_tokens: Optional[int] = None
+    timeout_s: Optional[float] = None
 
 # Define response model
 class ProcessingResponse(BaseModel):
@@ -60,6 +186,263 @@ class ProcessingResponse(BaseModel):
     success_count: Optional[int] = None
     error_count: Optional[int] = None
     results: list
+    timings: Optional[dict] = None
+    cache: Optional[dict] = None
+    stop_reason: Optional[str] = None
+
+# Define batch response model
+class BatchProcessingResponse(BaseModel):
+    status: str
+    message: str
+    process_id: str
+    timestamp: int
+    file_count: int
+    invoice_count: Optional[int] = None
+    results: dict
+    timings: Optional[dict] = None
+
+
+def check_batch_size(name, size, total):
+    """Dosya MAX_UPLOAD_BYTES'ı veya toplu isteğin toplamı BATCH_MAX_BYTES'ı aşıyorsa 413; yeni toplamı döndür"""
+    if size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"{name}: görüntü en fazla {MAX_UPLOAD_BYTES} byte olabilir")
+    if total + size > BATCH_MAX_BYTES:
+        raise HTTPException(status_code=413,
+                            detail=f"Toplu istekteki görüntüler toplamda en fazla {BATCH_MAX_BYTES} byte olabilir")
+    return total + size
+
+
+def extract_zip_images(content, total=0):
+    """
+    Zip arşivindeki görüntü dosyalarını [(ad, bytes), ...] olarak döndür. Üyeler okunmadan
+    önce açılmış boyutları (info.file_size) check_batch_size ile sınırlanır; total, istekte
+    zaten kabul edilmiş byte sayısıdır.
+    """
+    images = []
+    with zipfile.ZipFile(io.BytesIO(content)) as archive:
+        for info in archive.infolist():
+            if info.is_dir() or not info.filename.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            if len(images) >= BATCH_MAX_FILES:
+                raise HTTPException(status_code=413,
+                                    detail=f"Toplu istekte en fazla {BATCH_MAX_FILES} görüntü gönderilebilir")
+            # zipfile bir üyeden file_size'dan fazla byte döndürmez (fazlası CRC hatası verir)
+            total = check_batch_size(info.filename, info.file_size, total)
+            images.append((info.filename, archive.read(info)))
+    return images
+
+def decode_base64_payload(base64_string):
+    """data URI önekini atıp base64 metnini byte'lara çevir"""
+    if "base64," in base64_string:
+        base64_string = base64_string.split("base64,")[1]
+    try:
+        return base64.b64decode(base64_string)
+    except Exception as e:
+        raise HTTPException(status_code=422, detail=f"Base64 decode hatası: {str(e)}")
+
+
+async def read_body_limited(request, max_bytes=MAX_UPLOAD_BYTES):
+    """
+    Ham istek gövdesini parça parça en fazla max_bytes'lık bir tampona oku.
+    Content-Length sınırı aşıyorsa gövde hiç okunmadan, Content-Length yoksa
+    (chunked) sınır aşıldığı anda 413 döner.
+    """
+    length = request.headers.get("content-length")
+    if length is not None:
+        try:
+            length = int(length)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Geçersiz Content-Length")
+        if length > max_bytes:
+            raise HTTPException(status_code=413, detail=f"Görüntü en fazla {max_bytes} byte olabilir")
+
+    buffer = bytearray()
+    async for chunk in request.stream():
+        if len(buffer) + len(chunk) > max_bytes:
+            raise HTTPException(status_code=413, detail=f"Görüntü en fazla {max_bytes} byte olabilir")
+        buffer += chunk
+    if not buffer:
+        raise HTTPException(status_code=422, detail="İstek gövdesi boş")
+    return buffer
+
+
+def check_raw_content_type(request):
+    """Ham yükleme endpoint'leri yalnızca application/octet-stream veya image/* kabul eder"""
+    content_type = request.headers.get("content-type", "application/octet-stream")
+    content_type = content_type.split(";")[0].strip().lower()
+    if content_type != "application/octet-stream" and not content_type.startswith("image/"):
+        raise HTTPException(status_code=415,
+                            detail="Content-Type application/octet-stream veya image/* olmalıdır")
+
+
+# How often a request waiting on the inference pool checks whether its client is still connected
+DISCONNECT_POLL_SECONDS = float(os.environ.get("DISCONNECT_POLL_SECONDS", "0.5"))
+
+
+def make_budget(max_new_tokens=None, timeout_s=None):
+    """Per-request decode budget; unset values fall back to DONUT_MAX_NEW_TOKENS / DONUT_DECODE_TIMEOUT_S"""
+    if max_new_tokens is not None and max_new_tokens < 1:
+        raise HTTPException(status_code=422, detail="max_new_tokens en az 1 olmalıdır")
+    if timeout_s is not None and timeout_s <= 0:
+        raise HTTPException(status_code=422, detail="timeout_s pozitif olmalıdır")
+    return DecodeBudget(max_new_tokens=max_new_tokens, timeout_s=timeout_s)
+
+
+async def run_cancellable(request, budget, fn, *args):
+    """
+    fn'i inference havuzunda budget ile çalıştır; istemci bağlantısı beklerken koparsa
+    bütçeyi iptal et, böylece kalan decode adımları ve kuyruktaki crop'lar CPU harcamaz.
+    """
+    future = inference_pool.submit(fn, *args, budget=budget)
+    while True:
+        done, _ = await asyncio.wait({future}, timeout=DISCONNECT_POLL_SECONDS)
+        if done:
+            return future.result()
+        if not budget.cancelled and await request.is_disconnected():
+            logger.info("Client disconnected, cancelling decode")
+            budget.cancel()
+
+
+def stream_processing(request, image_bytes, filename, fmt, budget):
+    """
+    process_image_stream olaylarını inference havuzunda üretip NDJSON veya SSE olarak aktar.
+    Kuyruk doluysa yanıt başlamadan QueueFullError fırlatılır. İstemci akış bitmeden
+    bağlantıyı kapatırsa decode bütçesi iptal edilir.
+    """
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+
+    def produce():
+        try:
+            for event in processor.process_image_stream(image_bytes, filename, budget):
+                loop.call_soon_threadsafe(events.put_nowait, event)
+        except Exception as e:
+            # e.g. a worker error re-raised by WorkerPool.stream: end the stream with an error record
+            logger.error(f"Stream processing failed for {filename}: {str(e)}")
+            logger.error(traceback.format_exc())
+            loop.call_soon_threadsafe(events.put_nowait, {
+                "event": "error",
+                "status": "error",
+                "message": f"İşleme hatası: {str(e)}",
+                "timestamp": int(time.time()),
+            })
+        finally:
+            loop.call_soon_threadsafe(events.put_nowait, None)
+
+    use_sse = fmt == "sse" or (fmt is None and "text/event-stream" in request.headers.get("accept", ""))
+    inference_pool.submit(produce)
+
+    async def body():
+        finished = False
+        try:
+            while True:
+                event = await events.get()
+                if event is None:
+                    finished = True
+                    break
+                data = json.dumps(event, ensure_ascii=False)
+                if use_sse:
+                    yield f"event: {event['event']}\ndata: {data}\n\n"
+                else:
+                    yield data + "\n"
+        finally:
+            # Starlette stops iterating the body when the client disconnects
+            if not finished:
+                budget.cancel()
+
+    media_type = "text/event-stream" if use_sse else "application/x-ndjson"
+    return StreamingResponse(body(), media_type=media_type, headers={"Cache-Control": "no-cache"})
+
+# Define job response model
+class JobResponse(BaseModel):
+    job_id: str
+    status: str
+    source_type: Optional[str] = None
+    filename: Optional[str] = None
+    created_at: float
+    updated_at: float
+    result: Optional[dict] = None
+    error: Optional[str] = None
+
+
+async def job_worker():
+    """Kuyruktaki işleri sırayla inference havuzunda çalıştır"""
+    global job_queue_bytes
+    while True:
+        job_id, fn, args, budget_args, payload_size = await job_queue.get()
+        try:
+            job_store.update(job_id, status="running")
+            # The decode deadline starts when the job starts running, not when it is queued
+            budget = DecodeBudget(**budget_args)
+            while True:
+                try:
+                    result = await inference_pool.run(fn, *args, budget=budget)
+                    break
+                except QueueFullError:
+                    # Senkron endpoint'ler havuzu doldurmuş; iş kuyrukta kalır, biraz sonra tekrar denenir
+                    await asyncio.sleep(0.5)
+            job_store.update(job_id, status="done", result=result)
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {str(e)}")
+            job_store.update(job_id, status="failed", error=str(e))
+        finally:
+            job_queue_bytes -= payload_size
+            job_queue.task_done()
+
+
+async def evict_expired_jobs():
+    """Süresi dolan işleri periyodik olarak sil"""
+    while True:
+        await asyncio.sleep(60)
+        try:
+            evicted = job_store.evict_expired()
+            if evicted:
+                logger.info(f"Evicted {evicted} expired jobs")
+        except Exception as e:
+            logger.error(f"Job eviction failed: {str(e)}")
+
+
+# Load the models and run them once on dummy inputs before reporting ready,
+# so the first real request does not pay the load / first-call cost
+WARMUP_ON_STARTUP = os.environ.get("WARMUP_ON_STARTUP", "1").lower() not in ("0", "false", "no")
+readiness = {"ready": False, "error": None, "warmup_s": None}
+
+
+async def run_warmup():
+    start = time.perf_counter()
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, processor.warmup)
+        readiness["warmup_s"] = round(time.perf_counter() - start, 2)
+        readiness["ready"] = True
+    except Exception as e:
+        readiness["error"] = str(e)
+        logger.error(f"Warmup failed: {str(e)}")
+        logger.error(traceback.format_exc())
+
+
+@app.on_event("startup")
+async def start_warmup():
+    if WARMUP_ON_STARTUP:
+        asyncio.create_task(run_warmup())
+    else:
+        readiness["ready"] = True
+
+
+@app.on_event("shutdown")
+async def stop_worker_pool():
+    if worker_pool is not None:
+        worker_pool.shutdown()
+
+
+@app.on_event("startup")
+async def start_job_workers():
+    global job_queue
+    # Önceki çalışmadan kalan bitmemiş işler (SQLite deposu) artık çalıştırılamaz
+    job_store.fail_incomplete("Sunucu iş tamamlanmadan yeniden başlatıldı")
+    job_queue = asyncio.Queue(maxsize=JOB_QUEUE_LIMIT)
+    for _ in range(JOB_WORKERS):
+        asyncio.create_task(job_worker())
+    asyncio.create_task(evict_expired_jobs())
 
 # Root endpoint
 @app.get("/")
@@ -69,51 +452,227 @@ async def root():
         "docs": "/docs",
         "endpoints": [
             "/api/process-file",
-            "/api/process-base64"
+            "/api/process-base64",
+            "/api/process-raw",
+            "/api/process-batch",
+            "/api/process-file/stream",
+            "/api/process-base64/stream",
+            "/api/process-raw/stream",
+            "/api/jobs",
+            "/metrics"
         ]
     }
 
 # Process file endpoint
 @app.post("/api/process-file", response_model=ProcessingResponse)
-async def process_file(file: UploadFile = File(...)):
-    temp_path = None
+async def process_file(request: Request, file: UploadFile = File(...),
+                       max_new_tokens: Optional[int] = None, timeout_s: Optional[float] = None):
+    budget = make_budget(max_new_tokens, timeout_s)
     try:
-        # Create a temporary file in /tmp directory (writable)
-        timestamp = int(time.time())
-        filename = f"upload_{timestamp}_{file.filename}"
-        temp_path = os.path.join("/tmp", filename)
+        content = await file.read()
 
-        # Save the uploaded file
-        with open(temp_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
-
-        # Process the image
-        result = processor.process_image(temp_path)
-
-        # Clean up the temporary file
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
+        # Process the image bytes in the inference pool (served from the result cache if seen before)
+        result = await run_cancellable(request, budget, processor.process_image_bytes, content, file.filename)
+        result["source_type"] = "file"
 
         return result
+    except QueueFullError:
+        raise queue_full_error()
     except Exception as e:
-        if temp_path and os.path.exists(temp_path):
-            os.remove(temp_path)
         raise HTTPException(status_code=500, detail=str(e))
 
 # Process base64 endpoint
 @app.post("/api/process-base64", response_model=ProcessingResponse)
-async def process_base64(request: Base64Request):
+async def process_base64(body: Base64Request, request: Request):
+    budget = make_budget(body.max_new_tokens, body.timeout_s)
+    try:
+        result = await run_cancellable(request, budget, processor.process_base64_image,
+                                       body.base64_image, body.filename)
+        return result
+    except QueueFullError:
+        raise queue_full_error()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Raw binary upload: the request body is the image itself (no multipart or base64 overhead)
+@app.post("/api/process-raw", response_model=ProcessingResponse)
+async def process_raw(request: Request, filename: Optional[str] = None,
+                      max_new_tokens: Optional[int] = None, timeout_s: Optional[float] = None):
+    budget = make_budget(max_new_tokens, timeout_s)
+    check_raw_content_type(request)
+    content = await read_body_limited(request)
     try:
-        result = processor.process_base64_image(request.base64_image, request.filename)
+        result = await run_cancellable(request, budget, processor.process_image_bytes, content,
+                                       filename or request.headers.get("x-filename"))
+        result["source_type"] = "raw"
         return result
+    except QueueFullError:
+        raise queue_full_error()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Streaming variants: detection event first, then one record per invoice as its OCR completes
+@app.post("/api/process-file/stream")
+async def process_file_stream(request: Request, file: UploadFile = File(...), format: Optional[str] = None,
+                              max_new_tokens: Optional[int] = None, timeout_s: Optional[float] = None):
+    budget = make_budget(max_new_tokens, timeout_s)
+    content = await file.read()
+    try:
+        return stream_processing(request, content, file.filename, format, budget)
+    except QueueFullError:
+        raise queue_full_error()
+
+@app.post("/api/process-base64/stream")
+async def process_base64_stream(request: Request, body: Base64Request, format: Optional[str] = None):
+    budget = make_budget(body.max_new_tokens, body.timeout_s)
+    image_bytes = decode_base64_payload(body.base64_image)
+    try:
+        return stream_processing(request, image_bytes, body.filename, format, budget)
+    except QueueFullError:
+        raise queue_full_error()
+
+@app.post("/api/process-raw/stream")
+async def process_raw_stream(request: Request, filename: Optional[str] = None, format: Optional[str] = None,
+                             max_new_tokens: Optional[int] = None, timeout_s: Optional[float] = None):
+    budget = make_budget(max_new_tokens, timeout_s)
+    check_raw_content_type(request)
+    content = await read_body_limited(request)
+    try:
+        return stream_processing(request, content, filename or request.headers.get("x-filename"), format, budget)
+    except QueueFullError:
+        raise queue_full_error()
+
+# Process batch endpoint (multiple files and/or zip archives in one request)
+@app.post("/api/process-batch", response_model=BatchProcessingResponse)
+async def process_batch(request: Request, files: List[UploadFile] = File(...),
+                        max_new_tokens: Optional[int] = None, timeout_s: Optional[float] = None):
+    budget = make_budget(max_new_tokens, timeout_s)
+    try:
+        images = []
+        total = 0
+        for file in files:
+            filename = file.filename or f"upload_{len(images)}.jpg"
+            is_zip = filename.lower().endswith(".zip") or file.content_type in ("application/zip",
+                                                                                "application/x-zip-compressed")
+            # Multipart dosyalar diske yazılmış olur; boyut sınırı belleğe okunmadan kontrol edilir
+            if file.size is not None:
+                if is_zip and file.size > BATCH_MAX_BYTES:
+                    raise HTTPException(status_code=413,
+                                        detail=f"{filename}: zip arşivi en fazla {BATCH_MAX_BYTES} byte olabilir")
+                if not is_zip:
+                    check_batch_size(filename, file.size, total)
+            content = await file.read()
+            if is_zip:
+                extracted = extract_zip_images(content, total)
+                total += sum(len(data) for _, data in extracted)
+                images.extend(extracted)
+            else:
+                total = check_batch_size(filename, len(content), total)
+                images.append((filename, content))
+            if len(images) > BATCH_MAX_FILES:
+                raise HTTPException(status_code=413,
+                                    detail=f"Toplu istekte en fazla {BATCH_MAX_FILES} görüntü gönderilebilir")
+        if not images:
+            raise HTTPException(status_code=422, detail="İşlenecek görüntü bulunamadı")
+
+        return await run_cancellable(request, budget, processor.process_image_batch, images)
+    except QueueFullError:
+        raise queue_full_error()
+    except HTTPException:
+        raise
+    except zipfile.BadZipFile as e:
+        raise HTTPException(status_code=422, detail=f"Geçersiz zip arşivi: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Submit job endpoint (multipart file or base64 JSON body, same as the sync endpoints)
+@app.post("/api/jobs", response_model=JobResponse, status_code=202)
+async def submit_job(request: Request):
+    global job_queue_bytes
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        file = form.get("file")
+        if file is None or not hasattr(file, "read"):
+            raise HTTPException(status_code=422, detail="'file' alanı gerekli")
+        filename = file.filename
+        source_type = "file"
+        if file.size is not None and file.size > MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=413, detail=f"Görüntü en fazla {MAX_UPLOAD_BYTES} byte olabilir")
+        content = await file.read()
+        if len(content) > MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=413, detail=f"Görüntü en fazla {MAX_UPLOAD_BYTES} byte olabilir")
+        payload_size = len(content)
+        fn, args = processor.process_image_bytes, (content, filename)
+        try:
+            max_new_tokens = int(form["max_new_tokens"]) if form.get("max_new_tokens") else None
+            timeout_s = float(form["timeout_s"]) if form.get("timeout_s") else None
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=f"Geçersiz bütçe değeri: {str(e)}")
+    else:
+        # Base64 metni görüntüden ~4/3 büyüktür; gövde bu sınırı aşarsa okunmadan 413 döner
+        raw = await read_body_limited(request, MAX_UPLOAD_BYTES * 4 // 3 + 64 * 1024)
+        try:
+            body = Base64Request(**json.loads(raw))
+        except Exception as e:
+            raise HTTPException(status_code=422, detail=f"Geçersiz istek gövdesi: {str(e)}")
+        del raw
+        filename = body.filename
+        source_type = "base64"
+        payload_size = len(body.base64_image)
+        fn, args = processor.process_base64_image, (body.base64_image, filename)
+        max_new_tokens, timeout_s = body.max_new_tokens, body.timeout_s
+    # Validate now; the budget itself is created when the job starts
+    make_budget(max_new_tokens, timeout_s)
+
+    job_id = uuid.uuid4().hex
+    if job_queue.full() or job_queue_bytes + payload_size > JOB_QUEUE_MAX_BYTES:
+        raise queue_full_error()
+    job = job_store.create(job_id, source_type, filename)
+    job_queue_bytes += payload_size
+    job_queue.put_nowait((job_id, fn, args, {"max_new_tokens": max_new_tokens, "timeout_s": timeout_s},
+                          payload_size))
+    return job
+
+# Job status/result endpoint
+@app.get("/api/jobs/{job_id}", response_model=JobResponse)
+async def get_job(job_id: str):
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="İş bulunamadı veya süresi doldu")
+    return job
+
 # Health check endpoint
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "timestamp": int(time.time())}
+    return {
+        "status": "healthy",
+        "timestamp": int(time.time()),
+        "inference": inference_pool.stats(),
+        "cache": result_cache.stats() if result_cache is not None else None,
+        "crop_index": crop_index.stats() if crop_index is not None else None,
+        "workers": worker_pool.stats() if worker_pool is not None else None,
+        "pipeline": processor.pipeline.stats() if processor.pipeline is not None else None,
+        "jobs_queued": job_queue.qsize() if job_queue is not None else 0,
+    }
+
+# Prometheus scrape endpoint: per-stage latency histograms, counters and queue gauges
+@app.get("/metrics")
+async def metrics_endpoint():
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
+
+# Readiness endpoint: 503 until the models are loaded and warmed up
+# (/health only reports that the process is alive)
+@app.get("/ready")
+async def readiness_check():
+    body = {
+        "status": "ready" if readiness["ready"] else ("failed" if readiness["error"] else "warming_up"),
+        "error": readiness["error"],
+        "warmup_s": readiness["warmup_s"],
+        "models": registry.status(),
+    }
+    return JSONResponse(status_code=200 if readiness["ready"] else 503, content=body)
 
 # Run the app
 if __name__ == "__main__":
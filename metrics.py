@@ -0,0 +1,104 @@
+"""
+Prometheus metrikleri.
+
+Aşama süreleri tek bir histogramda `stage` etiketiyle tutulur: decode, detect, crop,
+rectify, donut_preprocess, donut_encoder, donut_decoder ve serialize. Sayaçlar
+tespit edilen fatura, OCR sonuç durumu, önbellek ve yakın-kopya isabetlerini sayar.
+Kuyruk derinliği gibi anlık değerler register_gauge ile kaydedilen fonksiyonlardan
+/metrics isteği sırasında okunur.
+
+PROCESS_WORKERS ile model çağrıları worker süreçlerinde yapılır; bu durumda
+PROMETHEUS_MULTIPROC_DIR boş bir klasöre ayarlanmalıdır, böylece worker'ların
+histogram ve sayaçları dosyalar üzerinden ana süreçte toplanır.
+"""
+import contextlib
+import os
+import threading
+import time
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, \
+    generate_latest
+from prometheus_client.core import GaugeMetricFamily
+
+MULTIPROCESS = bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+
+STAGES = ("decode", "detect", "crop", "rectify", "donut_preprocess", "donut_encoder", "donut_decoder",
+          "serialize")
+
+STAGE_SECONDS = Histogram(
+    "invoice_stage_duration_seconds", "İşleme aşamalarının süresi (saniye)", ["stage"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+GENERATED_TOKENS = Histogram(
+    "donut_generated_tokens", "Crop başına Donut'un ürettiği token sayısı",
+    buckets=(8, 16, 32, 64, 128, 192, 256, 384, 512),
+)
+INVOICES_DETECTED = Counter("invoices_detected_total", "YOLO'nun tespit ettiği fatura sayısı")
+OCR_RESULTS = Counter("ocr_results_total", "Crop başına OCR sonucu", ["status"])
+CACHE_LOOKUPS = Counter("result_cache_lookups_total", "Sonuç önbelleği sorguları", ["source"])
+NEAR_DUPLICATE_HITS = Counter("crop_index_hits_total", "OCR çalıştırılmadan yakın-kopya indeksinden dönen crop'lar")
+REQUESTS_IN_FLIGHT = Gauge("http_requests_in_flight", "İşlenmekte olan API istekleri",
+                           multiprocess_mode="livesum")
+
+for _stage in STAGES:
+    STAGE_SECONDS.labels(_stage)
+
+
+@contextlib.contextmanager
+def timed(stage):
+    """with bloğunun süresini aşama histogramına yaz"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(stage).observe(time.perf_counter() - start)
+
+
+class _LiveCollector:
+    """register_gauge ile kaydedilen fonksiyonları toplama anında çağıran collector"""
+
+    def __init__(self):
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, documentation, fn, labels):
+        with self._lock:
+            self._gauges[name] = (documentation, fn, tuple(labels))
+
+    def collect(self):
+        with self._lock:
+            gauges = list(self._gauges.items())
+        for name, (documentation, fn, labels) in gauges:
+            family = GaugeMetricFamily(name, documentation, labels=labels or None)
+            value = fn()
+            if labels:
+                for label_values, v in value.items():
+                    family.add_metric(list(label_values), v)
+            else:
+                family.add_metric([], value)
+            yield family
+
+
+_live = _LiveCollector()
+if not MULTIPROCESS:
+    REGISTRY.register(_live)
+
+
+def register_gauge(name, documentation, fn, labels=()):
+    """
+    Anlık değeri fn()'den okunan gauge kaydet. labels verilirse fn
+    {(etiket_değerleri, ...): değer} sözlüğü döndürmelidir.
+    """
+    _live.add(name, documentation, fn, labels)
+
+
+def render():
+    """(gövde, content_type): /metrics yanıtı"""
+    if MULTIPROCESS:
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(_live)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,58 @@
+"""
+Modeller için tembel (lazy) yükleme kaydı.
+
+Modüller model yükleyicilerini isimle kaydeder; model ilk get() çağrısında
+yüklenir ve süreç boyunca paylaşılır. Böylece bir modülü import etmek (ör. bir
+CLI aracı veya test) model yükleme maliyeti doğurmaz. Aynı ismin eşzamanlı
+ilk çağrıları tek bir yüklemeyi bekler.
+"""
+import logging
+import threading
+import time
+
+logger = logging.getLogger("model_registry")
+
+
+class ModelRegistry:
+    def __init__(self):
+        self._loaders = {}
+        self._models = {}
+        self._locks = {}
+        self._load_times = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, loader):
+        """name için yükleyici kaydet; aynı isim zaten kayıtlıysa mevcut kayıt korunur"""
+        with self._lock:
+            if name not in self._loaders:
+                self._loaders[name] = loader
+                self._locks[name] = threading.Lock()
+
+    def get(self, name):
+        """Modeli döndür, henüz yüklenmediyse yükle"""
+        model = self._models.get(name)
+        if model is not None:
+            return model
+        with self._lock:
+            if name not in self._loaders:
+                raise KeyError(f"Kayıtlı olmayan model: {name}")
+            name_lock = self._locks[name]
+        with name_lock:
+            if name not in self._models:
+                start = time.perf_counter()
+                self._models[name] = self._loaders[name]()
+                self._load_times[name] = round(time.perf_counter() - start, 2)
+                logger.info(f"Model loaded: {name} ({self._load_times[name]} s)")
+            return self._models[name]
+
+    def is_loaded(self, name):
+        return name in self._models
+
+    def status(self):
+        """Kayıtlı modellerin yüklenme durumu ve süreleri"""
+        with self._lock:
+            return {name: {"loaded": name in self._models, "load_s": self._load_times.get(name)}
+                    for name in self._loaders}
+
+
+registry = ModelRegistry()
@@ -0,0 +1,120 @@
+"""
+Fatura crop'ları için algısal hash (pHash) tabanlı yakın-kopya indeksi.
+
+Aynı fatura farklı kadrajla yeniden tarandığında byte'lar değişse de 64 bitlik
+DCT hash'i birkaç bit içinde kalır. İndeks, hash'leri bir BK-tree'de tutar ve
+Hamming mesafesi eşiğin altındaki en yakın crop'un OCR çıktısını döndürür.
+Bellek max_entries ile sınırlıdır; en eski kullanılan kayıtlar atılır.
+"""
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+
+def phash(image, hash_size=8, highfreq_factor=4):
+    """BGR veya gri görüntünün 64 bitlik DCT algısal hash'ini tamsayı olarak döndür"""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    size = hash_size * highfreq_factor
+    resized = cv2.resize(gray, (size, size), interpolation=cv2.INTER_AREA).astype(np.float32)
+    dct = cv2.dct(resized)[:hash_size, :hash_size]
+    # DC bileşeni medyanı çarpıtmasın diye hesaba katılmaz
+    median = np.median(dct.flatten()[1:])
+    bits = (dct > median).flatten()
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+class _BKNode:
+    __slots__ = ("hash", "children")
+
+    def __init__(self, value):
+        self.hash = value
+        self.children = {}
+
+
+class CropIndex:
+    def __init__(self, max_entries=10000, max_distance=6):
+        self.max_entries = max(1, int(max_entries))
+        self.max_distance = int(max_distance)
+        self._entries = OrderedDict()  # hash -> OCR çıktısı (LRU sırasında)
+        self._root = None
+        self._tree_size = 0  # ağaçtaki düğüm sayısı (silinmiş kayıtlar dahil)
+        self._lock = threading.Lock()
+        self._stats = {"lookups": 0, "matches": 0, "evictions": 0}
+
+    def lookup(self, value):
+        """
+        max_distance içindeki en yakın hash'in çıktısını döndür.
+
+        Returns:
+            (çıktı, mesafe) veya eşleşme yoksa (None, None)
+        """
+        with self._lock:
+            self._stats["lookups"] += 1
+            best, best_distance = None, None
+            stack = [self._root] if self._root is not None else []
+            while stack:
+                node = stack.pop()
+                distance = hamming(value, node.hash)
+                if distance <= self.max_distance and node.hash in self._entries and \
+                        (best_distance is None or distance < best_distance):
+                    best, best_distance = node.hash, distance
+                for edge, child in node.children.items():
+                    if distance - self.max_distance <= edge <= distance + self.max_distance:
+                        stack.append(child)
+            if best is None:
+                return None, None
+            self._stats["matches"] += 1
+            self._entries.move_to_end(best)
+            return self._entries[best], best_distance
+
+    def add(self, value, output):
+        """Hash'i ve OCR çıktısını indekse ekle"""
+        with self._lock:
+            if value in self._entries:
+                self._entries[value] = output
+                self._entries.move_to_end(value)
+                return
+            self._entries[value] = output
+            self._insert(value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+            # Atılan kayıtlar ağaçta ölü düğüm olarak kalır; çoğalınca ağaç yeniden kurulur
+            if self._tree_size > 2 * self.max_entries:
+                self._rebuild()
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, "size": len(self._entries), "max_entries": self.max_entries,
+                    "max_distance": self.max_distance}
+
+    def _insert(self, value):
+        self._tree_size += 1
+        if self._root is None:
+            self._root = _BKNode(value)
+            return
+        node = self._root
+        while True:
+            distance = hamming(value, node.hash)
+            if distance == 0:
+                return
+            child = node.children.get(distance)
+            if child is None:
+                node.children[distance] = _BKNode(value)
+                return
+            node = child
+
+    def _rebuild(self):
+        self._root = None
+        self._tree_size = 0
+        for value in self._entries:
+            self._insert(value)
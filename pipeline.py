@@ -0,0 +1,285 @@
+"""
+Aşamalı (stage-parallel) fatura işleme hattı.
+
+Her istek decode → detect → crop → rectify → ocr → serialize aşamalarından geçer
+(rectify, InvoiceProcessor.rectify kapalıysa crop'ları olduğu gibi geçirir). Aşamalar
+arasında sınırlı kuyruklar vardır ve her aşamanın worker sayısı ayrı ayarlanır;
+böylece bir görüntünün OCR'ı sürerken sonraki görüntünün tespiti yapılabilir.
+Tespit aşaması kuyrukta bekleyen görüntüleri DETECT_BATCH_SIZE'a kadar tek bir
+predict çağrısında işler. Bir aşamanın çıkış kuyruğu doluysa aşama bekler
+(backpressure), böylece yavaş aşamanın önünde sınırsız iş birikmez.
+
+Aşama başına kuyruk derinliği, meşgul worker sayısı ve kullanım oranı stats()
+ile alınır.
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger("pipeline")
+
+STAGES = ("decode", "detect", "crop", "rectify", "ocr", "serialize")
+
+
+def parse_stage_workers(value):
+    """PIPELINE_WORKERS değerini (ör. "detect=1,ocr=4") {aşama: worker_sayısı} sözlüğüne çevir"""
+    workers = {}
+    for part in value.split(","):
+        if not part.strip():
+            continue
+        name, count = part.split("=")
+        name = name.strip()
+        if name not in STAGES:
+            raise ValueError(f"Bilinmeyen pipeline aşaması: {name} (seçenekler: {STAGES})")
+        workers[name] = max(1, int(count))
+    return workers
+
+
+class _Job:
+    """Hattaki tek bir isteğin durumu"""
+
+    def __init__(self, image_bytes, filename, budget):
+        self.image_bytes = image_bytes
+        self.filename = filename
+        self.budget = budget
+        self.future = Future()
+        self.start = time.perf_counter()
+        self.timings = {}
+        self.timestamp = None
+        self.process_id = None
+        self.request_dir = None
+        self.image = None
+        self.boxes = None
+        self.crops = None
+        self.invoice_count = 0
+        self.results = None
+        self.rectifications = None
+
+    def mark(self, key, since):
+        self.timings[key] = round((time.perf_counter() - since) * 1000, 1)
+
+
+class Stage:
+    """
+    Kendi sınırlı giriş kuyruğu ve worker thread'leri olan bir hat aşaması.
+
+    fn, batch_size 1 ise tek bir işi, büyükse iş listesini alır. İşi bir sonraki
+    aşamaya geçirmek için True, işi kendisi bitirdiyse False döndürür (toplu
+    modda her iş için bir değer içeren liste).
+    """
+
+    def __init__(self, name, fn, workers=1, queue_size=16, batch_size=1):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, int(workers))
+        self.batch_size = max(1, int(batch_size))
+        self.queue = queue.Queue(maxsize=max(1, int(queue_size)))
+        self.next = None
+        self.on_error = None
+        self._threads = []
+        self._lock = threading.Lock()
+        self._busy = 0
+        self._busy_seconds = 0.0
+        self._processed = 0
+        self._started_at = None
+
+    def start(self):
+        self._started_at = time.perf_counter()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"pipeline-{self.name}-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _take(self):
+        """Kuyruktan bir iş (toplu modda kuyrukta hazır bekleyenlerle birlikte batch_size'a kadar) al"""
+        item = self.queue.get()
+        if item is None:
+            return None, True
+        batch = [item]
+        while len(batch) < self.batch_size:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        while True:
+            batch, stop = self._take()
+            if batch:
+                self._process(batch)
+            if stop:
+                return
+
+    def _process(self, batch):
+        start = time.perf_counter()
+        with self._lock:
+            self._busy += 1
+        try:
+            forward = self.fn(batch) if self.batch_size > 1 else [self.fn(batch[0])]
+        except Exception as e:
+            forward = [False] * len(batch)
+            for job in batch:
+                self.on_error(job, e)
+        finally:
+            with self._lock:
+                self._busy -= 1
+                self._busy_seconds += time.perf_counter() - start
+                self._processed += len(batch)
+
+        for job, go_on in zip(batch, forward):
+            if go_on and self.next is not None:
+                self.next.queue.put(job)
+
+    def stop(self):
+        for _ in self._threads:
+            self.queue.put(None)
+
+    def stats(self):
+        with self._lock:
+            elapsed = time.perf_counter() - self._started_at if self._started_at else 0.0
+            return {
+                "workers": self.workers,
+                "queue_depth": self.queue.qsize(),
+                "queue_size": self.queue.maxsize,
+                "busy": self._busy,
+                "processed": self._processed,
+                "utilization": round(self._busy_seconds / (elapsed * self.workers), 4) if elapsed else 0.0,
+            }
+
+
+class InvoicePipeline:
+    """
+    InvoiceProcessor'ın tespit/kırpma/OCR adımlarını aşamalı hatta çalıştırır.
+
+    process() process_image ile aynı formatta sonuç döndürür; InvoiceProcessor.pipeline
+    ayarlandığında process_image_bytes bu hattı kullanır. Thread'ler ilk kullanımda
+    başlatılır (fork edilen worker süreçlerinde her süreç kendi hattını açar).
+
+    Args:
+        processor: Modelleri ve yardımcı adımları sağlayan InvoiceProcessor
+        workers: {aşama: worker_sayısı}; verilmeyen aşamalar 1 worker ile çalışır
+        queue_size: Her aşamanın giriş kuyruğu kapasitesi
+    """
+
+    def __init__(self, processor, workers=None, queue_size=16):
+        self.processor = processor
+        workers = dict(workers or {})
+        fns = {
+            "decode": self._decode,
+            "detect": self._detect,
+            "crop": self._crop,
+            "rectify": self._rectify,
+            "ocr": self._ocr,
+            "serialize": self._serialize,
+        }
+        self.stages = [Stage(name, fns[name], workers.get(name, 1), queue_size,
+                             batch_size=processor.DETECT_BATCH_SIZE if name == "detect" else 1)
+                       for name in STAGES]
+        for stage, next_stage in zip(self.stages, self.stages[1:]):
+            stage.next = next_stage
+        for stage in self.stages:
+            stage.on_error = self._fail
+        self._lock = threading.Lock()
+        self._started = False
+
+    def start(self):
+        with self._lock:
+            if not self._started:
+                for stage in self.stages:
+                    stage.start()
+                self._started = True
+
+    def process(self, image_bytes, filename, budget=None):
+        """Görüntüyü hatta gönder ve sonucu bekle (ilk kuyruk doluysa yer açılana kadar bekler)"""
+        self.start()
+        job = _Job(image_bytes, filename, budget)
+        self.stages[0].queue.put(job)
+        return job.future.result()
+
+    def stats(self):
+        return {stage.name: stage.stats() for stage in self.stages}
+
+    def shutdown(self):
+        for stage in self.stages:
+            stage.stop()
+
+    def _finish(self, job, result):
+        self.processor._cleanup_request_dir(job.request_dir)
+        job.future.set_result(result)
+
+    def _fail(self, job, error):
+        logger.error(f"Pipeline job {job.process_id} failed: {str(error)}")
+        self.processor._cleanup_request_dir(job.request_dir)
+        if not job.future.done():
+            job.future.set_exception(error)
+
+    def _stopped(self, job):
+        """İş kuyrukta beklerken iptal edildiyse veya süresi dolduysa hattan çıkar"""
+        reason = job.budget.stop_reason() if job.budget is not None else None
+        if reason is None:
+            return False
+        self._finish(job, self.processor._stopped_result(job.process_id, job.timestamp, job.filename, reason))
+        return True
+
+    def _decode(self, job):
+        job.timestamp = int(time.time())
+        job.process_id = self.processor._new_process_id(job.timestamp)
+        if self._stopped(job):
+            return False
+        start = time.perf_counter()
+        job.image = self.processor.decode_image_bytes(job.image_bytes)
+        job.image_bytes = None
+        if job.image is None:
+            # Hattın dışındaki yolla aynı sonuç: hata sözlüğü döner, istisna fırlatılmaz
+            self._finish(job, self.processor._invalid_image_result(job.filename, job.timestamp, job.process_id))
+            return False
+        job.request_dir = self.processor._make_request_dir(job.process_id)
+        job.mark("decode_ms", start)
+        return True
+
+    def _detect(self, jobs):
+        active = [job for job in jobs if not self._stopped(job)]
+        if active:
+            start = time.perf_counter()
+            for job, (orig, boxes) in zip(active, self.processor._detect([job.image for job in active])):
+                job.image, job.boxes = orig, boxes
+                job.mark("detection_ms", start)
+        return [not job.future.done() for job in jobs]
+
+    def _crop(self, job):
+        job.crops, job.invoice_count = self.processor._crops_from_detection(
+            job.image, job.boxes, job.filename, job.request_dir)
+        if not job.crops:
+            job.mark("total_ms", job.start)
+            self._finish(job, self.processor._summarize([], 0, job.process_id, job.timestamp,
+                                                        job.filename, job.timings))
+            return False
+        return True
+
+    def _rectify(self, job):
+        start = time.perf_counter()
+        job.crops, job.rectifications = self.processor.rectify_crops(job.crops)
+        if self.processor.rectify:
+            job.mark("rectify_ms", start)
+        return True
+
+    def _ocr(self, job):
+        start = time.perf_counter()
+        submitted = self.processor.submit_crops([crop for _, crop in job.crops], job.budget)
+        job.results = [self.processor._ocr_result_entry(name, future, match, rectification)
+                       for (name, _), (future, match), rectification
+                       in zip(job.crops, submitted, job.rectifications)]
+        job.mark("ocr_ms", start)
+        return True
+
+    def _serialize(self, job):
+        job.mark("total_ms", job.start)
+        self._finish(job, self.processor._summarize(job.results, job.invoice_count, job.process_id,
+                                                    job.timestamp, job.filename, job.timings))
+        return False
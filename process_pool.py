@@ -0,0 +1,372 @@
+"""
+Çok süreçli (pre-fork) inference worker havuzu.
+
+Modeller ana süreçte bir kez yüklenir, ardından worker süreçleri fork ile
+oluşturulur; ağırlık tensörleri copy-on-write ile paylaşılır (model.safetensors
+mmap ile okunsa da tensörler modül parametrelerine kopyalanır, yani paylaşılan
+sayfalar dosya değil fork öncesi ana süreç belleğidir). Her worker kendi
+torch thread sayısıyla çalışır ve istenirse ayrı bir CPU çekirdek grubuna
+sabitlenir. Görüntü byte'ları worker'lara pickle edilmeden, istek başına açılan
+bir shared memory bloğu üzerinden aktarılır; bloğun ilk byte'ı isteğin iptal
+bayrağıdır.
+
+Notlar:
+    - Ana süreç fork'tan önce model çalıştırmaz (OpenMP thread havuzu fork'tan
+      sonra çocuk süreçte kilitlenebilir); warmup her worker'da ayrı yapılır.
+    - ONNX Runtime / OpenVINO oturumları fork'a dayanıklı olmadığından
+      DONUT_BACKEND=onnx ve dışa aktarılmış YOLO dedektörü worker'larda ayrı yüklenir.
+"""
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from multiprocessing import resource_tracker, shared_memory
+
+import donut_ocr
+from docgeonet_correct import get_rectifier
+from donut_ocr import DecodeBudget
+from invoice_processor import InvoiceProcessor
+from yolo_onnx import is_exported_model
+
+logger = logging.getLogger("process_pool")
+
+# Worker'ların çalıştırabildiği işler: (processor, byte_buffer_listesi, *args, budget=...)
+TASKS = {
+    "bytes": lambda p, buffers, filename, budget: p._process_bytes_uncached(buffers[0], filename, budget),
+    "batch": lambda p, buffers, names, budget: p.process_image_batch(list(zip(names, buffers)), budget),
+    "stream": lambda p, buffers, filename, budget: p.process_image_stream(buffers[0], filename, budget),
+}
+
+
+class _SharedFlagBudget(DecodeBudget):
+    """İptal bayrağı ana süreçle paylaşılan shared memory bloğunun ilk byte'ında tutulan bütçe"""
+
+    def __init__(self, shm, max_new_tokens, deadline):
+        super().__init__(max_new_tokens=max_new_tokens or 0, timeout_s=0)
+        self.deadline = deadline
+        self._shm = shm
+
+    def cancel(self):
+        buf = self._shm.buf
+        if buf is not None:
+            buf[0] = 1
+
+    @property
+    def cancelled(self):
+        buf = self._shm.buf
+        return buf is not None and buf[0] != 0
+
+
+class _Task:
+    """Ana süreçte bekleyen bir işin durumu; shared memory bloğu iş bitince silinir"""
+
+    def __init__(self, shm, stream=False):
+        self.shm = shm
+        self.future = None if stream else Future()
+        self.events = queue.Queue() if stream else None
+        self.worker = None
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def cancel(self):
+        with self._lock:
+            if not self._closed:
+                self.shm.buf[0] = 1
+
+    def close(self):
+        with self._lock:
+            if not self._closed:
+                self._closed = True
+                self.shm.close()
+                self.shm.unlink()
+
+
+def _cpu_lanes(workers, threads):
+    """Her worker için sabitlenecek CPU kümeleri (çekirdekler yetmezse başa sarar)"""
+    cpus = sorted(os.sched_getaffinity(0))
+    return [set(cpus[(i * threads + j) % len(cpus)] for j in range(threads)) for i in range(workers)]
+
+
+class WorkerPool:
+    """
+    InvoiceProcessor işlerini fork edilmiş worker süreçlerinde çalıştıran havuz.
+
+    Args:
+        processor: Worker'larda kullanılacak InvoiceProcessor (result_cache'siz; önbellek ana süreçte tutulur)
+        workers: Worker süreç sayısı
+        torch_threads: Worker başına torch intra-op thread sayısı (varsayılan: çekirdek sayısı / workers)
+        pin_cpus: True ise her worker ayrı bir çekirdek grubuna sabitlenir
+        concurrency: Worker başına aynı anda çalışan iş sayısı; 1'den büyükse aynı worker'daki
+            işlerin crop'ları Donut batcher'ında birlikte batch'lenebilir
+    """
+
+    def __init__(self, processor, workers=2, torch_threads=None, pin_cpus=False, concurrency=1):
+        self.processor = processor
+        self.workers = max(1, int(workers))
+        cpu_count = len(os.sched_getaffinity(0))
+        self.torch_threads = max(1, int(torch_threads or cpu_count // self.workers))
+        self.pin_cpus = pin_cpus
+        self.concurrency = max(1, int(concurrency))
+        self._ctx = multiprocessing.get_context("fork")
+        self._task_queue = None
+        self._result_queue = None
+        self._processes = []
+        self._tasks = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._started = False
+        self._ready = {}
+        self._ready_event = threading.Event()
+        self._collector = None
+
+    def start(self):
+        """Modelleri ana süreçte yükle, worker'ları fork et ve hepsi ısınana kadar bekle"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+
+        import torch
+        # Ana süreç yükleme sırasında OpenMP havuzu açmasın; worker'lar kendi sayılarını ayarlar
+        torch.set_num_threads(1)
+        start = time.perf_counter()
+        if donut_ocr.BACKEND == "torch":
+            donut_ocr.get_processor()
+            donut_ocr.get_model()
+        if not is_exported_model(self.processor.YOLO_MODEL_PATH):
+            self.processor.detector
+        if self.processor.rectify:
+            get_rectifier()
+        logger.info(f"Models loaded in parent in {time.perf_counter() - start:.1f} s, forking {self.workers} workers")
+
+        self._task_queue = self._ctx.Queue()
+        self._result_queue = self._ctx.Queue()
+        lanes = _cpu_lanes(self.workers, self.torch_threads) if self.pin_cpus else [None] * self.workers
+        for idx in range(self.workers):
+            process = self._ctx.Process(target=self._worker_main, args=(idx, lanes[idx]),
+                                        name=f"inference-worker-{idx}", daemon=True)
+            process.start()
+            self._processes.append(process)
+
+        self._collector = threading.Thread(target=self._collect, name="worker-pool-collector", daemon=True)
+        self._collector.start()
+        self._ready_event.wait()
+        failed = {idx: info for idx, info in self._ready.items() if info is not True}
+        if failed:
+            raise RuntimeError(f"Worker başlatılamadı: {failed}")
+        logger.info(f"{self.workers} workers ready ({self.torch_threads} torch threads each, "
+                     f"pinned={self.pin_cpus})")
+
+    def _worker_main(self, idx, cpus):
+        """Worker süreci: thread/CPU ayarları, warmup ve iş döngüsü"""
+        try:
+            import torch
+            if cpus:
+                os.sched_setaffinity(0, cpus)
+            torch.set_num_threads(self.torch_threads)
+            self.processor.warmup()
+            self._result_queue.put((None, "ready", idx))
+        except Exception:
+            self._result_queue.put((None, "failed", (idx, traceback.format_exc())))
+            return
+
+        threads = [threading.Thread(target=self._worker_loop, args=(idx,), daemon=True)
+                   for _ in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def _worker_loop(self, idx):
+        while True:
+            item = self._task_queue.get()
+            if item is None:
+                return
+            task_id, kind, shm_name, sizes, args, max_new_tokens, deadline = item
+            self._result_queue.put((task_id, "started", idx))
+            shm = shared_memory.SharedMemory(name=shm_name)
+            # Bloğun sahibi ana süreç; worker'ın resource tracker'ı onu ikinci kez silmeye çalışmasın
+            resource_tracker.unregister(shm._name, "shared_memory")
+            try:
+                buffers, offset = [], 1
+                for size in sizes:
+                    buffers.append(bytes(shm.buf[offset:offset + size]))
+                    offset += size
+                budget = _SharedFlagBudget(shm, max_new_tokens, deadline)
+                output = TASKS[kind](self.processor, buffers, *args, budget)
+                if kind == "stream":
+                    for event in output:
+                        self._result_queue.put((task_id, "event", event))
+                    self._result_queue.put((task_id, "done", None))
+                else:
+                    self._result_queue.put((task_id, "result", output))
+            except Exception:
+                self._result_queue.put((task_id, "error", traceback.format_exc()))
+            finally:
+                shm.close()
+
+    def _collect(self):
+        """Ana süreçte worker mesajlarını ilgili Future / olay kuyruğuna dağıt"""
+        while True:
+            try:
+                task_id, status, payload = self._result_queue.get(timeout=1.0)
+            except queue.Empty:
+                self._fail_dead_workers()
+                continue
+
+            if task_id is None:
+                idx, info = (payload, True) if status == "ready" else payload
+                self._ready[idx] = info
+                if len(self._ready) == self.workers:
+                    self._ready_event.set()
+                continue
+
+            task = self._tasks.get(task_id)
+            if task is None:
+                continue
+            if status == "started":
+                task.worker = payload
+            elif status == "event":
+                task.events.put(payload)
+            else:
+                self._finish(task_id, status, payload)
+
+    def _finish(self, task_id, status, payload):
+        task = self._tasks.pop(task_id, None)
+        if task is None:
+            return
+        task.close()
+        error = RuntimeError(f"Worker hatası: {payload}") if status == "error" else None
+        if task.events is not None:
+            task.events.put(error)
+            task.events.put(None)
+        elif error is not None:
+            task.future.set_exception(error)
+        else:
+            task.future.set_result(payload)
+
+    def _fail_dead_workers(self):
+        dead = {idx for idx, p in enumerate(self._processes) if not p.is_alive()}
+        if not dead:
+            return
+        if len(self._ready) < self.workers:
+            for idx in dead:
+                self._ready.setdefault(idx, "worker süreci başlatılırken sonlandı")
+            if len(self._ready) == self.workers:
+                self._ready_event.set()
+        # Worker'lar yeniden fork edilmez (ana süreç artık thread'li ve modeller çalışmış durumda);
+        # hiç canlı worker kalmadıysa kuyrukta bekleyen işler de hemen hata ile bitirilir
+        no_workers_left = len(dead) == len(self._processes)
+        for task_id, task in list(self._tasks.items()):
+            if task.worker in dead:
+                logger.error(f"Worker {task.worker} died while running task {task_id}")
+                self._finish(task_id, "error", f"worker {task.worker} beklenmedik şekilde sonlandı")
+            elif no_workers_left:
+                logger.error(f"No live workers left, failing queued task {task_id}")
+                self._finish(task_id, "error", "çalışan worker süreci kalmadı")
+
+    def _submit(self, kind, buffers, args, budget, stream=False):
+        self.start()
+        if not any(p.is_alive() for p in self._processes):
+            raise RuntimeError("Worker hatası: çalışan worker süreci kalmadı")
+        shm = shared_memory.SharedMemory(create=True, size=1 + sum(len(b) for b in buffers))
+        shm.buf[0] = 0
+        offset = 1
+        for buffer in buffers:
+            shm.buf[offset:offset + len(buffer)] = buffer
+            offset += len(buffer)
+        task = _Task(shm, stream=stream)
+        task_id = next(self._ids)
+        self._tasks[task_id] = task
+        self._task_queue.put((task_id, kind, shm.name, [len(b) for b in buffers], args,
+                              budget.max_new_tokens if budget is not None else None,
+                              budget.deadline if budget is not None else None))
+        return task
+
+    def call(self, kind, buffers, *args, budget=None):
+        """İşi bir worker'da çalıştır ve sonucunu bekle; budget iptal edilirse worker'a iletilir"""
+        task = self._submit(kind, buffers, args, budget)
+        while True:
+            try:
+                return task.future.result(timeout=0.1)
+            except FutureTimeoutError:
+                if budget is not None and budget.cancelled:
+                    task.cancel()
+
+    def stream(self, kind, buffers, *args, budget=None):
+        """Worker'ın ürettiği olayları geldikçe yield et; tüketici erken ayrılırsa iş iptal edilir"""
+        task = self._submit(kind, buffers, args, budget, stream=True)
+        finished = False
+        try:
+            while True:
+                try:
+                    event = task.events.get(timeout=0.1)
+                except queue.Empty:
+                    if budget is not None and budget.cancelled:
+                        task.cancel()
+                    continue
+                if event is None:
+                    finished = True
+                    return
+                if isinstance(event, Exception):
+                    raise event
+                yield event
+        finally:
+            if not finished:
+                task.cancel()
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "alive": sum(1 for p in self._processes if p.is_alive()),
+            "torch_threads": self.torch_threads,
+            "pinned": self.pin_cpus,
+            "in_flight": len(self._tasks),
+        }
+
+    def shutdown(self, timeout=10):
+        """Worker'lara durma mesajı gönder ve kapanmalarını bekle"""
+        if not self._processes:
+            return
+        for _ in range(self.workers * self.concurrency):
+            self._task_queue.put(None)
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+
+
+class ProcessPoolInvoiceProcessor(InvoiceProcessor):
+    """
+    İşleri WorkerPool üzerinden çalıştıran InvoiceProcessor.
+
+    Önbellek kontrolü, base64 decode ve doğrulama ana süreçte yapılır; yalnızca
+    tespit + OCR gerektiren kısım worker'lara gönderilir.
+    """
+
+    def __init__(self, pool, **kwargs):
+        super().__init__(**kwargs)
+        self.pool = pool
+
+    def warmup(self):
+        self.pool.start()
+
+    def process_image(self, image_path, budget=None):
+        with open(image_path, "rb") as f:
+            image_bytes = f.read()
+        return self._process_bytes_uncached(image_bytes, os.path.basename(image_path), budget)
+
+    def _process_bytes_uncached(self, image_bytes, filename, budget=None):
+        return self.pool.call("bytes", [image_bytes], filename, budget=budget)
+
+    def process_image_stream(self, image_bytes, filename=None, budget=None):
+        yield from self.pool.stream("stream", [image_bytes], filename, budget=budget)
+
+    def process_image_batch(self, files, budget=None):
+        names = [name for name, _ in files]
+        return self.pool.call("batch", [data for _, data in files], names, budget=budget)
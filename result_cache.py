@@ -0,0 +1,159 @@
+"""
+Görüntü içeriğine göre anahtarlanan sonuç önbelleği.
+
+Anahtar, görüntü byte'larının ve model/eşik sürüm bilgisinin SHA-256 özetidir;
+model ya da eşik değiştiğinde eski sonuçlar kendiliğinden geçersiz olur.
+Bellekte LRU + TTL ile tutulur, istenirse diskte ikinci bir katman kullanılır.
+Aynı anahtar için eşzamanlı gelen istekler tek bir hesaplamayı paylaşır (single-flight).
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+logger = logging.getLogger("result_cache")
+
+
+class ResultCache:
+    def __init__(self, max_entries=1024, ttl_seconds=3600, disk_dir=None):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_seconds = ttl_seconds
+        self.disk_dir = disk_dir
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+        self._entries = OrderedDict()  # key -> (stored_at, result)
+        self._inflight = {}  # key -> Future
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "disk_hits": 0, "misses": 0, "coalesced": 0, "evictions": 0}
+
+    @staticmethod
+    def make_key(data, version):
+        """Görüntü byte'ları ve sürüm metninden önbellek anahtarı üret"""
+        digest = hashlib.sha256()
+        digest.update(version.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(data)
+        return digest.hexdigest()
+
+    def get_or_compute(self, key, compute, should_store=None):
+        """
+        Anahtarın sonucunu önbellekten döndür, yoksa compute() ile hesapla.
+        Aynı anahtar için hesaplama sürüyorsa yeni çağıran onun sonucunu bekler.
+
+        Args:
+            key: make_key ile üretilmiş anahtar
+            compute: Sonucu üreten argümansız fonksiyon
+            should_store: Sonucun saklanıp saklanmayacağına karar veren fonksiyon (ör. hata sonuçlarını saklamamak için)
+
+        Returns:
+            (sonuç, kaynak) çifti; kaynak "memory", "disk", "coalesced" veya "miss"
+        """
+        with self._lock:
+            result = self._get_memory(key)
+            if result is not None:
+                self._stats["hits"] += 1
+                return result, "memory"
+            future = self._inflight.get(key)
+            if future is not None:
+                self._stats["coalesced"] += 1
+                leader = False
+            else:
+                future = Future()
+                self._inflight[key] = future
+                leader = True
+
+        if not leader:
+            return future.result(), "coalesced"
+
+        try:
+            result = self._get_disk(key)
+            if result is not None:
+                source = "disk"
+                with self._lock:
+                    self._stats["disk_hits"] += 1
+                    self._put_memory(key, result)
+            else:
+                source = "miss"
+                with self._lock:
+                    self._stats["misses"] += 1
+                result = compute()
+                if should_store is None or should_store(result):
+                    with self._lock:
+                        self._put_memory(key, result)
+                    self._put_disk(key, result)
+            future.set_result(result)
+            return result, source
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def stats(self):
+        """Önbellek sayaçlarını döndür"""
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["disk_hits"] + self._stats["misses"] + self._stats["coalesced"]
+            hit_count = lookups - self._stats["misses"]
+            return {
+                **self._stats,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "inflight": len(self._inflight),
+                "hit_ratio": round(hit_count / lookups, 4) if lookups else 0.0,
+            }
+
+    def _get_memory(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stored_at, result = entry
+        if time.time() - stored_at > self.ttl_seconds:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return result
+
+    def _put_memory(self, key, result):
+        self._entries[key] = (time.time(), result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _get_disk(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl_seconds:
+                os.remove(path)
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Disk cache read failed for {key}: {str(e)}")
+            return None
+
+    def _put_disk(self, key, result):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(result, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f"Disk cache write failed for {key}: {str(e)}")
@@ -2,6 +2,7 @@ import os
 import sys
 import json
 import base64
+import time
 import requests
 from pathlib import Path
 
@@ -72,6 +73,87 @@ def test_base64_processing():
 
     return result
 
+def test_raw_processing():
+    """Test processing raw image bytes sent as the request body"""
+    test_images_dir = "test_images"
+    test_image = next(Path(test_images_dir).glob("*.[jp][pn]g"), None)
+    if not test_image:
+        print(f"Uyarı: Test görüntüsü bulunamadı: {test_images_dir}")
+        return
+
+    print(f"Ham yükleme test görüntüsü: {test_image}")
+    with open(test_image, "rb") as img_file:
+        response = requests.post(f"{API_URL}/api/process-raw", params={"filename": test_image.name},
+                                 data=img_file, headers={"Content-Type": "application/octet-stream"})
+
+    if response.status_code != 200:
+        print(f"API Hatası: {response.status_code} - {response.text}")
+        return None
+
+    result = response.json()
+
+    print("\n--- Ham Yükleme İşleme Sonucu ---")
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+    return result
+
+def test_batch_processing():
+    """Test processing several image files in one request"""
+    test_images_dir = "test_images"
+    test_images = sorted(Path(test_images_dir).glob("*.[jp][pn]g"))[:4]
+    if not test_images:
+        print(f"Uyarı: Test görüntüsü bulunamadı: {test_images_dir}")
+        return
+
+    print(f"Toplu test görüntüleri: {[p.name for p in test_images]}")
+    handles = [open(p, "rb") for p in test_images]
+    try:
+        files = [("files", (p.name, f, "image/jpeg")) for p, f in zip(test_images, handles)]
+        response = requests.post(f"{API_URL}/api/process-batch", files=files)
+    finally:
+        for f in handles:
+            f.close()
+
+    if response.status_code != 200:
+        print(f"API Hatası: {response.status_code} - {response.text}")
+        return None
+
+    result = response.json()
+
+    print("\n--- Toplu İşleme Sonucu ---")
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+    return result
+
+def test_job_processing():
+    """Test submitting an image as an asynchronous job and polling its result"""
+    test_images_dir = "test_images"
+    test_image = next(Path(test_images_dir).glob("*.[jp][pn]g"), None)
+    if not test_image:
+        print(f"Uyarı: Test görüntüsü bulunamadı: {test_images_dir}")
+        return
+
+    print(f"İş (job) test görüntüsü: {test_image}")
+    with open(test_image, "rb") as img_file:
+        files = {"file": (test_image.name, img_file, "image/jpeg")}
+        response = requests.post(f"{API_URL}/api/jobs", files=files)
+
+    if response.status_code != 202:
+        print(f"API Hatası: {response.status_code} - {response.text}")
+        return None
+
+    job_id = response.json()["job_id"]
+    for _ in range(120):
+        job = requests.get(f"{API_URL}/api/jobs/{job_id}").json()
+        if job["status"] in ("done", "failed"):
+            break
+        time.sleep(1)
+
+    print("\n--- İş (Job) Sonucu ---")
+    print(json.dumps(job, ensure_ascii=False, indent=2))
+
+    return job
+
 def test_health_check():
     """Test the health check endpoint"""
     print("\n--- Sağlık Kontrolü ---")
@@ -85,6 +167,22 @@ def test_health_check():
     print(json.dumps(result, ensure_ascii=False, indent=2))
     return True
 
+def wait_until_ready(timeout=600):
+    """Wait for /ready to return 200 (models loaded and warmed up)"""
+    print("\n--- Hazırlık Kontrolü ---")
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        response = requests.get(f"{API_URL}/ready")
+        if response.status_code == 200:
+            print(json.dumps(response.json(), ensure_ascii=False, indent=2))
+            return True
+        if response.json().get("status") == "failed":
+            print(f"Warmup başarısız: {response.text}")
+            return False
+        time.sleep(2)
+    print("Modeller zaman aşımı içinde hazır olmadı")
+    return False
+
 def main():
     """Run all tests"""
     print("=== Fatura İşleme API Testi ===")
@@ -99,12 +197,24 @@ def main():
         print(f"API'ye bağlanılamıyor. Lütfen API'nin {API_URL} adresinde çalıştığından emin olun.")
         return
 
+    if not wait_until_ready():
+        return
+
     # Dosya işleme testi
     file_result = test_file_processing()
 
     # Base64 işleme testi
     base64_result = test_base64_processing()
 
+    # Ham yükleme testi
+    test_raw_processing()
+
+    # Toplu işleme testi
+    test_batch_processing()
+
+    # Asenkron iş testi
+    test_job_processing()
+
     # Sonuçları karşılaştır
     if file_result and base64_result:
         print("\n--- Karşılaştırma ---")
@@ -132,7 +132,3 @@ def disable_weights_only_loading():
     except Exception as e:
         logger.error(f"Failed to disable weights_only loading: {str(e)}")
         return False
-
-# Otomatik olarak import edildiğinde globals'leri kaydet
-if __name__ != "__main__":
-    register_safe_globals()
\ No newline at end of file
@@ -2,10 +2,12 @@ import os
 import cv2
 import logging
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from ultralytics import YOLO
-from donut_ocr import img2json
+from PIL import Image
+from donut_ocr import img2json_batch, MAX_BATCH_SIZE
 from docgeonet_correct import correct_with_docgeonet
+from model_registry import registry
 
 # Import the centralized safe globals module
 from torch_safe_globals import register_safe_globals
@@ -26,48 +28,99 @@ REC_DIR = "rectified"  # DocGeoNet'ten çıkan düzeltmeler
 DOCGEONET_DIR = "DocGeoNet"
 CONF_THRESHOLD = 0.20
 IMGSZ = 640
+DETECT_BATCH_SIZE = int(os.environ.get("DETECT_BATCH_SIZE", "8"))
 # --------------------------------------
 
-# Register safe globals before loading any models
-# This is automatically done when importing the module, but we call it again to be sure
-register_safe_globals()
-logger.info("PyTorch safe globals registered")
 
-# Klasörleri oluştur
-os.makedirs(CROP_DIR, exist_ok=True)
-os.makedirs(REC_DIR, exist_ok=True)
+def _load_yolo():
+    # Register safe globals before loading the YOLO model
+    register_safe_globals()
+    from ultralytics import YOLO
+    try:
+        model = YOLO(YOLO_MODEL_PATH)
+        logger.info(f"YOLOv8 loaded: {YOLO_MODEL_PATH} | Device: {model.device.type}")
+        return model
+    except Exception as e:
+        logger.error(f"Failed to load YOLO model: {str(e)}")
+        logger.error(traceback.format_exc())
+        raise
 
-# YOLOv8 modeli yükle
-try:
-    yolo_model = YOLO(YOLO_MODEL_PATH)
-    device = 'cuda' if yolo_model.device.type == 'cuda' else 'cpu'
-    logger.info(f"YOLOv8 loaded: {YOLO_MODEL_PATH} | Device: {device}")
-except Exception as e:
-    logger.error(f"Failed to load YOLO model: {str(e)}")
-    logger.error(traceback.format_exc())
-    raise
+
+def get_yolo_model():
+    """YOLOv8 modelini ilk kullanımda yükle (import sırasında model yüklenmez)"""
+    name = f"yolo:{os.path.abspath(YOLO_MODEL_PATH)}"
+    registry.register(name, _load_yolo)
+    return registry.get(name)
 
 
 def clamp(v, lo, hi): return max(lo, min(v, hi))
 
 
+def _read_images(img_paths):
+    """Görüntüleri BGR dizilere decode et (okunamayanlar None olur)"""
+    return [cv2.imread(str(p)) for p in img_paths]
+
+
+def _save_crops(img_path, orig, boxes, crop_dir):
+    H, W = orig.shape[:2]
+    crop_paths = []
+    for idx, b in enumerate(boxes):
+        x1, y1, x2, y2 = [clamp(x, 0, W - 1 if i % 2 == 0 else H - 1) for i, x in enumerate([b[0], b[1], b[2], b[3]])]
+        crop = orig[y1:y2, x1:x2]
+        cpath = Path(crop_dir) / f"crop_{Path(img_path).stem}_{idx:02d}.jpg"
+        cv2.imwrite(str(cpath), crop)
+        crop_paths.append(str(cpath))
+        logger.debug(f"Cropped invoice {idx+1}/{len(boxes)} saved to {cpath}")
+    return crop_paths
+
+
+def crop_invoices_from_imgs(img_paths, crop_dir, conf_th=0.20, imgsz=640, batch_size=DETECT_BATCH_SIZE):
+    """
+    Görüntüleri batch_size'lık gruplar halinde tek predict çağrısıyla tespit et ve kırp.
+    Bir grup dedektörde çalışırken sonraki grup arka plan thread'inde decode edilir.
+
+    Returns:
+        Her görüntü için kırpılmış dosya yollarının listesi (hata olan görüntüler için boş liste)
+    """
+    img_paths = [str(p) for p in img_paths]
+    batch_size = max(1, int(batch_size))
+    chunks = [img_paths[i:i + batch_size] for i in range(0, len(img_paths), batch_size)]
+    outputs = []
+    if not chunks:
+        return outputs
+
+    yolo_model = get_yolo_model()
+    device = 'cuda' if yolo_model.device.type == 'cuda' else 'cpu'
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="detect-prefetch") as prefetch:
+        pending = prefetch.submit(_read_images, chunks[0])
+        for i, chunk in enumerate(chunks):
+            arrays = pending.result()
+            if i + 1 < len(chunks):
+                pending = prefetch.submit(_read_images, chunks[i + 1])
+
+            readable = [(path, arr) for path, arr in zip(chunk, arrays) if arr is not None]
+            crops = {path: [] for path in chunk}
+            for path, arr in zip(chunk, arrays):
+                if arr is None:
+                    logger.error(f"Error cropping invoices from {path}: image could not be read")
+            try:
+                if readable:
+                    results = yolo_model.predict([arr for _, arr in readable], conf=conf_th, imgsz=imgsz,
+                                                 device=device, save=False, verbose=False)
+                    for (path, orig), result in zip(readable, results):
+                        boxes = result.boxes.xyxy.cpu().numpy().astype(int)
+                        logger.info(f"{Path(path).name} - {len(boxes)} invoices found")
+                        crops[path] = _save_crops(path, orig, boxes, crop_dir)
+            except Exception as e:
+                logger.error(f"Error cropping invoices from {chunk}: {str(e)}")
+                logger.error(traceback.format_exc())
+            outputs.extend(crops[path] for path in chunk)
+    return outputs
+
+
 def crop_invoices_from_img(img_path, crop_dir, conf_th=0.20, imgsz=640):
     try:
-        results = yolo_model.predict(img_path, conf=conf_th, imgsz=imgsz, device=device, save=False, verbose=False)[0]
-        n = len(results.boxes)
-        logger.info(f"{Path(img_path).name} - {n} invoices found")
-        orig = results.orig_img.copy()
-        H, W = orig.shape[:2]
-        crop_paths = []
-
-        for idx, b in enumerate(results.boxes.xyxy.cpu().numpy().astype(int)):
-            x1, y1, x2, y2 = [clamp(x, 0, W - 1 if i % 2 == 0 else H - 1) for i, x in enumerate([b[0], b[1], b[2], b[3]])]
-            crop = orig[y1:y2, x1:x2]
-            cpath = Path(crop_dir) / f"crop_{Path(img_path).stem}_{idx:02d}.jpg"
-            cv2.imwrite(str(cpath), crop)
-            crop_paths.append(str(cpath))
-            logger.debug(f"Cropped invoice {idx+1}/{n} saved to {cpath}")
-        return crop_paths
+        return crop_invoices_from_imgs([img_path], crop_dir, conf_th, imgsz)[0]
     except Exception as e:
         logger.error(f"Error cropping invoices from {img_path}: {str(e)}")
         logger.error(traceback.format_exc())
@@ -77,14 +130,16 @@ def crop_invoices_from_img(img_path, crop_dir, conf_th=0.20, imgsz=640):
 def main():
     try:
         logger.info("Starting invoice processing")
+        # Klasörleri oluştur
+        os.makedirs(CROP_DIR, exist_ok=True)
+        os.makedirs(REC_DIR, exist_ok=True)
         img_files = sorted(
             [str(p) for p in Path(TEST_IMAGES_DIR).glob("*") if p.suffix.lower() in (".jpg", ".jpeg", ".png")])
         logger.info(f"Found {len(img_files)} image files to process")
 
         all_jsons = []
-        for img_path in img_files:
-            logger.info(f"Processing image: {img_path}")
-            crop_paths = crop_invoices_from_img(img_path, CROP_DIR, CONF_THRESHOLD, IMGSZ)
+        crops_per_image = crop_invoices_from_imgs(img_files, CROP_DIR, CONF_THRESHOLD, IMGSZ)
+        for img_path, crop_paths in zip(img_files, crops_per_image):
             logger.info(f"Created {len(crop_paths)} crops from {img_path}")
 
         # Tüm kırpmalar bitince topluca düzeltme yapıyoruz
@@ -95,18 +150,23 @@ def main():
         success_count = 0
         error_count = 0
 
-        for rec_img_path in rectified_imgs:
-            logger.info(f"Starting OCR for: {rec_img_path}")
+        # Düzeltilmiş görüntüleri MAX_BATCH_SIZE'lık gruplar halinde tek generate çağrısıyla işle
+        for start in range(0, len(rectified_imgs), MAX_BATCH_SIZE):
+            batch_paths = rectified_imgs[start:start + MAX_BATCH_SIZE]
+            logger.info(f"Starting OCR for {len(batch_paths)} images: {batch_paths}")
             try:
-                ocr_result = img2json(rec_img_path)
-                logger.info(f"OCR successful for: {rec_img_path}")
-                logger.debug(f"JSON Output:\n{ocr_result}")
-                all_jsons.append((rec_img_path, ocr_result))
-                success_count += 1
+                outputs = img2json_batch([Image.open(p) for p in batch_paths])
             except Exception as e:
-                logger.error(f"OCR error for {rec_img_path}: {str(e)}")
+                logger.error(f"OCR error for {batch_paths}: {str(e)}")
                 logger.error(traceback.format_exc())
-                error_count += 1
+                error_count += len(batch_paths)
+                continue
+
+            for rec_img_path, output in zip(batch_paths, outputs):
+                logger.info(f"OCR successful for: {rec_img_path} ({output['num_tokens']} tokens)")
+                logger.debug(f"JSON Output:\n{output['text']}")
+                all_jsons.append((rec_img_path, output["text"]))
+                success_count += 1
 
         logger.info(f"All processing completed. Total: {len(all_jsons)} invoices processed successfully, {error_count} errors.")
         return all_jsons
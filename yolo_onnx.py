@@ -0,0 +1,158 @@
+"""
+Dışa aktarılmış (ONNX veya OpenVINO IR) YOLOv8 fatura dedektörü.
+
+Ultralytics predictor'ı ve PyTorch eager yükü olmadan çalışır: letterbox ön
+işleme, model çağrısı ve NMS tamamen NumPy üzerinde yapılır. Çıktı formatı
+YOLOv8 export'u ile aynıdır: (B, 4 + sınıf_sayısı, aday_sayısı), kutular cx, cy, w, h.
+"""
+import logging
+import os
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger("yolo_onnx")
+
+# Ultralytics predict varsayılanları
+IOU_THRESHOLD = 0.7
+MAX_DETECTIONS = 300
+MAX_WH = 7680  # sınıf bazlı NMS için kutuları sınıfa göre kaydırma miktarı
+
+
+def is_exported_model(path):
+    """Yolun ONNX dosyası veya OpenVINO IR (.xml ya da *_openvino_model klasörü) olup olmadığı"""
+    path = str(path)
+    return path.endswith((".onnx", ".xml", "_openvino_model")) or path.endswith("_openvino_model/")
+
+
+def letterbox(image, new_shape=640, color=(114, 114, 114)):
+    """
+    Görüntüyü en-boy oranını koruyarak new_shape x new_shape tuvale ortalayarak yerleştir.
+
+    Returns:
+        (tuval, ölçek, (pad_x, pad_y))
+    """
+    h, w = image.shape[:2]
+    ratio = min(new_shape / h, new_shape / w)
+    new_w, new_h = int(round(w * ratio)), int(round(h * ratio))
+    pad_x, pad_y = (new_shape - new_w) / 2, (new_shape - new_h) / 2
+    if (w, h) != (new_w, new_h):
+        image = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    top, bottom = int(round(pad_y - 0.1)), int(round(pad_y + 0.1))
+    left, right = int(round(pad_x - 0.1)), int(round(pad_x + 0.1))
+    canvas = cv2.copyMakeBorder(image, top, bottom, left, right, cv2.BORDER_CONSTANT, value=color)
+    return canvas, ratio, (left, top)
+
+
+def nms(boxes, scores, iou_threshold):
+    """Vektörize greedy NMS; tutulan kutuların indekslerini skor sırasıyla döndürür"""
+    x1, y1, x2, y2 = boxes.T
+    areas = (x2 - x1).clip(0) * (y2 - y1).clip(0)
+    order = scores.argsort()[::-1]
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        w = (np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest])).clip(0)
+        h = (np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest])).clip(0)
+        inter = w * h
+        iou = inter / (areas[i] + areas[rest] - inter + 1e-9)
+        order = rest[iou <= iou_threshold]
+    return np.asarray(keep, dtype=np.int64)
+
+
+def postprocess(prediction, conf_threshold, iou_threshold=IOU_THRESHOLD, max_det=MAX_DETECTIONS):
+    """
+    Tek görüntünün (4 + nc, N) çıktısından (K, 6) [x1, y1, x2, y2, skor, sınıf] dizisi üret
+    (letterbox koordinatlarında).
+    """
+    prediction = prediction.T
+    class_scores = prediction[:, 4:]
+    classes = class_scores.argmax(axis=1)
+    scores = class_scores[np.arange(len(classes)), classes]
+    mask = scores > conf_threshold
+    if not mask.any():
+        return np.zeros((0, 6), dtype=np.float32)
+    cx, cy, w, h = prediction[mask, :4].T
+    boxes = np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+    scores, classes = scores[mask], classes[mask]
+    keep = nms(boxes + classes[:, None] * MAX_WH, scores, iou_threshold)[:max_det]
+    return np.concatenate([boxes[keep], scores[keep, None], classes[keep, None]], axis=1).astype(np.float32)
+
+
+class ExportedYoloDetector:
+    def __init__(self, model_path, imgsz=640, intra_op_threads=0):
+        self.model_path = str(model_path)
+        self.imgsz = imgsz
+        if self.model_path.endswith(".onnx"):
+            self._load_onnx(intra_op_threads)
+        else:
+            self._load_openvino()
+        logger.info(f"Exported YOLO detector loaded: {self.model_path}")
+
+    def _load_onnx(self, intra_op_threads):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise RuntimeError("ONNX dedektörü için onnxruntime kurulu olmalı: pip install onnxruntime") from e
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        session = ort.InferenceSession(self.model_path, options, providers=["CPUExecutionProvider"])
+        input_name = session.get_inputs()[0].name
+        # Statik export'ta batch boyutu 1'dir; bu durumda görüntüler tek tek çalıştırılır
+        batch_dim = session.get_inputs()[0].shape[0]
+        self._dynamic_batch = not isinstance(batch_dim, int)
+        # InferenceSession.run thread-safe olduğu için kilide gerek yok
+        self._run = lambda batch: session.run(None, {input_name: batch})[0]
+
+    def _load_openvino(self):
+        try:
+            from openvino.runtime import Core
+        except ImportError as e:
+            raise RuntimeError("OpenVINO dedektörü için openvino kurulu olmalı: pip install openvino") from e
+        xml_path = self.model_path
+        if os.path.isdir(xml_path):
+            xml_path = next(os.path.join(xml_path, f) for f in os.listdir(xml_path) if f.endswith(".xml"))
+        compiled = Core().compile_model(xml_path, "CPU")
+        output = compiled.output(0)
+        batch_dim = compiled.input(0).get_partial_shape()[0]
+        self._dynamic_batch = batch_dim.is_dynamic
+        # Her çağrı kendi infer request'ini kullanır; eşzamanlı çağrılar birbirini bozmaz
+        self._run = lambda batch: compiled.create_infer_request().infer({0: batch})[output]
+
+    def preprocess(self, images):
+        """BGR görüntüleri (B, 3, imgsz, imgsz) float32 girdiye çevir"""
+        tensors, metas = [], []
+        for image in images:
+            canvas, ratio, pad = letterbox(image, self.imgsz)
+            tensors.append(canvas[:, :, ::-1].transpose(2, 0, 1))
+            metas.append((ratio, pad, image.shape[:2]))
+        batch = np.ascontiguousarray(np.stack(tensors)).astype(np.float32) / 255.0
+        return batch, metas
+
+    def predict(self, images, conf=0.25, iou=IOU_THRESHOLD, prepared=None):
+        """
+        BGR NumPy görüntülerinde fatura tespiti yap.
+
+        Args:
+            prepared: Aynı görüntüler için önceden (ör. arka plan thread'inde) hesaplanmış preprocess çıktısı
+
+        Returns:
+            Her görüntü için orijinal koordinatlarda (K, 6) [x1, y1, x2, y2, skor, sınıf] dizisi
+        """
+        batch, metas = prepared if prepared is not None else self.preprocess(images)
+        if self._dynamic_batch:
+            predictions = self._run(batch)
+        else:
+            predictions = np.concatenate([self._run(batch[i:i + 1]) for i in range(len(batch))])
+
+        detections = []
+        for prediction, (ratio, (pad_x, pad_y), (h, w)) in zip(predictions, metas):
+            det = postprocess(prediction, conf, iou)
+            det[:, [0, 2]] = ((det[:, [0, 2]] - pad_x) / ratio).clip(0, w)
+            det[:, [1, 3]] = ((det[:, [1, 3]] - pad_y) / ratio).clip(0, h)
+            detections.append(det)
+        return detections